@@ -0,0 +1,50 @@
+"""
+ASGI config for backend project.
+
+It exposes the ASGI callable as a module-level variable named ``application``,
+run it with e.g. ``uvicorn backend.asgi:application``. The live readings stream
+and the hot sensor endpoints are served by async handlers, every other request
+goes to the django application on a thread, see sensor.async_views
+"""
+
+import os
+
+import django
+from asgiref.wsgi import WsgiToAsgi
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+django.setup()
+
+from django.core.wsgi import get_wsgi_application
+
+from sensor import async_views
+from sensor.models import SensorManager
+from sensor.stream import stream_readings
+
+django_application = WsgiToAsgi(get_wsgi_application())
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # async views read the hot cache without SensorManager.cached
+            SensorManager.ensure_hot_cache_listener()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] == 'http' and scope['path'] == '/sensor/stream/':
+        await stream_readings(scope, receive, send)
+        return
+    route = async_views.resolve(scope['path']) if scope['type'] == 'http' else None
+    if route is not None:
+        await async_views.dispatch(scope, send, *route)
+    else:
+        await django_application(scope, receive, send)
@@ -22,15 +22,11 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 
 app.conf.beat_schedule = {
-    'fetch-sensor-data-iddqd': {
-        'task': 'sensor.tasks.fetch_sensor_data',
+    'fetch-all-sensors': {
+        'task': 'sensor.tasks.fetch_all_sensors',
         'schedule': 1.0,
-        'args': ('iddqd',)
-    },
-    'fetch-sensor-data-abba5': {
-        'task': 'sensor.tasks.fetch_sensor_data',
-        'schedule': 1.0,
-        'args': ('abba5',)
+        # there is no point in polling late, next run is due anyway
+        'options': {'expires': 1.0}
     },
     'fetch_and_cache_weather': {
         'task': 'sensor.tasks.fetch_weather',
@@ -117,7 +117,34 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'iot_db.sqlite'),
-    }
+    },
+    # used by sensor queries which only read, see SensorManager.read_connection
+    'readonly': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'file:{}?mode=ro'.format(os.path.join(BASE_DIR, 'iot_db.sqlite')),
+        'TEST': {
+            'MIRROR': 'default',
+        },
+    },
+}
+
+# pragmas run on every new sqlite connection of a database alias, see sensor.db.
+# WAL lets readers run alongside the writer, synchronous=NORMAL is safe with WAL
+# and busy_timeout makes writers wait for the lock instead of failing
+SQLITE_PRAGMAS = {
+    'default': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        # negative cache size is in KiB
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -65536)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 1024 ** 3)),
+    },
+    'readonly': {
+        'busy_timeout': 5000,
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -65536)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 1024 ** 3)),
+    },
 }
 
 # Password validation
@@ -158,6 +185,51 @@ STATIC_URL = '/static/'
 
 CELERY_RESULT_BACKEND = 'django-db'
 
+# sensors polled by celery beat and served by the api,
+# comma separated SUPPORTED_SENSORS environment variable overrides them
+SUPPORTED_SENSORS = os.environ.get(
+    'SUPPORTED_SENSORS',
+    'abba5,abba,acdc,iddqd,idkfa'
+).split(',')
+
+# timeouts (seconds) and number of retries of requests to sensor and weather apis.
+# A request takes up to (connect + read) * (retries + 1) seconds plus backoff,
+# which has to stay below the 1s poll interval of fetch_all_sensors,
+# a failed poll is retried by the next one anyway
+EXTERNAL_API_CONNECT_TIMEOUT = float(os.environ.get('EXTERNAL_API_CONNECT_TIMEOUT', 0.25))
+EXTERNAL_API_READ_TIMEOUT = float(os.environ.get('EXTERNAL_API_READ_TIMEOUT', 0.5))
+EXTERNAL_API_RETRIES = int(os.environ.get('EXTERNAL_API_RETRIES', 0))
+
+# whole months of raw readings kept by drop_old_partitions command
+SENSOR_RETENTION_MONTHS = int(os.environ.get('SENSOR_RETENTION_MONTHS', 12))
+# whole months of readings kept as rows by compact_datas command, older ones are archived
+SENSOR_HOT_MONTHS = int(os.environ.get('SENSOR_HOT_MONTHS', 1))
+
+# seconds statistics are cached in memory of every web process, 0 disables the cache;
+# with SENSOR_HOT_CACHE_INVALIDATION=1 ingest publishes updated sensors over redis
+# pub/sub and cached values are dropped right away, so the ttl can be much longer
+SENSOR_HOT_CACHE_TTL = float(os.environ.get('SENSOR_HOT_CACHE_TTL', 1))
+SENSOR_HOT_CACHE_INVALIDATION = os.environ.get('SENSOR_HOT_CACHE_INVALIDATION') == '1'
+
+# max number of redis connections of every process serving backend.asgi
+ASYNC_REDIS_POOL_SIZE = int(os.environ.get('ASYNC_REDIS_POOL_SIZE', 32))
+
+# with SENSOR_FAST_PATH=1 backend.wsgi serves statistics and temperature differences
+# GET requests by plain django views behind SENSOR_FAST_PATH_MIDDLEWARE only, see sensor.fastpath
+SENSOR_FAST_PATH = os.environ.get('SENSOR_FAST_PATH') == '1'
+SENSOR_FAST_PATH_MIDDLEWARE = [
+    'corsheaders.middleware.CorsMiddleware',
+]
+
+# stages every batch of sensor readings goes through, see sensor.ingest
+SENSOR_INGEST_STAGES = [
+    'sensor.ingest.ReadingsStage',
+    'sensor.ingest.RollupsStage',
+    'sensor.ingest.StatisticsStage',
+    'sensor.ingest.PublishStage',
+    'sensor.ingest.AlertsStage',
+]
+
 CACHES = {
     'default': {
         'BACKEND': 'redis_cache.RedisCache',
@@ -2,6 +2,7 @@
 WSGI config for backend project.
 
 It exposes the WSGI callable as a module-level variable named ``application``.
+With SENSOR_FAST_PATH hot read endpoints skip most of it, see sensor.fastpath
 
 For more information on this file, see
 https://docs.djangoproject.com/en/2.0/howto/deployment/wsgi/
@@ -9,8 +10,13 @@ https://docs.djangoproject.com/en/2.0/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
 
 application = get_wsgi_application()
+
+if settings.SENSOR_FAST_PATH:
+    from sensor.fastpath import FastPathApplication
+    application = FastPathApplication(application)
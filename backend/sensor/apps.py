@@ -1,5 +1,14 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+
+from sensor.db import apply_sqlite_pragmas
 
 
 class SensorConfig(AppConfig):
     name = 'sensor'
+
+    def ready(self):
+        connection_created.connect(
+            apply_sqlite_pragmas,
+            dispatch_uid='apply-sqlite-pragmas'
+        )
@@ -0,0 +1,71 @@
+"""
+Columnar encoding of archived sensor readings
+
+A segment holds readings of one sensor as two compressed columns:
+- times are delta-of-delta encoded, regular readings become zeros
+- values are XORed with the previous value (as in Gorilla), close
+  values share sign, exponent and high mantissa bits which become zeros
+
+Both columns are byte-shuffled (all first bytes, then all second bytes...)
+before zlib, so the zero bits end up in long runs of zero bytes
+"""
+import zlib
+
+import numpy as np
+
+
+def shuffle(array):
+    return array.view(np.uint8).reshape(-1, array.itemsize).T.tobytes()
+
+
+def unshuffle(data: bytes, dtype):
+    itemsize = np.dtype(dtype).itemsize
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1)
+    return np.ascontiguousarray(planes.T).view(dtype).ravel()
+
+
+def encode_times(times):
+    deltas = np.diff(times.astype(np.int64), prepend=0)
+    return zlib.compress(shuffle(np.diff(deltas, prepend=0)))
+
+
+def decode_times(data: bytes):
+    return np.cumsum(np.cumsum(unshuffle(zlib.decompress(data), np.int64)))
+
+
+def encode_values(values):
+    bits = values.astype(np.float64).view(np.uint64)
+    return zlib.compress(shuffle(np.bitwise_xor(bits, np.r_[np.uint64(0), bits[:-1]])))
+
+
+def decode_values(data: bytes):
+    bits = unshuffle(zlib.decompress(data), np.uint64)
+    return np.bitwise_xor.accumulate(bits).view(np.float64)
+
+
+def split_segments(times, size: int):
+    """
+    Yield (start, end, slice) of readings sorted by time
+    for every non-empty bucket of size seconds
+    """
+    buckets = times - times % size
+    edges = np.flatnonzero(buckets[1:] != buckets[:-1]) + 1
+    for first, last in zip(np.r_[0, edges], np.r_[edges, len(times)]):
+        start = int(buckets[first])
+        yield start, start + size, slice(first, last)
+
+
+def aggregate_buckets(times, values, size: int):
+    """
+    Count, total, min and max of readings sorted by time per bucket of size
+    seconds, returns arrays of buckets and of the aggregates
+    """
+    buckets = times - times % size
+    firsts = np.r_[0, np.flatnonzero(buckets[1:] != buckets[:-1]) + 1]
+    return (
+        buckets[firsts],
+        np.diff(np.r_[firsts, len(times)]),
+        np.add.reduceat(values, firsts),
+        np.minimum.reduceat(values, firsts),
+        np.maximum.reduceat(values, firsts)
+    )
@@ -0,0 +1,189 @@
+"""
+Async versions of the hot sensor endpoints for backend.asgi
+
+Redis reads go through one aioredis connection pool per process and
+the hot cache, so a request waiting on redis doesn't hold a thread.
+sqlite has no async driver, range queries run on a small thread pool
+and share their validation and payload with the django views.
+Responses match the ones of sensor.views. It requires aioredis
+"""
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+from django.http import Http404
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework.exceptions import ValidationError
+
+from sensor.auth import get_bearer_token, get_token_user_id
+from sensor.constants import (
+    ASYNC_QUERY_WORKERS,
+    ASYNC_REDIS_POOL_SIZE,
+    REDIS_URL,
+    SUPPORTED_SENSOR_IDS
+)
+from sensor.hotcache import MISSING
+from sensor.models import SensorManager
+from sensor.views import NOT_FOUND, range_statistics
+
+try:
+    import aioredis
+except ImportError:
+    aioredis = None
+
+_pool = None
+_pool_lock = None
+_query_executor = ThreadPoolExecutor(
+    max_workers=ASYNC_QUERY_WORKERS,
+    thread_name_prefix='sensor-query'
+)
+
+
+async def get_redis():
+    """
+    Connection pool shared by all requests of the process, created on first use
+    """
+    global _pool, _pool_lock
+    if _pool is None:
+        if aioredis is None:
+            raise ImportError('Async views require aioredis')
+        # created here so it belongs to the loop of the server
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await aioredis.create_redis_pool(
+                    REDIS_URL, minsize=1, maxsize=ASYNC_REDIS_POOL_SIZE
+                )
+    return _pool
+
+
+async def send_json(send, status: int, payload, headers=()):
+    body = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def is_not_modified(headers: dict, etag: str, modified: float):
+    """
+    Same conditions as django.utils.cache.get_conditional_response for GET requests
+    """
+    if_none_match = headers.get(b'if-none-match')
+    if if_none_match is not None:
+        etags = [value.strip() for value in if_none_match.decode().split(',')]
+        return '*' in etags or etag in etags
+    if_modified_since = headers.get(b'if-modified-since')
+    if if_modified_since is not None:
+        since = parse_http_date_safe(if_modified_since.decode())
+        return since is not None and int(modified) <= since
+    return False
+
+
+async def sensor_statistics(scope, send):
+    headers = dict(scope['headers'])
+    SensorManager.ensure_hot_cache_listener()
+    document, generation = SensorManager.hot_cache.lookup(SensorManager.STATISTICS_DOCUMENT_KEY)
+    if document is MISSING:
+        redis = await get_redis()
+        document = SensorManager.parse_statistics_document(
+            await redis.hgetall(SensorManager.STATISTICS_DOCUMENT_KEY)
+        )
+        if document is None:
+            document = await asyncio.get_event_loop().run_in_executor(
+                _query_executor, SensorManager.refresh_statistics_document
+            )
+        SensorManager.hot_cache.store(SensorManager.STATISTICS_DOCUMENT_KEY, document, generation)
+    body, version, modified = document
+    etag = f'"{version}"'
+    response_headers = [
+        (b'etag', etag.encode()),
+        (b'last-modified', http_date(modified).encode())
+    ]
+    if is_not_modified(headers, etag, modified):
+        await send({
+            'type': 'http.response.start',
+            'status': 304,
+            'headers': response_headers
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await send_json(send, 200, body, response_headers)
+
+
+async def temperature_difference(scope, send, sensor_id: str):
+    """
+    Statistics of the sensor and helsinki temperature
+    are read in one round-trip when they aren't cached
+    """
+    if sensor_id not in SUPPORTED_SENSOR_IDS:
+        await send_json(send, 404, NOT_FOUND)
+        return
+    SensorManager.ensure_hot_cache_listener()
+    hot_cache = SensorManager.hot_cache
+    statistics_key = SensorManager.statistics_key(sensor_id)
+    statistics, statistics_generation = hot_cache.lookup(statistics_key)
+    helsinki_temp, helsinki_generation = hot_cache.lookup(SensorManager.HELSINKI_TEMPERATURE_KEY)
+    if statistics is MISSING or helsinki_temp is MISSING:
+        pipe = (await get_redis()).pipeline()
+        statistics_data = pipe.hgetall(statistics_key)
+        helsinki_data = pipe.get(SensorManager.helsinki_temperature_redis_key())
+        await pipe.execute()
+        statistics = SensorManager.parse_statistics(await statistics_data)
+        helsinki_temp = SensorManager.parse_helsinki_temperature(await helsinki_data)
+        hot_cache.store(statistics_key, statistics, statistics_generation)
+        hot_cache.store(SensorManager.HELSINKI_TEMPERATURE_KEY, helsinki_temp, helsinki_generation)
+    temp = SensorManager.temp_diff(statistics, helsinki_temp)
+    if temp is not None:
+        await send_json(send, 200, {'differenceInCelsius': temp})
+    else:
+        await send_json(send, 404, NOT_FOUND)
+
+
+async def sensor_range_statistics(scope, send, sensor_id: str):
+    params = dict(parse_qsl(scope['query_string'].decode()))
+    try:
+        payload = await asyncio.get_event_loop().run_in_executor(
+            _query_executor, range_statistics, sensor_id, params
+        )
+    except Http404:
+        await send_json(send, 404, NOT_FOUND)
+    except ValidationError as error:
+        await send_json(send, 400, error.detail)
+    else:
+        await send_json(send, 200, payload)
+
+
+def resolve(path: str):
+    """
+    (handler, args) of an async endpoint, None if the path is served by django
+    """
+    parts = path.strip('/').split('/')
+    if parts == ['sensor']:
+        return sensor_statistics, ()
+    if len(parts) == 3 and parts[:2] == ['sensor', 'diff']:
+        return temperature_difference, (parts[2],)
+    if len(parts) == 3 and parts[0] == 'sensor' and parts[2] == 'stats':
+        return sensor_range_statistics, (parts[1],)
+    return None
+
+
+async def dispatch(scope, send, handler, args):
+    """
+    Run an async endpoint for an authenticated GET request
+    """
+    if scope['method'] not in ('GET', 'HEAD'):
+        await send_json(send, 405, {'detail': f'Method "{scope["method"]}" not allowed.'})
+        return
+    authorization = dict(scope['headers']).get(b'authorization', b'').decode()
+    if get_token_user_id(get_bearer_token(authorization)) is None:
+        await send_json(
+            send, 401, {'detail': 'Authentication credentials were not provided.'},
+            [(b'www-authenticate', b'Bearer realm="api"')]
+        )
+        return
+    await handler(scope, send, *args)
@@ -0,0 +1,46 @@
+import time
+
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from sensor.constants import TOKEN_CACHE_MAX_SIZE, TOKEN_CACHE_TTL
+from sensor.hotcache import HotCache, MISSING
+
+# (user id, expiration time) of recently verified tokens,
+# polling clients send the same token until it expires
+verified_tokens = HotCache(ttl=TOKEN_CACHE_TTL, max_size=TOKEN_CACHE_MAX_SIZE)
+
+
+def get_token_user_id(token: str):
+    """
+    User id of a valid access token issued by /api/token, None otherwise
+
+    Only the signature and expiration time are checked, the user is not
+    loaded from the database, so endpoints served outside of django views
+    authenticate without a query per request. Valid tokens are cached
+    for TOKEN_CACHE_TTL seconds so their signature is checked once
+    """
+    if not token:
+        return None
+    verified, generation = verified_tokens.lookup(token)
+    if verified is not MISSING:
+        user_id, expires = verified
+        return user_id if expires > time.time() else None
+    try:
+        access_token = AccessToken(token)
+        user_id = access_token[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+    verified_tokens.store(token, (user_id, access_token['exp']), generation)
+    return user_id
+
+
+def get_bearer_token(authorization: str):
+    """
+    Token of an Authorization header value with one of AUTH_HEADER_TYPES
+    """
+    parts = (authorization or '').split()
+    if len(parts) == 2 and parts[0] in api_settings.AUTH_HEADER_TYPES:
+        return parts[1]
+    return None
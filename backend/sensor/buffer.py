@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+
+from sensor.constants import SENSOR_EVENT_BUFFER_SIZE, SENSOR_EVENT_BUFFER_MAX_AGE
+
+
+class SensorEventBuffer:
+    """
+    Write-behind buffer for sensor events
+
+    Events are accumulated in memory and handed over to flush_callback
+    as a single list once the buffer holds max_size events or the oldest
+    event is older than max_age seconds. A daemon thread started with the
+    first buffered event flushes stale events even if nothing is added
+    afterwards, it lives as long as the process so flush_callback keeps
+    its database connection. flush() has to be called on shutdown,
+    otherwise buffered events are lost.
+
+    Each worker process gets its own buffer so there is no need
+    for anything fancier than a lock here
+    """
+    def __init__(self, flush_callback, max_size=SENSOR_EVENT_BUFFER_SIZE,
+                 max_age=SENSOR_EVENT_BUFFER_MAX_AGE):
+        self.flush_callback = flush_callback
+        self.max_size = max_size
+        self.max_age = max_age
+        self._events = []
+        self._first_event_at = None
+        self._flusher = None
+        self._lock = threading.RLock()
+        self._event_added = threading.Condition(self._lock)
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, sensor_id: str, timestamp: int, value: float):
+        return self.extend([(sensor_id, timestamp, value)])
+
+    def extend(self, events):
+        """
+        Buffer events and flush them if size or age limit is reached,
+        returns number of flushed events
+        """
+        with self._lock:
+            if not self._events:
+                self._first_event_at = time.monotonic()
+                self._start_flusher()
+                self._event_added.notify()
+            self._events.extend(events)
+            if self._is_full() or self._is_stale():
+                return self.flush()
+            return 0
+
+    def flush(self):
+        """
+        Pass all buffered events to flush_callback,
+        events are put back to the buffer if the callback fails
+        so they can be retried with the next flush
+        """
+        with self._lock:
+            events, self._events = self._events, []
+            if not events:
+                return 0
+            try:
+                self.flush_callback(events)
+            except Exception:
+                self._events = events + self._events
+                raise
+            self._first_event_at = None
+            return len(events)
+
+    def _start_flusher(self):
+        # threads don't survive a fork, prefork children start their own
+        if self._flusher is None or not self._flusher.is_alive():
+            # buffered events are flushed on shutdown, the thread mustn't block it
+            self._flusher = threading.Thread(target=self._flush_stale, daemon=True)
+            self._flusher.start()
+
+    def _flush_stale(self):
+        """
+        Flush events once the oldest one is max_age seconds old,
+        a failed flush is retried after max_age
+        """
+        retry_at = 0
+        with self._lock:
+            while True:
+                if not self._events:
+                    self._event_added.wait()
+                    continue
+                now = time.monotonic()
+                due = max(self._first_event_at + self.max_age, retry_at)
+                if now < due:
+                    self._event_added.wait(due - now)
+                    continue
+                try:
+                    self.flush()
+                except Exception:
+                    retry_at = now + self.max_age
+                    logging.exception(
+                        'Couldn"t flush buffered events',
+                        extra={'events': len(self)}
+                    )
+
+    def _is_full(self):
+        return len(self._events) >= self.max_size
+
+    def _is_stale(self):
+        return time.monotonic() - self._first_event_at >= self.max_age
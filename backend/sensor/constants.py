@@ -1,5 +1,73 @@
+from django.conf import settings
+
 SENSOR_DATA_URI = 'http://dummy-sensors.azurewebsites.net/api/sensor/{sensor_id}'
 WEATHER_DATA_URI = 'http://dummy-sensors.azurewebsites.net/api/weather'
-# sensors returned by /sensor api
-SUPPORTED_SENSORS = ['abba5', 'abba', 'acdc', 'iddqd', 'idkfa']
-EXTERNAL_API_TIMEOUT = 5
+# sensors returned by /sensor api, polled by fetch_all_sensors
+SUPPORTED_SENSORS = settings.SUPPORTED_SENSORS
+# the same ids for membership checks of requested sensors
+SUPPORTED_SENSOR_IDS = frozenset(SUPPORTED_SENSORS)
+# (connect, read) timeouts of requests to the apis above
+EXTERNAL_API_TIMEOUT = (
+    settings.EXTERNAL_API_CONNECT_TIMEOUT,
+    settings.EXTERNAL_API_READ_TIMEOUT
+)
+EXTERNAL_API_RETRIES = settings.EXTERNAL_API_RETRIES
+# sleeps 0.1s, 0.2s, 0.4s... between retries
+EXTERNAL_API_BACKOFF_FACTOR = 0.1
+# max number of sensors fetched at the same time by fetch_all_sensors
+SENSOR_FETCH_CONCURRENCY = 32
+# keep-alive connections per process, one per concurrently fetched sensor
+EXTERNAL_API_POOL_SIZE = SENSOR_FETCH_CONCURRENCY
+# write-behind buffer for sensor events, flushed when it holds
+# SENSOR_EVENT_BUFFER_SIZE events or by a background thread once the oldest event is
+# SENSOR_EVENT_BUFFER_MAX_AGE seconds old. Statistics are updated on flush too,
+# so the age is how far behind they can be
+SENSOR_EVENT_BUFFER_SIZE = 100
+SENSOR_EVENT_BUFFER_MAX_AGE = 1
+# readings outside of this range are reported by the alerts ingest stage
+ALERT_MIN_TEMPERATURE = 16
+ALERT_MAX_TEMPERATURE = 29
+# rollup tables (rollup_<level>) and size of their buckets in seconds,
+# ordered from the finest to the coarsest one
+ROLLUP_LEVELS = {
+    'minute': 60,
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+}
+# per-process cache of statistics read from redis, see sensor.hotcache,
+# with HOT_CACHE_INVALIDATION updated keys are published to HOT_CACHE_CHANNEL
+HOT_CACHE_TTL = settings.SENSOR_HOT_CACHE_TTL
+HOT_CACHE_MAX_SIZE = 1024
+HOT_CACHE_INVALIDATION = settings.SENSOR_HOT_CACHE_INVALIDATION
+HOT_CACHE_CHANNEL = 'sensor_hot_cache'
+# redis server of django cache, also used by the async readings stream
+REDIS_URL = settings.CACHES['default']['LOCATION']
+# every ingested batch of readings is published to this channel, see sensor.stream
+READINGS_CHANNEL = 'sensor_readings'
+# batches a stream client can fall behind before it is disconnected
+STREAM_QUEUE_SIZE = 100
+# idle stream connections get a comment every STREAM_HEARTBEAT_SECONDS
+STREAM_HEARTBEAT_SECONDS = 15
+# redis connections of every process serving backend.asgi
+ASYNC_REDIS_POOL_SIZE = settings.ASYNC_REDIS_POOL_SIZE
+# threads running sqlite queries of async endpoints, see sensor.async_views
+ASYNC_QUERY_WORKERS = 8
+# sensor readings are compared with the latest helsinki temperature
+# at most this many seconds older than them, see SensorManager.iter_temp_diffs
+WEATHER_MAX_AGE = 60 * 60
+# verified access tokens kept by every process, see sensor.auth
+TOKEN_CACHE_TTL = 60
+TOKEN_CACHE_MAX_SIZE = 1024
+# database alias of read-only sensor queries
+READ_ONLY_DATABASE = 'readonly'
+# duration of archive segments, see SensorManager.archive_partition
+ARCHIVE_SEGMENT_SECONDS = 24 * 60 * 60
+# rows fetched at once when streaming readings from datas table
+READINGS_BATCH_SIZE = 10000
+# max number of readings pushed to the ingest endpoint in one request
+INGEST_MAX_BATCH_SIZE = 10000
+# pushed readings may be this many seconds ahead of the server clock
+INGEST_MAX_CLOCK_SKEW = 60 * 60
+# number of points returned by the downsampled series endpoint
+SERIES_DEFAULT_POINTS = 500
+SERIES_MAX_POINTS = 5000
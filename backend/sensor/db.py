@@ -0,0 +1,12 @@
+from django.conf import settings
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Run SQLITE_PRAGMAS of the database alias on a new connection
+    """
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {}).get(connection.alias, {})
+    for name, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {name}={value}')
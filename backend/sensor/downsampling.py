@@ -0,0 +1,119 @@
+"""
+Downsampling of sensor readings for charting
+
+Both algorithms consume readings as chunks of (time, value) rows ordered
+by time and split [start, end) into buckets of equal duration, so memory
+depends on the chunk size and the number of points, not on the window
+"""
+import numpy as np
+
+
+def bucket_indexes(times, start: int, end: int, buckets: int):
+    # same integer formula as SensorManager.get_bucket_averages uses in sql
+    return ((times.astype(np.int64) - start) * buckets) // (end - start)
+
+
+def to_arrays(rows):
+    readings = np.asarray(rows, dtype=np.float64)
+    return readings[:, 0], readings[:, 1]
+
+
+def min_max(chunks, start: int, end: int, points: int):
+    """
+    Keep the lowest and the highest reading of points // 2 buckets
+    """
+    buckets = max(points // 2, 1)
+    min_times = np.zeros(buckets)
+    min_values = np.full(buckets, np.inf)
+    max_times = np.zeros(buckets)
+    max_values = np.full(buckets, -np.inf)
+    for rows in chunks:
+        times, values = to_arrays(rows)
+        indexes = bucket_indexes(times, start, end, buckets)
+        # sorted by bucket and then by value, so the first and the last
+        # row of every bucket are its min and max
+        order = np.lexsort((values, indexes))
+        sorted_indexes = indexes[order]
+        edges = sorted_indexes[1:] != sorted_indexes[:-1]
+        lowest = order[np.r_[True, edges]]
+        highest = order[np.r_[edges, True]]
+        chunk_buckets = sorted_indexes[np.r_[True, edges]]
+
+        lower = values[lowest] < min_values[chunk_buckets]
+        min_values[chunk_buckets[lower]] = values[lowest][lower]
+        min_times[chunk_buckets[lower]] = times[lowest][lower]
+        higher = values[highest] > max_values[chunk_buckets]
+        max_values[chunk_buckets[higher]] = values[highest][higher]
+        max_times[chunk_buckets[higher]] = times[highest][higher]
+
+    filled = np.isfinite(min_values)
+    times = np.concatenate((min_times[filled], max_times[filled]))
+    values = np.concatenate((min_values[filled], max_values[filled]))
+    order = np.argsort(times, kind='mergesort')
+    times, values = times[order], values[order]
+    # buckets with a single reading have the same min and max
+    unique = np.r_[True, times[1:] != times[:-1]]
+    return to_points(times[unique], values[unique])
+
+
+def lttb(chunks, start: int, end: int, points: int, averages: dict, last_point):
+    """
+    Largest-Triangle-Three-Buckets
+
+    The first reading is always kept, every bucket contributes the reading
+    forming the largest triangle with the previously selected one and the
+    average of the next bucket. averages maps non-empty buckets of
+    points - 2 buckets to their (avg time, avg value) and last_point
+    is the last reading of the window, it is kept as well.
+    Averages have to be known upfront to make this a single pass
+    """
+    buckets = points - 2
+    non_empty = sorted(averages)
+    next_averages = dict(zip(non_empty, (averages[b] for b in non_empty[1:])))
+    selected_times = []
+    selected_values = []
+    previous = None
+    current_bucket = None
+    best = None
+    for rows in chunks:
+        times, values = to_arrays(rows)
+        if previous is None:
+            previous = times[0], values[0]
+            selected_times.append(previous[0])
+            selected_values.append(previous[1])
+            times, values = times[1:], values[1:]
+            if not len(times):
+                continue
+        indexes = bucket_indexes(times, start, end, buckets)
+        splits = np.flatnonzero(indexes[1:] != indexes[:-1]) + 1
+        for bucket, bucket_times, bucket_values in zip(
+                indexes[np.r_[0, splits]],
+                np.split(times, splits),
+                np.split(values, splits)):
+            if bucket != current_bucket:
+                if best is not None:
+                    previous = best[1:]
+                    selected_times.append(previous[0])
+                    selected_values.append(previous[1])
+                current_bucket = bucket
+                best = None
+            next_time, next_value = next_averages.get(bucket, last_point)
+            previous_time, previous_value = previous
+            areas = np.abs(
+                (previous_time - next_time) * (bucket_values - previous_value) -
+                (previous_time - bucket_times) * (next_value - previous_value)
+            )
+            i = int(np.argmax(areas))
+            if best is None or areas[i] > best[0]:
+                best = areas[i], bucket_times[i], bucket_values[i]
+    if best is not None and best[1] != last_point[0]:
+        selected_times.append(best[1])
+        selected_values.append(best[2])
+    if previous is not None and selected_times[-1] != last_point[0]:
+        selected_times.append(last_point[0])
+        selected_values.append(last_point[1])
+    return to_points(selected_times, selected_values)
+
+
+def to_points(times, values):
+    return [[int(t), float(v)] for t, v in zip(times, values)]
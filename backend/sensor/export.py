@@ -0,0 +1,89 @@
+"""
+Streaming serializers for raw sensor readings
+
+Every serializer takes batches of (time, value) rows as yielded by
+SensorManager.iter_readings and yields encoded chunks of bytes,
+so an export never holds more than a batch in memory
+"""
+import csv
+import io
+import json
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+
+def csv_chunks(sensor_id: str, readings):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(('id', 'time', 'value'))
+    for rows in readings:
+        writer.writerows((sensor_id, time, value) for time, value in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_chunks(sensor_id: str, readings):
+    for rows in readings:
+        yield ''.join(
+            json.dumps({'id': sensor_id, 'time': time, 'value': value}) + '\n'
+            for time, value in rows
+        ).encode()
+
+
+def arrow_chunks(sensor_id: str, readings):
+    """
+    Arrow IPC stream with one record batch per batch of rows
+    """
+    if pyarrow is None:
+        raise ImportError('Arrow export requires pyarrow')
+    schema = pyarrow.schema([
+        ('id', pyarrow.string()),
+        ('time', pyarrow.int64()),
+        ('value', pyarrow.float64())
+    ])
+    sink = io.BytesIO()
+    writer = pyarrow.RecordBatchStreamWriter(sink, schema)
+    for rows in readings:
+        times, values = zip(*rows)
+        writer.write_batch(pyarrow.RecordBatch.from_arrays(
+            [
+                pyarrow.array([sensor_id] * len(rows), pyarrow.string()),
+                pyarrow.array(times, pyarrow.int64()),
+                pyarrow.array(values, pyarrow.float64())
+            ],
+            schema=schema
+        ))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
+
+
+def temp_diff_ndjson_chunks(diffs):
+    """
+    Serialize (times, differences) arrays as yielded by SensorManager.iter_temp_diffs
+    """
+    for times, differences in diffs:
+        yield ''.join(
+            json.dumps({'time': time, 'differenceInCelsius': difference}) + '\n'
+            for time, difference in zip(times.tolist(), differences.tolist())
+        ).encode()
+
+
+# format: (content type, serializer)
+FORMATS = {
+    'csv': ('text/csv', csv_chunks),
+    'ndjson': ('application/x-ndjson', ndjson_chunks),
+    'arrow': ('application/vnd.apache.arrow.stream', arrow_chunks),
+}
+
+
+def is_available(export_format: str):
+    return export_format in FORMATS and (export_format != 'arrow' or pyarrow is not None)
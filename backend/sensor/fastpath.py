@@ -0,0 +1,145 @@
+"""
+Lean read-only routing of the hot sensor endpoints for backend.wsgi
+
+GET requests of statistics and temperature differences are handled by
+plain django views behind SENSOR_FAST_PATH_MIDDLEWARE only, skipping
+sessions, csrf, messages and rest_framework request wrapping, content
+negotiation and authentication, which loads the user from the database.
+The access token is verified without a query by sensor.auth.
+Every other request goes to the full django application.
+Payloads are serialized with orjson when it is installed
+"""
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler, get_path_info
+from django.http import Http404, HttpResponse
+from django.urls import Resolver404, get_resolver, path
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import ValidationError
+
+from sensor.auth import get_bearer_token, get_token_user_id
+from sensor.constants import SUPPORTED_SENSOR_IDS
+from sensor.models import SensorManager
+from sensor.views import (
+    NOT_FOUND,
+    statistics_document_response,
+    temperature_differences_payload
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(payload) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload).encode()
+
+
+def json_response(payload, status=200):
+    return HttpResponse(dumps(payload), status=status, content_type='application/json')
+
+
+def authenticated(view):
+    """
+    Same 401 response as rest_framework IsAuthenticated with jwt authentication
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        # validates ALLOWED_HOSTS like CommonMiddleware, 400 otherwise
+        request.get_host()
+        token = get_bearer_token(request.META.get('HTTP_AUTHORIZATION'))
+        if get_token_user_id(token) is None:
+            response = json_response(
+                {'detail': 'Authentication credentials were not provided.'}, 401
+            )
+            response['WWW-Authenticate'] = 'Bearer realm="api"'
+            return response
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+@authenticated
+def sensor_statistics(request):
+    return statistics_document_response(request)
+
+
+@authenticated
+def temperature_difference(request, sensor_id):
+    if sensor_id not in SUPPORTED_SENSOR_IDS:
+        return json_response(NOT_FOUND, 404)
+    temp = SensorManager.get_helsinki_temp_diff(sensor_id)
+    if temp is not None:
+        return json_response({'differenceInCelsius': temp})
+    return json_response(NOT_FOUND, 404)
+
+
+@authenticated
+def temperature_differences(request):
+    try:
+        return json_response(temperature_differences_payload(request.GET))
+    except Http404:
+        return json_response(NOT_FOUND, 404)
+    except ValidationError as error:
+        return json_response(error.detail, 400)
+
+
+# same paths as backend.urls and sensor.urls
+urlpatterns = [
+    path('sensor/diff/<str:sensor_id>/', temperature_difference),
+    path('sensor/diff/', temperature_differences),
+    path('sensor/', sensor_statistics),
+]
+
+
+class FastPathHandler(WSGIHandler):
+    """
+    Django handler of the views above with SENSOR_FAST_PATH_MIDDLEWARE
+    """
+    def load_middleware(self):
+        # BaseHandler.load_middleware only reads settings.MIDDLEWARE,
+        # the views above don't need exception or template response hooks
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+        handler = convert_exception_to_response(self._get_response)
+        for middleware_path in reversed(settings.SENSOR_FAST_PATH_MIDDLEWARE):
+            middleware = import_string(middleware_path)(handler)
+            if hasattr(middleware, 'process_view'):
+                self._view_middleware.insert(0, middleware.process_view)
+            handler = convert_exception_to_response(middleware)
+        self._middleware_chain = handler
+
+    def get_response(self, request):
+        request.urlconf = __name__
+        return super().get_response(request)
+
+
+class FastPathApplication:
+    """
+    WSGI application which serves GET requests of the hot endpoints
+    by FastPathHandler and everything else by application
+    """
+    def __init__(self, application):
+        self.application = application
+        self.handler = FastPathHandler()
+        self.resolver = get_resolver(__name__)
+
+    def is_fast_path(self, environ) -> bool:
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return False
+        try:
+            self.resolver.resolve(get_path_info(environ))
+        except Resolver404:
+            return False
+        return True
+
+    def __call__(self, environ, start_response):
+        if self.is_fast_path(environ):
+            return self.handler(environ, start_response)
+        return self.application(environ, start_response)
@@ -0,0 +1,116 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from redis.exceptions import RedisError
+
+from sensor.constants import HOT_CACHE_TTL, HOT_CACHE_MAX_SIZE
+
+# lookup result of keys which aren't cached, None is a valid value
+MISSING = object()
+
+
+class HotCache:
+    """
+    Per-process read-through cache in front of redis reads
+
+    Values are kept for ttl seconds and at most max_size of them,
+    the least recently used one is evicted first. ttl of 0 disables it.
+
+    With listen() keys published to a redis channel are dropped
+    as soon as they change, ttl then only bounds how stale a value
+    can get if the subscription is lost
+    """
+    def __init__(self, ttl=HOT_CACHE_TTL, max_size=HOT_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._values = OrderedDict()
+        # bumped by every invalidation, values looked up
+        # before an invalidation must not be stored
+        self._generation = 0
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def lookup(self, key):
+        """
+        (value, generation) of key, value is MISSING if it isn't cached,
+        loaders which can't use get_or_set pass generation to store
+        """
+        with self._lock:
+            item = self._values.get(key)
+            if item is not None and item[0] > time.monotonic():
+                self._values.move_to_end(key)
+                return item[1], self._generation
+            return MISSING, self._generation
+
+    def store(self, key, value, generation: int):
+        """
+        Cache a loaded value unless anything was invalidated
+        since its lookup returned generation
+        """
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            if generation == self._generation:
+                self._values[key] = (time.monotonic() + self.ttl, value)
+                self._values.move_to_end(key)
+                while len(self._values) > self.max_size:
+                    self._values.popitem(last=False)
+
+    def get_or_set(self, key, load):
+        """
+        Cached value of key, load() result is cached on a miss
+        """
+        value, generation = self.lookup(key)
+        if value is MISSING:
+            value = load()
+            self.store(key, value, generation)
+        return value
+
+    def invalidate(self, keys):
+        with self._lock:
+            self._generation += 1
+            for key in keys:
+                self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._values.clear()
+
+    def listen(self, client, channel: str):
+        """
+        Drop keys published to channel as comma separated list,
+        the subscription runs in a daemon thread started once per process
+        """
+        with self._lock:
+            # threads don't survive fork, so forked workers start their own
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(
+                target=self._listen,
+                args=(client, channel),
+                name='hot-cache-invalidation',
+                daemon=True
+            )
+            self._listener.start()
+
+    def _listen(self, client, channel: str):
+        while True:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(channel)
+                # changes published before subscribing were missed
+                self.clear()
+                for message in pubsub.listen():
+                    self.invalidate(message['data'].decode().split(','))
+            except RedisError:
+                logging.exception('Hot cache subscription failed')
+                self.clear()
+                time.sleep(1)
+            finally:
+                pubsub.close()
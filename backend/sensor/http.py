@@ -0,0 +1,54 @@
+"""
+HTTP client for external sensor and weather apis
+
+Every celery worker process gets its own session created on
+worker_process_init, so connections are kept alive between polls
+instead of doing DNS, TCP and TLS setup on every request
+"""
+import requests
+from celery.signals import worker_process_init
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from sensor.constants import (
+    EXTERNAL_API_RETRIES,
+    EXTERNAL_API_BACKOFF_FACTOR,
+    EXTERNAL_API_POOL_SIZE
+)
+
+_session = None
+
+
+def create_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=EXTERNAL_API_POOL_SIZE,
+        max_retries=Retry(
+            total=EXTERNAL_API_RETRIES,
+            backoff_factor=EXTERNAL_API_BACKOFF_FACTOR,
+            status_forcelist=(500, 502, 503, 504),
+            # the last response is returned instead of raising,
+            # callers check response.ok anyway
+            raise_on_status=False
+        )
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+@worker_process_init.connect
+def init_session(*args, **kwargs):
+    global _session
+    _session = create_session()
+
+
+def get_session():
+    """
+    Session of the current process, created on first use outside
+    of prefork workers (solo pool, shell, tests)
+    """
+    if _session is None:
+        init_session()
+    return _session
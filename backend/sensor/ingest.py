@@ -0,0 +1,137 @@
+import json
+import logging
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from sensor.constants import ALERT_MIN_TEMPERATURE, ALERT_MAX_TEMPERATURE, READINGS_CHANNEL
+from sensor.models import SensorManager
+
+
+class IngestStage:
+    """
+    Base class of ingest pipeline stages
+
+    Every hook gets the whole batch of (sensor_id, timestamp, value)
+    tuples, override the ones a stage needs:
+    - write runs inside the database transaction shared by all stages
+    - cache queues redis commands to the pipeline shared by all stages
+    - after runs once both of them are committed
+    """
+    def write(self, cursor, events):
+        pass
+
+    def cache(self, pipe, events):
+        pass
+
+    def after(self, events):
+        pass
+
+
+class ReadingsStage(IngestStage):
+    def write(self, cursor, events):
+        SensorManager.insert_events(cursor, events)
+
+
+class RollupsStage(IngestStage):
+    def write(self, cursor, events):
+        SensorManager.upsert_rollups(cursor, events)
+
+
+class StatisticsStage(IngestStage):
+    def cache(self, pipe, events):
+        SensorManager.incr_statistics(pipe, events)
+
+    def after(self, events):
+        SensorManager.refresh_statistics_document()
+
+
+class PublishStage(IngestStage):
+    """
+    Publish the batch to subscribers of the live readings stream,
+    in the same redis transaction as statistics updates
+    """
+    def cache(self, pipe, events):
+        pipe.publish(READINGS_CHANNEL, json.dumps([
+            {
+                'id': sensor_id,
+                'timestamp': SensorManager.to_seconds(timestamp),
+                'value': value
+            }
+            for sensor_id, timestamp, value in events
+        ]))
+
+
+class AlertsStage(IngestStage):
+    """
+    Log readings outside of [min_value, max_value]
+    """
+    def __init__(self, min_value=ALERT_MIN_TEMPERATURE, max_value=ALERT_MAX_TEMPERATURE):
+        self.min_value = min_value
+        self.max_value = max_value
+
+    def after(self, events):
+        for sensor_id, timestamp, value in events:
+            if not self.min_value <= value <= self.max_value:
+                logging.warning(
+                    'Sensor reading out of range',
+                    extra={
+                        'sensor_id': sensor_id,
+                        'timestamp': timestamp,
+                        'value': value
+                    }
+                )
+
+
+class IngestPipeline:
+    """
+    Pass batches of events through stages
+
+    Database writes of all stages are committed in one transaction
+    and cache updates are sent in one redis transaction afterwards,
+    so cost of a batch depends on its size, not on the number of stages.
+    Statistics are not updated if the database write fails. Once it is
+    committed the batch is never failed, retrying it would store the
+    readings twice, so redis and after hook errors are only logged;
+    statistics can be rebuilt with hard_reset_statistics
+    """
+    def __init__(self, stages):
+        self.stages = stages
+
+    def run(self, events):
+        if not events:
+            return 0
+        # django connection runs in autocommit mode,
+        # so without atomic every statement would be committed separately
+        with transaction.atomic():
+            cursor = SensorManager.raw_connection().cursor()
+            for stage in self.stages:
+                stage.write(cursor, events)
+        try:
+            pipe = SensorManager.redis().pipeline()
+            for stage in self.stages:
+                stage.cache(pipe, events)
+            pipe.execute()
+        except Exception:
+            logging.exception('Couldn"t update sensor statistics', extra={'events': len(events)})
+        for stage in self.stages:
+            try:
+                stage.after(events)
+            except Exception:
+                logging.exception(
+                    'Ingest stage failed',
+                    extra={'stage': type(stage).__name__, 'events': len(events)}
+                )
+        return len(events)
+
+
+@lru_cache(maxsize=None)
+def get_pipeline():
+    """
+    Pipeline built from SENSOR_INGEST_STAGES setting, stages are created once per process
+    """
+    return IngestPipeline([
+        import_string(path)() for path in settings.SENSOR_INGEST_STAGES
+    ])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from sensor.models import SensorManager
+
+
+class Command(BaseCommand):
+    """
+    Rebuild minute/hour/day rollups from datas partitions,
+    needed once for existing data, afterwards rollups are maintained
+    by SensorManager.ingest
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sensor_ids',
+            nargs='*',
+            help='Sensors to rebuild, all sensors found in datas by default',
+        )
+
+    def handle(self, *args, **options):
+        sensor_ids = options.get('sensor_ids') or SensorManager.get_sensor_ids()
+        for sensor_id in sensor_ids:
+            SensorManager.backfill_rollups(sensor_id)
+            print(f'Rollups for {sensor_id} are rebuilt')
@@ -0,0 +1,84 @@
+import time
+from wsgiref.util import setup_testing_defaults
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from rest_framework_simplejwt.tokens import AccessToken
+
+from sensor.constants import SUPPORTED_SENSORS
+from sensor.fastpath import FastPathApplication
+
+
+class Command(BaseCommand):
+    """
+    Requests per second of the hot read endpoints served by the full
+    django application and by sensor.fastpath, measured in process
+    so the web server is left out. Reads the current redis data
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='User the access token is issued to')
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=2000,
+            dest='requests',
+            help='Requests per endpoint and application',
+        )
+        parser.add_argument(
+            '--sensor',
+            default=SUPPORTED_SENSORS[0],
+            dest='sensor_id',
+            help='Sensor of the temperature difference endpoint',
+        )
+        parser.add_argument(
+            '--host',
+            default='localhost',
+            dest='host',
+            help='Host header, must be one of ALLOWED_HOSTS',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'No such user {options["username"]}')
+        django_application = get_wsgi_application()
+        applications = (
+            ('django', django_application),
+            ('fast path', FastPathApplication(django_application)),
+        )
+        environ = {
+            'REQUEST_METHOD': 'GET',
+            'HTTP_HOST': options['host'],
+            'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(user)}',
+        }
+        setup_testing_defaults(environ)
+        for path in ('/sensor/', f'/sensor/diff/{options["sensor_id"]}/'):
+            for name, application in applications:
+                status, rate = self.benchmark(
+                    application, dict(environ, PATH_INFO=path), options['requests']
+                )
+                self.stdout.write(f'{path} {name}: {rate:.0f} requests/s ({status})')
+
+    @staticmethod
+    def benchmark(application, environ: dict, requests: int):
+        """
+        (status of the last response, requests per second) of application,
+        the first request is not timed as it fills caches
+        """
+        statuses = []
+
+        def start_response(status, headers):
+            statuses.append(status)
+
+        def request():
+            response = application(dict(environ), start_response)
+            b''.join(response)
+            response.close()
+
+        request()
+        started = time.perf_counter()
+        for _ in range(requests):
+            request()
+        return statuses[-1], requests / (time.perf_counter() - started)
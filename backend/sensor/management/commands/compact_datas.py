@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sensor.models import SensorManager
+
+
+class Command(BaseCommand):
+    """
+    Compact closed monthly partitions into the columnar archive,
+    archived readings are still returned by all sensor queries
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hot-months',
+            type=int,
+            default=settings.SENSOR_HOT_MONTHS,
+            help='Number of whole months kept as rows before the current one',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = SensorManager.months_ago_cutoff(options['hot_months'])
+        archived = SensorManager.archive_partitions(cutoff)
+        for name, rows in archived:
+            print(f'{rows} rows of {name} are archived')
+        month = datetime.fromtimestamp(cutoff, timezone.utc)
+        print(f'{len(archived)} partitions older than {month:%Y-%m} are archived')
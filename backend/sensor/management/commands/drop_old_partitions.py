@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from sensor.models import SensorManager
+
+
+class Command(BaseCommand):
+    """
+    Drop monthly datas partitions older than the retention period,
+    dropping a table is instant compared to deleting its rows.
+    Rollups are kept so aggregates of dropped months are still available
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--keep-months',
+            type=int,
+            default=settings.SENSOR_RETENTION_MONTHS,
+            help='Number of whole months kept before the current one',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = SensorManager.months_ago_cutoff(options['keep_months'])
+        dropped = SensorManager.drop_partitions(cutoff)
+        for name in dropped:
+            print(f'{name} is dropped')
+        month = datetime.fromtimestamp(cutoff, timezone.utc)
+        print(f'{len(dropped)} partitions older than {month:%Y-%m} are dropped')
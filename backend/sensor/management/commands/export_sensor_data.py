@@ -0,0 +1,63 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from sensor import export
+from sensor.models import SensorManager
+
+
+class Command(BaseCommand):
+    """
+    Stream raw readings of a sensor to a file or stdout
+    """
+    def add_arguments(self, parser):
+        parser.add_argument('sensor_id')
+        parser.add_argument(
+            '--from',
+            type=int,
+            default=0,
+            dest='start',
+            help='Unix timestamp of the first exported reading',
+        )
+        parser.add_argument(
+            '--to',
+            type=int,
+            default=None,
+            dest='end',
+            help='Unix timestamp the export stops at (exclusive), now by default',
+        )
+        parser.add_argument(
+            '--format',
+            choices=export.FORMATS,
+            default='csv',
+            dest='format',
+        )
+        parser.add_argument(
+            '--output',
+            default='-',
+            dest='output',
+            help='File to write to, stdout by default',
+        )
+
+    def handle(self, *args, **options):
+        export_format = options['format']
+        if not export.is_available(export_format):
+            raise CommandError(f'{export_format} export requires pyarrow')
+        start = SensorManager.to_seconds(options['start'])
+        end = SensorManager.to_seconds(options['end'] or int(time.time()))
+        _, serializer = export.FORMATS[export_format]
+        chunks = serializer(
+            options['sensor_id'],
+            SensorManager.iter_readings(options['sensor_id'], start, end)
+        )
+        if options['output'] == '-':
+            self.write(sys.stdout.buffer, chunks)
+        else:
+            with open(options['output'], 'wb') as output:
+                self.write(output, chunks)
+
+    @staticmethod
+    def write(output, chunks):
+        for chunk in chunks:
+            output.write(chunk)
+        output.flush()
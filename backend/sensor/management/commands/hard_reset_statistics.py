@@ -1,3 +1,6 @@
+import math
+import os
+
 from django.core.management.base import BaseCommand
 from sensor.models import SensorManager
 
@@ -7,6 +10,9 @@ class Command(BaseCommand):
     "Hard reset of statistics" for all sensors
     useful when you need to initialize the data or debug the code
 
+    By default only rows inserted after the previous run are aggregated
+    and folded into the stored checkpoints, use --full to scan all partitions
+
     TODO: add service to send an alert if data doesn't match
     """
     def add_arguments(self, parser):
@@ -16,6 +22,19 @@ class Command(BaseCommand):
             dest='health_check',
             help='Run health check instead of updating cache',
         )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            dest='full',
+            help='Aggregate all rows instead of the ones inserted after the previous run',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count(),
+            dest='workers',
+            help='Number of processes aggregating sensors in parallel',
+        )
 
     def update_cache(self, stats, health_check=False):
         """
@@ -24,25 +43,33 @@ class Command(BaseCommand):
         to True
         """
         print(stats)
+        if not health_check:
+            SensorManager.set_many([
+                (sensor_id, count, temp, total)
+                for sensor_id, temp, count, avg, total in stats
+            ])
+            return
         for sensor_id, temp, count, avg, total in stats:
-            if health_check:
-                current_sensor = SensorManager.get(sensor_id)
-                assert current_sensor is not None
-                assert current_sensor['avg'] == avg
-                assert current_sensor['count'] == count
-                assert current_sensor['temperature'] == temp
-                assert current_sensor['total'] == total
-                print(f'Data for {sensor_id} is up to date')
-            else:
-                SensorManager.set(
-                    sensor_id,
-                    count,
-                    avg,
-                    temp,
-                    total
-                )
+            current_sensor = SensorManager.get(sensor_id)
+            assert current_sensor is not None
+            # redis increments floats with long double precision,
+            # so totals can be off by a rounding error
+            assert math.isclose(current_sensor['avg'], avg)
+            assert current_sensor['count'] == count
+            assert current_sensor['temperature'] == temp
+            assert math.isclose(current_sensor['total'], total)
+            print(f'Data for {sensor_id} is up to date')
 
     def handle(self, *args, **options):
         health_check = options.get('health_check')
-        stats = SensorManager.get_stats_for_all_sensors()
+        workers = options.get('workers') or 1
+        # health check only reads, checkpoints are moved by updates
+        if options.get('full'):
+            stats = SensorManager.get_stats_for_all_sensors(
+                workers=workers, save=not health_check
+            )
+        else:
+            stats = SensorManager.get_stats_since_checkpoints(
+                workers=workers, save=not health_check
+            )
         self.update_cache(stats, health_check=health_check)
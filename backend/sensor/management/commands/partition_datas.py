@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from sensor.models import SensorManager
+
+
+class Command(BaseCommand):
+    """
+    Move rows of the legacy datas table (e.g. created by create_iot_db.py)
+    to monthly partitions, so retention can drop them later.
+    Rows are moved a month at a time and can be moved while workers write
+    """
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sensor_ids',
+            nargs='*',
+            help='Sensors to move, all sensors found in datas by default',
+        )
+
+    def handle(self, *args, **options):
+        sensor_ids = options.get('sensor_ids') or SensorManager.get_sensor_ids()
+        for sensor_id in sensor_ids:
+            moved = SensorManager.split_legacy_partition(sensor_id)
+            print(f'{moved} rows of {sensor_id} are moved to partitions')
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    datas table is normally created and populated by create_iot_db.py,
+    IF NOT EXISTS keeps this migration a no-op for existing databases
+    and gives test databases the same schema
+    """
+
+    initial = True
+
+    dependencies = []
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                'CREATE TABLE IF NOT EXISTS datas (id TEXT, time TIMESTAMP, value REAL)',
+                'CREATE INDEX IF NOT EXISTS main_idx on datas (id, time)',
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensor', '0001_datas'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE TABLE statistics_checkpoints (
+                id TEXT PRIMARY KEY,
+                time INTEGER,
+                count INTEGER,
+                total REAL,
+                value REAL
+            )
+            """,
+            reverse_sql='DROP TABLE statistics_checkpoints',
+        ),
+    ]
@@ -0,0 +1,28 @@
+from django.db import migrations
+
+from sensor.constants import ROLLUP_LEVELS
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensor', '0002_statistics_checkpoints'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=f"""
+            CREATE TABLE rollup_{level} (
+                id TEXT,
+                bucket INTEGER,
+                count INTEGER,
+                total REAL,
+                min REAL,
+                max REAL,
+                PRIMARY KEY (id, bucket)
+            ) WITHOUT ROWID
+            """,
+            reverse_sql=f'DROP TABLE rollup_{level}',
+        )
+        for level in ROLLUP_LEVELS
+    ]
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Readings are stored in monthly datas_YYYYMM tables created on first write,
+    datas_partitions keeps their names and [start_time, end_time) bounds.
+    The original datas table stays registered as a partition without bounds
+    so existing data is still read, see SensorManager.get_partitions
+    """
+
+    dependencies = [
+        ('sensor', '0003_rollups'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE TABLE datas_partitions (
+                    name TEXT PRIMARY KEY,
+                    start_time INTEGER,
+                    end_time INTEGER
+                )
+                """,
+                "INSERT INTO datas_partitions VALUES ('datas', NULL, NULL)",
+            ],
+            reverse_sql='DROP TABLE datas_partitions',
+        ),
+    ]
@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Readings of closed partitions compacted per sensor and day,
+    see sensor.archive for the encoding of time_data and value_data
+    """
+
+    dependencies = [
+        ('sensor', '0004_datas_partitions'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                CREATE TABLE archive_segments (
+                    id TEXT,
+                    start_time INTEGER,
+                    end_time INTEGER,
+                    count INTEGER,
+                    total REAL,
+                    min REAL,
+                    max REAL,
+                    time_data BLOB,
+                    value_data BLOB
+                )
+                """,
+                'CREATE UNIQUE INDEX archive_segments_idx ON archive_segments (id, start_time)',
+            ],
+            reverse_sql='DROP TABLE archive_segments',
+        ),
+    ]
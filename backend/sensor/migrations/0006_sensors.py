@@ -0,0 +1,137 @@
+from django.db import migrations
+
+from sensor.constants import ROLLUP_LEVELS
+
+ROLLUPS = [f'rollup_{level}' for level in ROLLUP_LEVELS]
+
+
+# copies of SensorManager.get_table_sensor_ids and the table schemas
+# frozen at the time of this migration, so later changes of
+# sensor.models don't change what it does on an old database
+def get_table_sensor_ids(cursor, table):
+    sensor_ids = []
+    cursor.execute(f'SELECT id FROM {table} ORDER BY id LIMIT 1')
+    row = cursor.fetchone()
+    while row is not None:
+        sensor_ids.append(row[0])
+        cursor.execute(f'SELECT id FROM {table} WHERE id > %s ORDER BY id LIMIT 1', row)
+        row = cursor.fetchone()
+    return sensor_ids
+
+
+def rebuild_table(cursor, table, create, columns, indexes=(), decode=False):
+    """
+    Copy table to a new one created by create with ids replaced by
+    sensor keys, or sensor keys replaced by ids if decode is set
+    """
+    new_id, old_id = ('id', 'sensor_key') if decode else ('sensor_key', 'id')
+    cursor.execute(create.format(table=f'{table}_new'))
+    cursor.execute(
+        f"""
+        INSERT INTO {table}_new
+        SELECT sensors.{new_id}, {columns}
+        FROM {table} JOIN sensors ON sensors.{old_id} = {table}.id
+        """
+    )
+    cursor.execute(f'DROP TABLE {table}')
+    cursor.execute(f'ALTER TABLE {table}_new RENAME TO {table}')
+    for index in indexes:
+        cursor.execute(index)
+
+
+def rebuild_tables(cursor, decode=False):
+    """
+    Rebuild partitions, archive segments and rollups, the sensors table
+    has to hold every id for encoding and every key for decoding
+    """
+    id_type = 'TEXT' if decode else 'INTEGER'
+    for table in get_partitions(cursor):
+        if table == 'datas':
+            continue
+        rebuild_table(
+            cursor,
+            table,
+            f'CREATE TABLE {{table}} (id {id_type}, time TIMESTAMP, value REAL)',
+            'time, value',
+            [f'CREATE INDEX {table}_idx ON {table} (id, time)'],
+            decode
+        )
+    rebuild_table(
+        cursor,
+        'archive_segments',
+        f"""
+        CREATE TABLE {{table}} (
+            id {id_type},
+            start_time INTEGER,
+            end_time INTEGER,
+            count INTEGER,
+            total REAL,
+            min REAL,
+            max REAL,
+            time_data BLOB,
+            value_data BLOB
+        )
+        """,
+        'start_time, end_time, count, total, min, max, time_data, value_data',
+        ['CREATE UNIQUE INDEX archive_segments_idx ON archive_segments (id, start_time)'],
+        decode
+    )
+    for table in ROLLUPS:
+        rebuild_table(
+            cursor,
+            table,
+            f"""
+            CREATE TABLE {{table}} (
+                id {id_type},
+                bucket INTEGER,
+                count INTEGER,
+                total REAL,
+                min REAL,
+                max REAL,
+                PRIMARY KEY (id, bucket)
+            ) WITHOUT ROWID
+            """,
+            'bucket, count, total, min, max',
+            decode=decode
+        )
+
+
+def get_partitions(cursor):
+    cursor.execute('SELECT name FROM datas_partitions')
+    return [name for name, in cursor.fetchall()]
+
+
+def encode_sensor_ids(apps, schema_editor):
+    cursor = schema_editor.connection.cursor()
+    for table in get_partitions(cursor) + ['archive_segments'] + ROLLUPS:
+        cursor.executemany(
+            'INSERT OR IGNORE INTO sensors (id) VALUES (%s)',
+            [(sensor_id,) for sensor_id in get_table_sensor_ids(cursor, table)]
+        )
+    rebuild_tables(cursor)
+
+
+def decode_sensor_ids(apps, schema_editor):
+    rebuild_tables(schema_editor.connection.cursor(), decode=True)
+
+
+class Migration(migrations.Migration):
+    """
+    Sensor ids are stored once in the sensors table, partitions,
+    archive segments and rollups store its integer key instead, so
+    their rows and (id, ...) indexes are smaller and compare faster.
+    The legacy datas table keeps text ids, rebuilding it would
+    take as long as partition_datas which empties it anyway
+    """
+
+    dependencies = [
+        ('sensor', '0005_archive_segments'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql='CREATE TABLE sensors (sensor_key INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE)',
+            reverse_sql='DROP TABLE sensors',
+        ),
+        migrations.RunPython(encode_sensor_ids, reverse_code=decode_sensor_ids),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensor', '0006_sensors'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE TABLE weather (
+                time INTEGER PRIMARY KEY,
+                temperature REAL
+            )
+            """,
+            reverse_sql='DROP TABLE weather',
+        ),
+    ]
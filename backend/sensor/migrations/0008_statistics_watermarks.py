@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensor', '0007_weather'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+            CREATE TABLE statistics_watermarks (
+                name TEXT PRIMARY KEY,
+                row INTEGER
+            )
+            """,
+            reverse_sql='DROP TABLE statistics_watermarks',
+        ),
+        # checkpoints used to be watermarked by reading time,
+        # they are rebuilt from scratch by the next run
+        migrations.RunSQL(
+            sql='DELETE FROM statistics_checkpoints',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -1,7 +1,29 @@
+import heapq
+import json
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from itertools import chain, islice
+from operator import itemgetter
+
 from django.core.cache import cache
-from django.db import connection
+from django.db import connection, connections, transaction
+
+import numpy as np
 
-from sensor.constants import SUPPORTED_SENSORS
+from sensor import archive, downsampling
+from sensor.constants import (
+    SUPPORTED_SENSORS,
+    ROLLUP_LEVELS,
+    READINGS_BATCH_SIZE,
+    READ_ONLY_DATABASE,
+    ARCHIVE_SEGMENT_SECONDS,
+    HOT_CACHE_INVALIDATION,
+    HOT_CACHE_CHANNEL,
+    WEATHER_MAX_AGE
+)
+from sensor.hotcache import HotCache, MISSING
 
 
 class SensorManager:
@@ -14,86 +36,1367 @@ class SensorManager:
     NB: cache manipulations should happen here not in views or tasks
     """
     HELSINKI_TEMPERATURE_KEY = 'helsinki_temperature'
+    # redis hash with count, total and latest temperature of a sensor
+    STATISTICS_KEY = 'sensor_statistics:{sensor_id}'
+    # hot cache key of get_statistics result
+    ALL_STATISTICS_KEY = 'sensor_statistics'
+    # redis hash with get_statistics result serialized
+    # as the statistics endpoint response, its version and modification time
+    STATISTICS_DOCUMENT_KEY = 'sensor_statistics_document'
+    hot_cache = HotCache()
+    # sensor api reports timestamps in milliseconds while datas rows
+    # are stored in seconds, anything above this is treated as milliseconds
+    MILLISECONDS_THRESHOLD = 10 ** 11
+    # upper bound of open-ended time ranges
+    MAX_TIMESTAMP = 2 ** 62
+    # partition created by create_iot_db.py, it stores sensor ids
+    # while other partitions store integer keys of the sensors table
+    LEGACY_PARTITION = 'datas'
+    # sensor id -> key of the sensors table, keys never change so
+    # committed ones are cached for the lifetime of the process
+    _sensor_keys = {}
 
     @staticmethod
-    def write_sensor_event(sensor_id: str, timestamp: int, value: float):
+    def raw_connection():
         # django connection.cursor raises a TypeError when doing the same thing
         # as arguments are interpolated differently:
         # https://github.com/django/django/blob/c1c163b42717ed5e051098ebf0e2f5c77810f20e/django/db/backends/sqlite3
         # /operations.py#L147
         # fetching original cursor object works just fine:
-        conn = connection.cursor().db.connection
-        cursor = conn.cursor()
+        return connection.cursor().db.connection
+
+    @classmethod
+    def read_connection(cls):
+        """
+        Connection to read-only database alias for queries which
+        don't need to see writes of the current transaction,
+        so they never hold a write lock of the ingest path
+        """
+        read_only = connections[READ_ONLY_DATABASE]
+        # tests run on an in-memory database which the read-only alias mirrors,
+        # a second connection to it wouldn't see rows of the test transaction
+        if read_only.is_in_memory_db():
+            return cls.raw_connection()
+        return read_only.cursor().db.connection
+
+    @classmethod
+    def get_sensor_key(cls, cursor, sensor_id: str):
+        """
+        Integer key of a sensor, None if the sensor was never stored
+        """
+        key = cls._sensor_keys.get(sensor_id)
+        if key is not None:
+            return key
+        cursor.execute('SELECT sensor_key FROM sensors WHERE id = ?', (sensor_id,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        # keys read inside a transaction might be rolled back
+        if not cursor.connection.in_transaction:
+            cls._sensor_keys[sensor_id] = row[0]
+        return row[0]
+
+    @classmethod
+    def get_or_create_sensor_keys(cls, cursor, sensor_ids):
+        """
+        Integer keys of sensors by id, missing sensors are registered,
+        has to run inside a transaction
+        """
+        keys = {}
+        created = {}
+        for sensor_id in set(sensor_ids):
+            key = cls._sensor_keys.get(sensor_id)
+            if key is None:
+                cursor.execute('INSERT OR IGNORE INTO sensors (id) VALUES (?)', (sensor_id,))
+                cursor.execute('SELECT sensor_key FROM sensors WHERE id = ?', (sensor_id,))
+                key = created[sensor_id] = cursor.fetchone()[0]
+            keys[sensor_id] = key
+        if created:
+            transaction.on_commit(lambda: cls._sensor_keys.update(created))
+        return keys
+
+    @classmethod
+    def partition_sensor(cls, table: str, sensor_id: str, key):
+        """
+        Value of the id column of a sensor in a datas partition
+        """
+        return sensor_id if table == cls.LEGACY_PARTITION else key
+
+    @classmethod
+    def to_seconds(cls, timestamp: int):
+        if timestamp > cls.MILLISECONDS_THRESHOLD:
+            return timestamp // 1000
+        return timestamp
+
+    @classmethod
+    def insert_events(cls, cursor, events):
+        """
+        Route events to monthly partitions, partitions are created on first write
+        """
+        keys = cls.get_or_create_sensor_keys(cursor, [event[0] for event in events])
+        partitions = {}
+        bounds = rows = None
+        for sensor_id, timestamp, value in events:
+            timestamp = cls.to_seconds(timestamp)
+            # batches almost always fall into a single month
+            if bounds is None or not bounds[1] <= timestamp < bounds[2]:
+                bounds = cls.partition_bounds(timestamp)
+                rows = partitions.setdefault(bounds, [])
+            rows.append((keys[sensor_id], timestamp, value))
+        for (name, start, end), rows in partitions.items():
+            cls.create_partition(cursor, name, start, end)
+            cursor.executemany(f'INSERT INTO {name} VALUES (?, ?, ?)', rows)
+
+    @staticmethod
+    def partition_bounds(timestamp: int):
+        """
+        Name, start and end of the monthly partition holding timestamp
+        """
+        moment = datetime.fromtimestamp(timestamp, timezone.utc)
+        start = moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if start.month == 12:
+            end = start.replace(year=start.year + 1, month=1)
+        else:
+            end = start.replace(month=start.month + 1)
+        return f'datas_{start:%Y%m}', int(start.timestamp()), int(end.timestamp())
+
+    @classmethod
+    def months_ago_cutoff(cls, months: int):
+        """
+        Start of the month which is the given number of
+        whole months before the current one
+        """
+        _, month_start, _ = cls.partition_bounds(int(time.time()))
+        current = datetime.fromtimestamp(month_start, timezone.utc)
+        months = current.year * 12 + current.month - 1 - months
+        cutoff = current.replace(year=months // 12, month=months % 12 + 1)
+        return int(cutoff.timestamp())
+
+    @staticmethod
+    def create_partition(cursor, name: str, start: int, end: int):
+        # IF NOT EXISTS statements don't touch the schema when
+        # the partition exists, so they are cheap enough to run per batch
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {name} (id INTEGER, time TIMESTAMP, value REAL)'
+        )
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name}_idx ON {name} (id, time)'
+        )
         cursor.execute(
-            'INSERT INTO datas VALUES (?, ?, ?)',
-            (sensor_id, timestamp, value)
+            'INSERT OR IGNORE INTO datas_partitions VALUES (?, ?, ?)',
+            (name, start, end)
         )
-        conn.commit()
+
+    @staticmethod
+    def get_partitions(cursor, start=None, end=None):
+        """
+        Names of datas partitions overlapping [start, end), oldest first,
+        the legacy datas table has no bounds and always overlaps
+        """
+        cursor.execute(
+            """
+            SELECT name
+            FROM datas_partitions
+            WHERE (start_time IS NULL OR ? IS NULL OR start_time < ?)
+              AND (end_time IS NULL OR ? IS NULL OR end_time > ?)
+            ORDER BY start_time
+            """,
+            (end, end, start, start)
+        )
+        return [name for name, in cursor.fetchall()]
 
     @classmethod
-    def update_sensor_statistics(cls, sensor_id: str, value: float):
-        sensor_data = cls.get(sensor_id, {})
-        old_count = sensor_data.get('count', 0)
-        count = old_count + 1
-        old_total = sensor_data.get('total', 0)
-        total = old_total + value
-        avg = total / count
-        return cls.set(
-            sensor_id,
-            count,
-            avg,
-            value,
-            total
+    def union_partitions(cls, cursor, query: str, sensor_id: str, params: tuple,
+                         start=None, end=None):
+        """
+        UNION ALL of query over partitions overlapping [start, end)
+        with its params, query selects from {table} and its first
+        parameter is the id column of the sensor followed by params
+        """
+        tables = cls.get_partitions(cursor, start, end)
+        key = cls.get_sensor_key(cursor, sensor_id)
+        return (
+            ' UNION ALL '.join(query.format(table=table) for table in tables),
+            tuple(chain.from_iterable(
+                (cls.partition_sensor(table, sensor_id, key),) + params
+                for table in tables
+            ))
+        )
+
+    @classmethod
+    def drop_partitions(cls, before: int):
+        """
+        Drop partitions, archive segments and weather readings which end
+        before the given time, returns names of dropped partitions
+        """
+        with transaction.atomic():
+            cursor = cls.raw_connection().cursor()
+            cursor.execute(
+                'SELECT name FROM datas_partitions WHERE end_time <= ? ORDER BY start_time',
+                (before,)
+            )
+            names = [name for name, in cursor.fetchall()]
+            for name in names:
+                cls.fold_into_checkpoints(cursor, name)
+                cls.drop_partition(cursor, name)
+            cursor.execute('DELETE FROM archive_segments WHERE end_time <= ?', (before,))
+            cursor.execute('DELETE FROM weather WHERE time < ?', (before,))
+        return names
+
+    @classmethod
+    def split_legacy_partition(cls, sensor_id: str):
+        """
+        Move rows of a sensor from the legacy datas table to monthly
+        partitions, one month per transaction so the writer is never
+        blocked for long. Returns number of moved rows
+
+        Workers used to store millisecond timestamps of the sensor api
+        as they are, such rows are moved to the month of their time
+        in seconds and converted
+        """
+        cursor = cls.raw_connection().cursor()
+        cursor.execute(
+            """
+            SELECT CAST(min(time) AS INTEGER), CAST(max(time) AS INTEGER)
+            FROM datas WHERE id = ? AND time <= ?
+            UNION ALL
+            SELECT CAST(min(time) AS INTEGER), CAST(max(time) AS INTEGER)
+            FROM datas WHERE id = ? AND time > ?
+            """,
+            (sensor_id, cls.MILLISECONDS_THRESHOLD) * 2
+        )
+        bounds = [
+            cls.to_seconds(timestamp)
+            for row in cursor.fetchall() for timestamp in row if timestamp is not None
+        ]
+        moved = 0
+        month_start = min(bounds, default=None)
+        while month_start is not None and month_start <= max(bounds):
+            name, month_start, month_end = cls.partition_bounds(month_start)
+            # seconds and milliseconds ranges of the month, both use the index
+            params = (sensor_id, month_start, month_end, month_start * 1000, month_end * 1000)
+            in_month = 'id = ? AND (time >= ? AND time < ? OR time >= ? AND time < ?)'
+            with transaction.atomic():
+                key = cls.get_or_create_sensor_keys(cursor, [sensor_id])[sensor_id]
+                cls.create_partition(cursor, name, month_start, month_end)
+                # moved rows get new rowids past the watermark of the partition,
+                # so whatever statistics haven't seen yet is folded first
+                cls.fold_into_checkpoints(cursor, cls.LEGACY_PARTITION, in_month, params)
+                cls.fold_into_checkpoints(cursor, name)
+                cursor.execute(
+                    f"""
+                    INSERT INTO {name}
+                    SELECT
+                        ?,
+                        CASE WHEN time > ? THEN CAST(time / 1000 AS INTEGER) ELSE time END,
+                        value
+                    FROM datas WHERE {in_month}
+                    """,
+                    (key, cls.MILLISECONDS_THRESHOLD) + params
+                )
+                # nothing is inserted to datas anymore, so rowids
+                # freed here can't be reused under its watermark
+                cursor.execute(f'DELETE FROM datas WHERE {in_month}', params)
+                moved += cursor.rowcount
+                cursor.execute(
+                    f'INSERT OR REPLACE INTO statistics_watermarks SELECT ?, max(rowid) FROM {name}',
+                    (name,)
+                )
+            month_start = month_end
+        return moved
+
+    @classmethod
+    def archive_partition(cls, name: str):
+        """
+        Compact a closed partition into archive segments of
+        ARCHIVE_SEGMENT_SECONDS per sensor and drop it, in one transaction.
+        Returns number of archived rows
+        """
+        archived = 0
+        with transaction.atomic():
+            cursor = cls.raw_connection().cursor()
+            for key in cls.get_table_sensor_ids(cursor, name):
+                cursor.execute(
+                    f"""
+                    SELECT CAST(time AS INTEGER), value
+                    FROM {name}
+                    WHERE id = ?
+                    ORDER BY time
+                    """,
+                    (key,)
+                )
+                readings = np.array(cursor.fetchall(), dtype=np.float64)
+                times = readings[:, 0].astype(np.int64)
+                values = readings[:, 1]
+                for start, end, part in archive.split_segments(times, ARCHIVE_SEGMENT_SECONDS):
+                    cls.write_segment(cursor, key, start, end, times[part], values[part])
+                archived += len(readings)
+            cls.fold_into_checkpoints(cursor, name)
+            cls.drop_partition(cursor, name)
+        return archived
+
+    @staticmethod
+    def drop_partition(cursor, name: str):
+        """
+        Drop a partition with its watermark, a partition created later
+        under the same name is aggregated from its first row
+        """
+        cursor.execute(f'DROP TABLE {name}')
+        cursor.execute('DELETE FROM datas_partitions WHERE name = ?', (name,))
+        cursor.execute('DELETE FROM statistics_watermarks WHERE name = ?', (name,))
+
+    @classmethod
+    def archive_partitions(cls, before: int):
+        """
+        Archive partitions which end before the given time,
+        returns (name, number of archived rows) of each one
+        """
+        cursor = cls.raw_connection().cursor()
+        cursor.execute(
+            'SELECT name FROM datas_partitions WHERE end_time <= ? ORDER BY start_time',
+            (before,)
+        )
+        return [
+            (name, cls.archive_partition(name))
+            for name, in cursor.fetchall()
+        ]
+
+    @staticmethod
+    def write_segment(cursor, key: int, start: int, end: int, times, values):
+        """
+        Store readings sorted by time as an archive segment, readings
+        are merged into the existing segment if the range was archived before
+        """
+        cursor.execute(
+            """
+            SELECT time_data, value_data
+            FROM archive_segments
+            WHERE id = ? AND start_time = ?
+            """,
+            (key, start)
+        )
+        existing = cursor.fetchone()
+        if existing is not None:
+            times = np.concatenate((archive.decode_times(existing[0]), times))
+            values = np.concatenate((archive.decode_values(existing[1]), values))
+            order = np.argsort(times, kind='mergesort')
+            times, values = times[order], values[order]
+        cursor.execute(
+            'INSERT OR REPLACE INTO archive_segments VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                key,
+                start,
+                end,
+                len(times),
+                float(values.sum()),
+                float(values.min()),
+                float(values.max()),
+                archive.encode_times(times),
+                archive.encode_values(values)
+            )
+        )
+
+    @staticmethod
+    def get_segments(cursor, key: int, start: int, end: int):
+        """
+        (start, end, count, total, min, max) of archive segments
+        of a sensor overlapping [start, end), oldest first
+        """
+        # segments are never longer than ARCHIVE_SEGMENT_SECONDS,
+        # the lower bound keeps it a range scan on archive_segments_idx
+        cursor.execute(
+            """
+            SELECT start_time, end_time, count, total, min, max
+            FROM archive_segments
+            WHERE id = ? AND start_time > ? AND start_time < ? AND end_time > ?
+            ORDER BY start_time
+            """,
+            (key, start - ARCHIVE_SEGMENT_SECONDS, end, start)
+        )
+        return cursor.fetchall()
+
+    @classmethod
+    def iter_archive(cls, cursor, key: int, start: int, end: int):
+        """
+        Yield (times, values) arrays of archived readings
+        of a sensor in [start, end), one segment at a time
+        """
+        # own cursor as segments are fetched lazily
+        segments = cursor.connection.cursor()
+        segments.execute(
+            """
+            SELECT start_time, end_time, time_data, value_data
+            FROM archive_segments
+            WHERE id = ? AND start_time > ? AND start_time < ? AND end_time > ?
+            ORDER BY start_time
+            """,
+            (key, start - ARCHIVE_SEGMENT_SECONDS, end, start)
+        )
+        for segment_start, segment_end, time_data, value_data in segments:
+            times = archive.decode_times(time_data)
+            values = archive.decode_values(value_data)
+            if segment_start < start or segment_end > end:
+                in_range = (times >= start) & (times < end)
+                times, values = times[in_range], values[in_range]
+            if len(times):
+                yield times, values
+
+    @classmethod
+    def aggregate_archive(cls, cursor, key: int, start: int, end: int):
+        """
+        Count, total, min and max of archived readings of a sensor in [start, end),
+        only segments cut by the window are decoded
+        """
+        parts = []
+        for segment_start, segment_end, *summary in cls.get_segments(
+                cursor, key, start, end):
+            if start <= segment_start and segment_end <= end:
+                parts.append(summary)
+                continue
+            for times, values in cls.iter_archive(
+                    cursor, key, max(start, segment_start), min(end, segment_end)):
+                parts.append(
+                    (len(times), float(values.sum()), float(values.min()), float(values.max()))
+                )
+        return cls.fold_aggregates(parts)
+
+    @classmethod
+    def ingest(cls, events):
+        """
+        Run (sensor_id, timestamp, value) tuples through the ingest pipeline,
+        see sensor.ingest for the stages
+        """
+        # imported here as ingest stages are built on top of SensorManager
+        from sensor.ingest import get_pipeline
+        return get_pipeline().run(events)
+
+    @classmethod
+    def upsert_rollups(cls, cursor, events):
+        """
+        Fold (sensor_id, timestamp, value) tuples into rollup tables,
+        events are aggregated per bucket in memory first,
+        so every rollup row is touched once per batch
+        """
+        keys = cls.get_or_create_sensor_keys(cursor, [event[0] for event in events])
+        buckets = {level: {} for level in ROLLUP_LEVELS}
+        for sensor_id, timestamp, value in events:
+            timestamp = cls.to_seconds(timestamp)
+            for level, size in ROLLUP_LEVELS.items():
+                key = (keys[sensor_id], timestamp - timestamp % size)
+                bucket = buckets[level].get(key)
+                if bucket is None:
+                    buckets[level][key] = [1, value, value, value]
+                else:
+                    bucket[0] += 1
+                    bucket[1] += value
+                    bucket[2] = min(bucket[2], value)
+                    bucket[3] = max(bucket[3], value)
+
+        for level, level_buckets in buckets.items():
+            cls.merge_rollup_buckets(cursor, level, level_buckets)
+
+    @staticmethod
+    def merge_rollup_buckets(cursor, level: str, buckets: dict):
+        """
+        Add {(sensor key, bucket): (count, total, min, max)} to a rollup level
+        """
+        # insert + update instead of upsert,
+        # so it works on sqlite versions without upsert support
+        cursor.executemany(
+            f'INSERT OR IGNORE INTO rollup_{level} VALUES (?, ?, 0, 0.0, ?, ?)',
+            [
+                (key, bucket, min_value, max_value)
+                for (key, bucket), (_, _, min_value, max_value)
+                in buckets.items()
+            ]
+        )
+        cursor.executemany(
+            f"""
+            UPDATE rollup_{level}
+            SET count = count + ?,
+                total = total + ?,
+                min = min(min, ?),
+                max = max(max, ?)
+            WHERE id = ? AND bucket = ?
+            """,
+            [
+                (count, total, min_value, max_value, key, bucket)
+                for (key, bucket), (count, total, min_value, max_value)
+                in buckets.items()
+            ]
         )
 
+    @classmethod
+    def backfill_rollups(cls, sensor_id: str):
+        """
+        Rebuild rollups of a sensor from datas table
+
+        Only the finest level is aggregated from raw rows,
+        every coarser level is aggregated from the previous one
+        """
+        levels = list(ROLLUP_LEVELS.items())
+        with transaction.atomic():
+            cursor = cls.raw_connection().cursor()
+            key = cls.get_or_create_sensor_keys(cursor, [sensor_id])[sensor_id]
+            for level, _ in levels:
+                cursor.execute(
+                    f'DELETE FROM rollup_{level} WHERE id = ?',
+                    (key,)
+                )
+            level, size = levels[0]
+            readings, params = cls.union_partitions(
+                cursor,
+                'SELECT time, value FROM {table} WHERE id = ?',
+                sensor_id,
+                ()
+            )
+            cursor.execute(
+                f"""
+                INSERT INTO rollup_{level}
+                SELECT ?, time - time % {size}, count(*), sum(value), min(value), max(value)
+                FROM ({readings})
+                GROUP BY 2
+                """,
+                (key,) + params
+            )
+            minutes = {}
+            for times, values in cls.iter_archive(cursor, key, 0, cls.MAX_TIMESTAMP):
+                aggregates = archive.aggregate_buckets(times, values, size)
+                # numpy scalars can't be sqlite parameters
+                for bucket, *aggregate in zip(*(array.tolist() for array in aggregates)):
+                    minutes[(key, bucket)] = aggregate
+            cls.merge_rollup_buckets(cursor, level, minutes)
+            for (source, _), (level, size) in zip(levels, levels[1:]):
+                cursor.execute(
+                    f"""
+                    INSERT INTO rollup_{level}
+                    SELECT id, bucket - bucket % {size}, sum(count), sum(total), min(min), max(max)
+                    FROM rollup_{source}
+                    WHERE id = ?
+                    GROUP BY 2
+                    """,
+                    (key,)
+                )
+
+    @classmethod
+    def incr_statistics(cls, pipe, events):
+        """
+        Queue statistics updates of events to pipe, events are summed
+        per sensor first so a batch costs three commands per sensor
+        whatever its size. The last event of a sensor sets its temperature
+        """
+        sums = {}
+        for sensor_id, timestamp, value in events:
+            count, total, _ = sums.get(sensor_id, (0, 0.0, None))
+            sums[sensor_id] = (count + 1, total + value, value)
+        keys = set()
+        for sensor_id, (count, total, value) in sums.items():
+            key = cls.statistics_key(sensor_id)
+            pipe.hincrby(key, 'count', count)
+            pipe.hincrbyfloat(key, 'total', total)
+            pipe.hset(key, 'temperature', value)
+            keys.add(key)
+        cls.publish_invalidation(pipe, keys)
+
     @classmethod
     def update_helsinki_temperature(cls, temperature: float):
-        return cache.set(
+        result = cache.set(
             cls.HELSINKI_TEMPERATURE_KEY,
             temperature,
             timeout=None
         )
+        if HOT_CACHE_INVALIDATION:
+            cls.redis().publish(HOT_CACHE_CHANNEL, cls.HELSINKI_TEMPERATURE_KEY)
+        return result
+
+    @classmethod
+    def write_weather(cls, timestamp: int, temperature: float):
+        """
+        Store a helsinki temperature reading, the weather table is
+        a time series of them keyed by time in seconds
+        """
+        cls.raw_connection().cursor().execute(
+            'INSERT OR REPLACE INTO weather VALUES (?, ?)',
+            (cls.to_seconds(timestamp), temperature)
+        )
+
+    @classmethod
+    def get_weather(cls, start: int, end: int):
+        """
+        (times, temperatures) arrays of helsinki temperature readings
+        in [start, end) ordered by time
+        """
+        cursor = cls.read_connection().cursor()
+        cursor.execute(
+            'SELECT time, temperature FROM weather WHERE time >= ? AND time < ? ORDER BY time',
+            (start, end)
+        )
+        rows = np.array(cursor.fetchall(), dtype=np.float64).reshape(-1, 2)
+        return rows[:, 0].astype(np.int64), rows[:, 1]
 
     @staticmethod
-    def get_stats_for_all_sensors():
+    def align_weather(times, values, weather_times, weather_temperatures,
+                      max_age=WEATHER_MAX_AGE):
+        """
+        As-of join of sensor readings with weather readings, both sorted
+        by time: every reading is matched with the latest weather reading
+        at or before it and at most max_age seconds older. Positions of
+        all readings are found by one searchsorted call instead of a lookup
+        per row. weather_times must not be empty.
+        Returns (times, differences) of matched readings
         """
-        Calculate count, avg and latest temperature
+        positions = np.searchsorted(weather_times, times, side='right') - 1
+        # readings before the first weather reading get -1
+        previous_times = weather_times[np.maximum(positions, 0)]
+        matched = (positions >= 0) & (times - previous_times <= max_age)
+        return (
+            times[matched],
+            np.abs(values[matched] - weather_temperatures[positions[matched]])
+        )
+
+    @classmethod
+    def iter_temp_diffs(cls, sensor_id: str, start: int, end: int):
         """
-        cursor = connection.cursor()
+        Yield (times, differences) arrays of readings of a sensor in [start, end)
+        and helsinki temperature at their time, batch by batch of iter_readings.
+        Only weather readings which can match a batch are loaded with it,
+        so memory is bounded by the batch size and not by the window
+        """
+        for rows in cls.iter_readings(sensor_id, start, end):
+            readings = np.array(rows, dtype=np.float64)
+            times = readings[:, 0].astype(np.int64)
+            weather_times, weather_temperatures = cls.get_weather(
+                int(times[0]) - WEATHER_MAX_AGE, int(times[-1]) + 1
+            )
+            if not len(weather_times):
+                continue
+            times, diffs = cls.align_weather(
+                times,
+                readings[:, 1],
+                weather_times,
+                weather_temperatures
+            )
+            if len(times):
+                yield times, diffs
+
+    @classmethod
+    def get_stats_for_all_sensors(cls, workers=1, since_checkpoints=False, save=True):
+        """
+        Calculate count, avg and latest temperature of every sensor,
+        with since_checkpoints only rows inserted after the previous run
+        are aggregated and folded into the checkpoint of each sensor.
+        Checkpoints are stored for the next run unless save is False
+
+        Runs are watermarked by the rowid of each partition, which follows
+        insertion order, so late and out of order readings are aggregated
+        exactly once whatever their time. Rows of the first run are read
+        with an (id, time) index seek per sensor and partition, newer ones
+        with a rowid range scan, so there is no GROUP BY over the whole
+        table. With workers > 1 sensors are aggregated in a process pool,
+        each one on its own read-only connection
+        """
+        checkpoints, watermarks = cls.get_checkpoints(), cls.get_watermarks()
+        cursor = cls.read_connection().cursor()
+        full = not (since_checkpoints and checkpoints)
+        row_bounds = cls.get_row_bounds(cursor, {} if full else watermarks)
+        sensor_ids = cls.get_sensor_ids()
+        if workers > 1:
+            db_path = connection.settings_dict['NAME']
+            # sqlite connections must not be carried over to forked processes
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                aggregates = list(executor.map(
+                    _aggregate_sensor_read_only,
+                    [db_path] * len(sensor_ids),
+                    sensor_ids,
+                    [row_bounds] * len(sensor_ids),
+                    [full] * len(sensor_ids)
+                ))
+        else:
+            aggregates = [
+                cls.aggregate_sensor(sensor_id, row_bounds, full)
+                for sensor_id in sensor_ids
+            ]
+
+        updated = {} if full else dict(checkpoints)
+        for sensor_id, aggregate in zip(sensor_ids, aggregates):
+            latest_time, count, total, value = updated.get(sensor_id, (None, 0, 0.0, None))
+            new_count, new_total, new_time, new_value = aggregate
+            if new_count:
+                count += new_count
+                total += new_total
+                if latest_time is None or new_time >= latest_time:
+                    latest_time, value = new_time, new_value
+            updated[sensor_id] = (latest_time, count, total, value)
+        if save:
+            cls.save_checkpoints(
+                updated,
+                {table: last for table, _, last in row_bounds},
+                (checkpoints, watermarks)
+            )
+        return [
+            (sensor_id, value, count, total / count, total)
+            for sensor_id, (_, count, total, value) in updated.items()
+            if count and sensor_id in sensor_ids
+        ]
+
+    @classmethod
+    def get_row_bounds(cls, cursor, watermarks: dict):
+        """
+        (table, after, last) rowid range of every partition which was
+        inserted after its watermark, last is the current latest row
+        """
+        row_bounds = []
+        for table in cls.get_partitions(cursor):
+            cursor.execute(f'SELECT max(rowid) FROM {table}')
+            row_bounds.append((table, watermarks.get(table, 0), cursor.fetchone()[0] or 0))
+        return row_bounds
+
+    @staticmethod
+    def plan_range(start: int, end: int, levels=None):
+        """
+        Split [start, end) into (level, start, end) parts so that the
+        middle is covered by the coarsest rollup buckets which fit
+        and finer levels only fill the edges, level None means raw rows
+        """
+        if levels is None:
+            levels = list(reversed(list(ROLLUP_LEVELS.items())))
+        if start >= end:
+            return []
+        if not levels:
+            return [(None, start, end)]
+        level, size = levels[0]
+        first = start - start % size
+        if first < start:
+            first += size
+        last = end - end % size
+        if first >= last:
+            return SensorManager.plan_range(start, end, levels[1:])
+        return (
+            SensorManager.plan_range(start, first, levels[1:]) +
+            [(level, first, last)] +
+            SensorManager.plan_range(last, end, levels[1:])
+        )
+
+    @classmethod
+    def aggregate_range(cls, sensor_id: str, start: int, end: int):
+        """
+        Count, total, min and max of sensor values in [start, end),
+        read from rollups, raw rows are only read at the edges
+        so the cost doesn't depend on the size of the window
+        """
+        cursor = cls.read_connection().cursor()
+        key = cls.get_sensor_key(cursor, sensor_id)
+        parts = []
+        for level, part_start, part_end in cls.plan_range(start, end):
+            if level is None:
+                parts.append(
+                    cls.aggregate_archive(cursor, key, part_start, part_end)
+                )
+                readings, params = cls.union_partitions(
+                    cursor,
+                    'SELECT value FROM {table} WHERE id = ? AND time >= ? AND time < ?',
+                    sensor_id,
+                    (part_start, part_end),
+                    part_start,
+                    part_end
+                )
+                cursor.execute(
+                    f"""
+                    SELECT count(*), sum(value), min(value), max(value)
+                    FROM ({readings})
+                    """,
+                    params
+                )
+            else:
+                cursor.execute(
+                    f"""
+                    SELECT sum(count), sum(total), min(min), max(max)
+                    FROM rollup_{level}
+                    WHERE id = ? AND bucket >= ? AND bucket < ?
+                    """,
+                    (key, part_start, part_end)
+                )
+            parts.append(cursor.fetchone())
+        return cls.fold_aggregates(parts)
+
+    @staticmethod
+    def fold_aggregates(parts):
+        """
+        Combine (count, total, min, max) aggregates, empty ones are skipped
+        """
+        count, total, min_value, max_value = 0, 0.0, None, None
+        for part_count, part_total, part_min, part_max in parts:
+            if not part_count:
+                continue
+            count += part_count
+            total += part_total
+            min_value = part_min if min_value is None else min(min_value, part_min)
+            max_value = part_max if max_value is None else max(max_value, part_max)
+        return count, total, min_value, max_value
+
+    @classmethod
+    def aggregate_range_buckets(cls, sensor_id: str, start: int, end: int, level: str):
+        """
+        Same as aggregate_range for every bucket of a rollup level
+        overlapping [start, end), buckets cut by the window are
+        aggregated from finer levels. Empty buckets are skipped
+
+        Returns a list of (bucket, count, total, min, max)
+        """
+        size = ROLLUP_LEVELS[level]
+        first = start - start % size
+        if first < start:
+            first += size
+        last = max(end - end % size, first)
+        buckets = []
+        if start < min(first, end):
+            buckets.append((start,) + cls.aggregate_range(sensor_id, start, min(first, end)))
+        if first < last:
+            cursor = cls.read_connection().cursor()
+            cursor.execute(
+                f"""
+                SELECT bucket, count, total, min, max
+                FROM rollup_{level}
+                WHERE id = ? AND bucket >= ? AND bucket < ?
+                ORDER BY bucket
+                """,
+                (cls.get_sensor_key(cursor, sensor_id), first, last)
+            )
+            buckets.extend(cursor)
+        if first <= last < end:
+            buckets.append((last,) + cls.aggregate_range(sensor_id, last, end))
+        return [bucket for bucket in buckets if bucket[1]]
+
+    @classmethod
+    def iter_readings(cls, sensor_id: str, start: int, end: int,
+                      batch_size=READINGS_BATCH_SIZE):
+        """
+        Yield lists of (time, value) rows of a sensor in [start, end)
+        ordered by time, rows are fetched in batches from a main_idx range
+        scan so the result is never materialized as a whole
+        """
+        conn = cls.read_connection()
+        key = cls.get_sensor_key(conn.cursor(), sensor_id)
+        cursors = []
+        for table in cls.get_partitions(conn.cursor(), start, end):
+            cursor = conn.cursor()
+            cursor.execute(
+                f"""
+                SELECT CAST(time AS INTEGER), value
+                FROM {table}
+                WHERE id = ? AND time >= ? AND time < ?
+                ORDER BY time
+                """,
+                (cls.partition_sensor(table, sensor_id, key), start, end)
+            )
+            cursors.append(cursor)
+        sources = list(cursors)
+        archived = cls.iter_archive(conn.cursor(), key, start, end)
+        first = next(archived, None)
+        if first is not None:
+            sources.append(
+                row
+                for times, values in chain([first], archived)
+                for row in zip(times.tolist(), values.tolist())
+            )
+        if len(sources) == 1 and cursors:
+            batches = iter(lambda: cursors[0].fetchmany(batch_size), [])
+        else:
+            # every partition is read in index order, sorting
+            # a UNION ALL of them would materialize the whole window
+            rows = heapq.merge(*sources, key=itemgetter(0))
+            batches = iter(lambda: list(islice(rows, batch_size)), [])
+        yield from batches
+
+    @classmethod
+    def get_bucket_averages(cls, sensor_id: str, start: int, end: int, buckets: int):
+        """
+        Average time and value of every non-empty bucket when [start, end)
+        is split into buckets of equal duration, returns them
+        with the total number of readings in the window
+        """
+        cursor = cls.read_connection().cursor()
+        readings, params = cls.union_partitions(
+            cursor,
+            'SELECT time, value FROM {table} WHERE id = ? AND time >= ? AND time < ?',
+            sensor_id,
+            (start, end),
+            start,
+            end
+        )
         cursor.execute(
+            f"""
+            SELECT (time - ?) * ? / ? AS bucket, sum(time), sum(value), count(*)
+            FROM ({readings})
+            GROUP BY bucket
+            """,
+            (start, buckets, end - start) + params
+        )
+        sums = {bucket: row for bucket, *row in cursor}
+        key = cls.get_sensor_key(cursor, sensor_id)
+        for times, values in cls.iter_archive(cursor, key, start, end):
+            indexes = downsampling.bucket_indexes(times, start, end, buckets)
+            archived, inverse = np.unique(indexes, return_inverse=True)
+            for bucket, time_sum, value_sum, bucket_count in zip(
+                    archived.tolist(),
+                    np.bincount(inverse, weights=times).tolist(),
+                    np.bincount(inverse, weights=values).tolist(),
+                    np.bincount(inverse).tolist()):
+                time_sum_so_far, value_sum_so_far, count_so_far = sums.get(bucket, (0, 0.0, 0))
+                sums[bucket] = (
+                    time_sum_so_far + time_sum,
+                    value_sum_so_far + value_sum,
+                    count_so_far + bucket_count
+                )
+        averages = {}
+        count = 0
+        for bucket, (time_sum, value_sum, bucket_count) in sums.items():
+            averages[bucket] = (time_sum / bucket_count, value_sum / bucket_count)
+            count += bucket_count
+        return averages, count
+
+    @classmethod
+    def get_last_reading(cls, sensor_id: str, start: int, end: int, conn=None):
+        """
+        (time, value) of the latest reading of a sensor in [start, end),
+        a single main_idx seek per overlapping partition
+        """
+        cursor = (conn or cls.read_connection()).cursor()
+        key = cls.get_sensor_key(cursor, sensor_id)
+        latest = cls.get_last_archived_reading(cursor, key, start, end)
+        for table in cls.get_partitions(cursor, start, end):
+            cursor.execute(
+                f"""
+                SELECT CAST(time AS INTEGER), value
+                FROM {table}
+                WHERE id = ? AND time >= ? AND time < ?
+                ORDER BY time DESC
+                LIMIT 1
+                """,
+                (cls.partition_sensor(table, sensor_id, key), start, end)
+            )
+            row = cursor.fetchone()
+            if row is not None and (latest is None or row[0] > latest[0]):
+                latest = row
+        return latest
+
+    @classmethod
+    def get_last_archived_reading(cls, cursor, key: int, start: int, end: int):
+        segments = cursor.connection.cursor()
+        segments.execute(
             """
-            SELECT id, value, count(*), avg(value), sum(value)
-            FROM datas
+            SELECT start_time, end_time
+            FROM archive_segments
+            WHERE id = ? AND start_time > ? AND start_time < ? AND end_time > ?
+            ORDER BY start_time DESC
+            """,
+            (key, start - ARCHIVE_SEGMENT_SECONDS, end, start)
+        )
+        # the latest segment can be empty within the window
+        for segment_start, segment_end in segments:
+            for times, values in cls.iter_archive(
+                    cursor, key, max(start, segment_start), min(end, segment_end)):
+                return int(times[-1]), float(values[-1])
+        return None
+
+    @classmethod
+    def get_series(cls, sensor_id: str, start: int, end: int, points: int,
+                   method='lttb'):
+        """
+        At most points (time, value) readings of a sensor in [start, end)
+        downsampled with lttb or minmax, see sensor.downsampling
+        """
+        readings = cls.iter_readings(sensor_id, start, end)
+        if method == 'minmax':
+            return downsampling.min_max(readings, start, end, points)
+        averages, count = cls.get_bucket_averages(sensor_id, start, end, points - 2)
+        if count <= points:
+            return [list(row) for rows in readings for row in rows]
+        last_point = cls.get_last_reading(sensor_id, start, end)
+        return downsampling.lttb(readings, start, end, points, averages, last_point)
+
+    @classmethod
+    def get_sensor_ids(cls):
+        """
+        Distinct sensor ids stored in datas partitions and the archive, each one
+        is found with a single index seek per table instead of scanning the whole index
+        """
+        cursor = cls.read_connection().cursor()
+        sensor_ids = set()
+        keys = set()
+        for table in cls.get_partitions(cursor) + ['archive_segments']:
+            if table == cls.LEGACY_PARTITION:
+                sensor_ids.update(cls.get_table_sensor_ids(cursor, table))
+            else:
+                keys.update(cls.get_table_sensor_ids(cursor, table))
+        cursor.execute(
+            f'SELECT id FROM sensors WHERE sensor_key IN ({", ".join("?" * len(keys))})',
+            tuple(keys)
+        )
+        sensor_ids.update(sensor_id for sensor_id, in cursor.fetchall())
+        return sorted(sensor_ids)
+
+    @staticmethod
+    def get_table_sensor_ids(cursor, table: str):
+        sensor_ids = []
+        cursor.execute(f'SELECT id FROM {table} ORDER BY id LIMIT 1')
+        row = cursor.fetchone()
+        while row is not None:
+            sensor_ids.append(row[0])
+            cursor.execute(
+                f'SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT 1',
+                row
+            )
+            row = cursor.fetchone()
+        return sensor_ids
+
+    @classmethod
+    def aggregate_sensor(cls, sensor_id: str, row_bounds=None, archived=True, conn=None):
+        """
+        Calculate count, total, time and value of the latest reading
+        of a sensor for rows in the (table, after, last) rowid ranges of
+        row_bounds (all rows if None) and archived readings if archived is set,
+        read-only connection is used unless conn is given
+
+        Ranges starting at the first row are read with the (id, time) index,
+        the others are rowid range scans. Rows inserted after last
+        are left for the next run
+        """
+        conn = conn or cls.read_connection()
+        cursor = conn.cursor()
+        if row_bounds is None:
+            row_bounds = cls.get_row_bounds(cursor, {})
+        key = cls.get_sensor_key(cursor, sensor_id)
+        count, total = 0, 0.0
+        latest = None
+        if archived:
+            count, total, _, _ = cls.aggregate_archive(cursor, key, 0, cls.MAX_TIMESTAMP)
+            latest = cls.get_last_archived_reading(cursor, key, 0, cls.MAX_TIMESTAMP)
+        for table, after, last in row_bounds:
+            if after >= last:
+                continue
+            if after:
+                # unary plus keeps the planner off the (id, time) index
+                condition = 'rowid > ? AND rowid <= ? AND +id = ?'
+                params = (after, last, cls.partition_sensor(table, sensor_id, key))
+            else:
+                condition = 'id = ? AND rowid <= ?'
+                params = (cls.partition_sensor(table, sensor_id, key), last)
+            cursor.execute(
+                f'SELECT count(*), sum(value) FROM {table} WHERE {condition}', params
+            )
+            table_count, table_total = cursor.fetchone()
+            if not table_count:
+                continue
+            count += table_count
+            total += table_total
+            cursor.execute(
+                f"""
+                SELECT CAST(time AS INTEGER), value
+                FROM {table}
+                WHERE {condition}
+                ORDER BY time DESC
+                LIMIT 1
+                """,
+                params
+            )
+            # legacy rows can hold milliseconds
+            reading_time, value = cursor.fetchone()
+            if latest is None or cls.to_seconds(reading_time) > latest[0]:
+                latest = cls.to_seconds(reading_time), value
+        if latest is None:
+            return 0, 0.0, None, None
+        return (count, total) + tuple(latest)
+
+    @classmethod
+    def get_checkpoints(cls):
+        """
+        Statistics aggregated so far by sensor id,
+        values are (time, count, total, value) tuples where
+        time and value are the ones of the latest reading
+        """
+        cursor = cls.raw_connection().cursor()
+        cursor.execute(
+            'SELECT id, time, count, total, value FROM statistics_checkpoints'
+        )
+        return {row[0]: row[1:] for row in cursor}
+
+    @classmethod
+    def get_watermarks(cls):
+        """
+        Rowid of the last row of each partition aggregated into checkpoints
+        """
+        cursor = cls.raw_connection().cursor()
+        cursor.execute('SELECT name, row FROM statistics_watermarks')
+        return dict(cursor)
+
+    @classmethod
+    def save_checkpoints(cls, checkpoints: dict, watermarks: dict, previous):
+        """
+        Replace checkpoints and watermarks in one transaction unless
+        they differ from previous (checkpoints, watermarks) read before
+        the run, partitions were archived, dropped or split meanwhile
+        and the next run starts from what they left. Returns whether saved
+        """
+        with transaction.atomic():
+            if (cls.get_checkpoints(), cls.get_watermarks()) != previous:
+                return False
+            cursor = cls.raw_connection().cursor()
+            cursor.execute('DELETE FROM statistics_checkpoints')
+            cursor.executemany(
+                'INSERT INTO statistics_checkpoints VALUES (?, ?, ?, ?, ?)',
+                [(sensor_id,) + checkpoint for sensor_id, checkpoint in checkpoints.items()]
+            )
+            cursor.execute('DELETE FROM statistics_watermarks')
+            cursor.executemany(
+                'INSERT INTO statistics_watermarks VALUES (?, ?)',
+                watermarks.items()
+            )
+        return True
+
+    @classmethod
+    def fold_into_checkpoints(cls, cursor, table: str, condition='1', params=()):
+        """
+        Add rows of a partition matching condition which were inserted after
+        its watermark to the checkpoints, has to run inside the transaction
+        which moves or drops them. Nothing to do before the first run
+        """
+        cursor.execute('SELECT count(*) FROM statistics_checkpoints')
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute('SELECT row FROM statistics_watermarks WHERE name = ?', (table,))
+        row = cursor.fetchone()
+        sensor = 'id' if table == cls.LEGACY_PARTITION else (
+            f'(SELECT id FROM sensors WHERE sensor_key = {table}.id)'
+        )
+        # value is taken from the row with the latest time
+        cursor.execute(
+            f"""
+            SELECT
+                {sensor},
+                count(*),
+                sum(value),
+                max(CASE
+                    WHEN time > ? THEN CAST(time / 1000 AS INTEGER)
+                    ELSE CAST(time AS INTEGER)
+                END),
+                value
+            FROM {table}
+            WHERE rowid > ? AND {condition}
             GROUP BY id
-            ORDER BY time DESC
-            """
+            """,
+            (cls.MILLISECONDS_THRESHOLD, row[0] if row else 0) + params
         )
-        result = list(cursor)
-        connection.close()
-        return result
+        for sensor_id, count, total, latest_time, value in cursor.fetchall():
+            cursor.execute(
+                'INSERT OR IGNORE INTO statistics_checkpoints VALUES (?, NULL, 0, 0.0, NULL)',
+                (sensor_id,)
+            )
+            # all expressions see the row before the update
+            cursor.execute(
+                """
+                UPDATE statistics_checkpoints SET
+                    count = count + ?,
+                    total = total + ?,
+                    value = CASE WHEN time IS NULL OR time <= ? THEN ? ELSE value END,
+                    time = CASE WHEN time IS NULL OR time <= ? THEN ? ELSE time END
+                WHERE id = ?
+                """,
+                (count, total, latest_time, value, latest_time, latest_time, sensor_id)
+            )
+
+    @classmethod
+    def get_stats_since_checkpoints(cls, workers=1, save=True):
+        """
+        Same as get_stats_for_all_sensors but rows which were
+        aggregated by the previous run are not read again
+        """
+        return cls.get_stats_for_all_sensors(workers, since_checkpoints=True, save=save)
 
     @staticmethod
-    def get(sensor_id, default=None):
-        return cache.get(sensor_id, default)
+    def redis():
+        """
+        Raw redis client behind django cache,
+        statistics are stored as redis hashes which django cache can't do
+        """
+        return cache.get_master_client()
+
+    @classmethod
+    def statistics_key(cls, sensor_id: str):
+        return cls.STATISTICS_KEY.format(sensor_id=sensor_id)
+
+    @classmethod
+    def ensure_hot_cache_listener(cls):
+        """
+        With HOT_CACHE_INVALIDATION make sure this process drops published
+        keys from its hot cache, every hot cache reader calls it
+        """
+        if HOT_CACHE_INVALIDATION:
+            cls.hot_cache.listen(cls.redis(), HOT_CACHE_CHANNEL)
+
+    @classmethod
+    def cached(cls, key: str, load):
+        """
+        Read key through the per-process hot cache, load() reads it from redis
+        """
+        cls.ensure_hot_cache_listener()
+        return cls.hot_cache.get_or_set(key, load)
+
+    @classmethod
+    def publish_invalidation(cls, pipe, keys):
+        """
+        Queue a message dropping keys from hot caches of all
+        processes, the list of all sensors changes with any of them
+        """
+        if HOT_CACHE_INVALIDATION and keys:
+            pipe.publish(HOT_CACHE_CHANNEL, ','.join(sorted(keys) + [cls.ALL_STATISTICS_KEY]))
 
     @staticmethod
-    def set(sensor_id: str, count: int, avg, temperature: float, total: float):
-        return cache.set(
-            sensor_id,
-            {
-                'count': count,
-                'avg': avg,
-                'temperature': temperature,
-                'total': total
-            },
-            timeout=None
+    def parse_statistics(data: dict, default=None):
+        """
+        Convert HGETALL result to a dict with count, avg, temperature and total
+        """
+        if not data:
+            return default
+        count = int(data[b'count'])
+        total = float(data[b'total'])
+        temperature = data.get(b'temperature')
+        return {
+            'count': count,
+            'avg': total / count,
+            'temperature': float(temperature) if temperature is not None else None,
+            'total': total
+        }
+
+    @classmethod
+    def get(cls, sensor_id, default=None):
+        """
+        Statistics of a sensor, the returned dict is shared
+        by the hot cache and must not be modified
+        """
+        key = cls.statistics_key(sensor_id)
+        statistics = cls.cached(
+            key,
+            lambda: cls.parse_statistics(cls.redis().hgetall(key))
+        )
+        return default if statistics is None else statistics
+
+    @classmethod
+    def set(cls, sensor_id: str, count: int, temperature: float, total: float):
+        return cls.set_many([(sensor_id, count, temperature, total)])
+
+    @classmethod
+    def set_many(cls, stats):
+        """
+        Replace statistics of several sensors in one round-trip,
+        stats is a list of (sensor_id, count, temperature, total)
+        """
+        pipe = cls.redis().pipeline()
+        keys = set()
+        for sensor_id, count, temperature, total in stats:
+            key = cls.statistics_key(sensor_id)
+            pipe.delete(key)
+            pipe.hmset(
+                key,
+                {
+                    'count': count,
+                    'temperature': temperature,
+                    'total': total
+                }
+            )
+            keys.add(key)
+        cls.publish_invalidation(pipe, keys)
+        result = pipe.execute()
+        cls.refresh_statistics_document()
+        return result
+
+    @classmethod
+    def get_helsinki_temperature(cls):
+        return cls.cached(
+            cls.HELSINKI_TEMPERATURE_KEY,
+            lambda: cache.get(cls.HELSINKI_TEMPERATURE_KEY)
+        )
+
+    @classmethod
+    def helsinki_temperature_redis_key(cls):
+        """
+        Redis key of the temperature stored by django cache,
+        for clients reading it without django cache
+        """
+        return str(cache.make_key(cls.HELSINKI_TEMPERATURE_KEY))
+
+    @staticmethod
+    def parse_helsinki_temperature(value):
+        """
+        Convert GET result of helsinki_temperature_redis_key the way django cache does
+        """
+        return None if value is None else cache.get_value(value)
+
+    @classmethod
+    def get_statistics(cls):
+        """
+        Count and avg of all sensors with statistics, the returned
+        list is shared by the hot cache and must not be modified
+        """
+        return cls.cached(cls.ALL_STATISTICS_KEY, cls.read_statistics)
+
+    @classmethod
+    def get_statistics_document(cls):
+        """
+        (body, version, modified) of the statistics endpoint response,
+        it is built on first use if no worker has done it yet
+        """
+        return cls.cached(cls.STATISTICS_DOCUMENT_KEY, cls.read_statistics_document)
+
+    @classmethod
+    def read_statistics_document(cls):
+        document = cls.parse_statistics_document(
+            cls.redis().hgetall(cls.STATISTICS_DOCUMENT_KEY)
         )
+        return document or cls.refresh_statistics_document()
 
     @staticmethod
-    def get_statistics():
-        data = cache.get_many(SUPPORTED_SENSORS)
+    def parse_statistics_document(data: dict):
+        """
+        Convert HGETALL result of the statistics document to (body, version, modified)
+        """
+        if not data:
+            return None
+        return data[b'body'], int(data[b'version']), float(data[b'modified'])
+
+    @classmethod
+    def refresh_statistics_document(cls):
+        """
+        Serialize statistics of all sensors and bump the document version,
+        called whenever statistics change so requests only read bytes.
+        Statistics keys are watched, so a document built from older
+        statistics can't overwrite a newer one. Returns (body, version, modified)
+        """
+        keys = [cls.statistics_key(sensor_id) for sensor_id in SUPPORTED_SENSORS]
+        document = {}
+
+        def write(pipe):
+            document['body'] = json.dumps({'sensors': cls.read_statistics()}).encode()
+            document['modified'] = time.time()
+            pipe.multi()
+            pipe.hmset(cls.STATISTICS_DOCUMENT_KEY, document)
+            pipe.hincrby(cls.STATISTICS_DOCUMENT_KEY, 'version', 1)
+            cls.publish_invalidation(pipe, [cls.STATISTICS_DOCUMENT_KEY])
+
+        version = cls.redis().transaction(write, *keys)[1]
+        return document['body'], version, document['modified']
+
+    @classmethod
+    def read_statistics(cls):
+        pipe = cls.redis().pipeline(transaction=False)
+        for sensor_id in SUPPORTED_SENSORS:
+            pipe.hgetall(cls.statistics_key(sensor_id))
         sensors = []
-        for sensor_id, details in data.items():
+        for sensor_id, data in zip(SUPPORTED_SENSORS, pipe.execute()):
+            details = cls.parse_statistics(data)
+            if details is None:
+                continue
             sensors.append(
                 {
                     'id': sensor_id,
@@ -105,9 +1408,62 @@ class SensorManager:
 
     @classmethod
     def get_helsinki_temp_diff(cls, sensor_id: str):
-        sensor_temp = cls.get(sensor_id, {}).get('temperature')
-        helsinki_temp = cls.get(cls.HELSINKI_TEMPERATURE_KEY)
+        return cls.temp_diff(cls.get(sensor_id), cls.get_helsinki_temperature())
+
+    @classmethod
+    def get_helsinki_temp_diffs(cls, sensor_ids):
+        """
+        {sensor_id: difference or None} of several sensors, statistics
+        missing from the hot cache and helsinki temperature are read
+        in one round-trip
+        """
+        cls.ensure_hot_cache_listener()
+        helsinki_temp, helsinki_generation = cls.hot_cache.lookup(cls.HELSINKI_TEMPERATURE_KEY)
+        statistics = {}
+        missing = {}
+        for sensor_id in sensor_ids:
+            key = cls.statistics_key(sensor_id)
+            statistics[sensor_id], generation = cls.hot_cache.lookup(key)
+            if statistics[sensor_id] is MISSING:
+                missing[sensor_id] = key, generation
+        if missing or helsinki_temp is MISSING:
+            pipe = cls.redis().pipeline(transaction=False)
+            for key, _ in missing.values():
+                pipe.hgetall(key)
+            pipe.get(cls.helsinki_temperature_redis_key())
+            *statistics_data, helsinki_data = pipe.execute()
+            for (sensor_id, (key, generation)), data in zip(missing.items(), statistics_data):
+                statistics[sensor_id] = cls.parse_statistics(data)
+                cls.hot_cache.store(key, statistics[sensor_id], generation)
+            if helsinki_temp is MISSING:
+                helsinki_temp = cls.parse_helsinki_temperature(helsinki_data)
+                cls.hot_cache.store(
+                    cls.HELSINKI_TEMPERATURE_KEY, helsinki_temp, helsinki_generation
+                )
+        return {
+            sensor_id: cls.temp_diff(statistics[sensor_id], helsinki_temp)
+            for sensor_id in sensor_ids
+        }
+
+    @staticmethod
+    def temp_diff(statistics, helsinki_temp):
+        """
+        Difference between the latest temperature of a sensor
+        and helsinki temperature, None if either is unknown
+        """
+        sensor_temp = (statistics or {}).get('temperature')
         try:
             return abs(sensor_temp - helsinki_temp)
         except TypeError:
             return None
+
+
+def _aggregate_sensor_read_only(db_path: str, sensor_id: str, row_bounds=None, archived=True):
+    """
+    Process pool entry point for SensorManager.get_stats_for_all_sensors
+    """
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True)
+    try:
+        return SensorManager.aggregate_sensor(sensor_id, row_bounds, archived, conn=conn)
+    finally:
+        conn.close()
@@ -0,0 +1,197 @@
+"""
+Live stream of sensor readings as server-sent events
+
+Ingest publishes every batch of readings to READINGS_CHANNEL (see
+sensor.ingest.PublishStage). A process serving the stream holds a single
+redis subscription and fans batches out to all connected clients, so
+a dashboard keeps one connection open instead of polling the api:
+
+    const source = new EventSource('/sensor/stream/?ids=abba,iddqd&token=...')
+    source.addEventListener('readings', event => JSON.parse(event.data))
+
+EventSource can't send headers, so the access token is passed as
+a query parameter, an Authorization header works as well.
+It requires aioredis, see backend.asgi for running it
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from sensor.auth import get_bearer_token, get_token_user_id
+from sensor.constants import (
+    READINGS_CHANNEL,
+    REDIS_URL,
+    STREAM_HEARTBEAT_SECONDS,
+    STREAM_QUEUE_SIZE,
+    SUPPORTED_SENSOR_IDS
+)
+
+try:
+    import aioredis
+except ImportError:
+    aioredis = None
+
+
+def format_event(event: str, data: bytes):
+    return b'event: ' + event.encode() + b'\ndata: ' + data + b'\n\n'
+
+
+class ReadingsHub:
+    """
+    Fan-out of the readings channel to per-client queues
+
+    Clients subscribe to a set of sensor ids (None for all sensors)
+    and get batches of their readings as encoded events. A client which
+    doesn't keep up gets None once its queue is full and has to reconnect,
+    so a slow connection never holds up the others
+    """
+    def __init__(self, address=REDIS_URL, channel=READINGS_CHANNEL,
+                 queue_size=STREAM_QUEUE_SIZE):
+        self.address = address
+        self.channel = channel
+        self.queue_size = queue_size
+        self.clients = {}
+        self._task = None
+
+    def start(self):
+        """
+        Subscribe to the channel on first use, the subscription
+        is kept and reconnected for the lifetime of the process
+        """
+        if self._task is None or self._task.done():
+            if aioredis is None:
+                raise ImportError('Readings stream requires aioredis')
+            self._task = asyncio.ensure_future(self._subscribe())
+
+    async def _subscribe(self):
+        while True:
+            conn = None
+            try:
+                conn = await aioredis.create_redis(self.address)
+                channel, = await conn.subscribe(self.channel)
+                async for message in channel.iter():
+                    self.publish(message)
+            except (OSError, aioredis.RedisError):
+                logging.exception('Readings stream subscription failed')
+            finally:
+                if conn is not None:
+                    conn.close()
+            await asyncio.sleep(1)
+
+    def subscribe(self, sensor_ids=None):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.clients[queue] = sensor_ids
+        return queue
+
+    def unsubscribe(self, queue):
+        self.clients.pop(queue, None)
+
+    def publish(self, message: bytes):
+        """
+        Put readings of a published batch to queues of clients subscribed
+        to them, every distinct set of sensor ids is encoded once
+        """
+        readings = json.loads(message)
+        events = {}
+        for queue, sensor_ids in list(self.clients.items()):
+            if sensor_ids not in events:
+                selected = readings if sensor_ids is None else [
+                    reading for reading in readings if reading['id'] in sensor_ids
+                ]
+                events[sensor_ids] = selected and format_event(
+                    'readings', json.dumps(selected).encode()
+                )
+            if not events[sensor_ids]:
+                continue
+            try:
+                queue.put_nowait(events[sensor_ids])
+            except asyncio.QueueFull:
+                self.unsubscribe(queue)
+                queue.get_nowait()
+                queue.put_nowait(None)
+
+
+hub = ReadingsHub()
+
+
+async def send_response(send, status: int, body: bytes, headers=()):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')] + list(headers)
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def wait_for_disconnect(receive):
+    """
+    Return once the client disconnects, servers send the request body
+    as http.request messages first
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def stream_readings(scope, receive, send, hub=hub):
+    """
+    ASGI app of GET /sensor/stream/?ids=&token=, ids are comma separated
+    sensor ids and default to all sensors
+    """
+    query = parse_qs(scope['query_string'].decode())
+    headers = dict(scope['headers'])
+    token = query.get('token', [None])[0] or get_bearer_token(
+        headers.get(b'authorization', b'').decode()
+    )
+    if get_token_user_id(token) is None:
+        await send_response(
+            send, 401, b'{"detail": "Authentication credentials were not provided."}'
+        )
+        return
+    sensor_ids = None
+    if query.get('ids'):
+        sensor_ids = frozenset(query['ids'][0].split(','))
+        if not sensor_ids <= SUPPORTED_SENSOR_IDS:
+            await send_response(send, 404, b'{"detail": "No such sensor"}')
+            return
+
+    hub.start()
+    queue = hub.subscribe(sensor_ids)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # nginx would buffer the stream otherwise
+                (b'x-accel-buffering', b'no')
+            ]
+        })
+        await send({'type': 'http.response.body', 'body': b': connected\n\n', 'more_body': True})
+        while True:
+            event = asyncio.ensure_future(queue.get())
+            done, _ = await asyncio.wait(
+                [event, disconnected],
+                timeout=STREAM_HEARTBEAT_SECONDS,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected in done:
+                event.cancel()
+                return
+            if event not in done:
+                # comments keep proxies from closing an idle connection
+                event.cancel()
+                body = b': heartbeat\n\n'
+            elif event.result() is None:
+                break
+            else:
+                body = event.result()
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        hub.unsubscribe(queue)
+        disconnected.cancel()
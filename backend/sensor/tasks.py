@@ -1,64 +1,74 @@
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from celery import task
-from celery.signals import celeryd_init
+from celery.signals import celeryd_init, worker_process_shutdown, worker_shutdown
 from celery.utils.dispatch import Signal
+from .buffer import SensorEventBuffer
+from .http import get_session
 from .models import SensorManager
 
-from .constants import SENSOR_DATA_URI, WEATHER_DATA_URI, EXTERNAL_API_TIMEOUT
+from .constants import (
+    SENSOR_DATA_URI,
+    WEATHER_DATA_URI,
+    EXTERNAL_API_TIMEOUT,
+    SUPPORTED_SENSORS,
+    SENSOR_FETCH_CONCURRENCY
+)
 
-sensor_fetched = Signal(providing_args=['sensor_id', 'timestamp', 'value'])
-weather_fetched = Signal(providing_args=['temperature'])
+weather_fetched = Signal(providing_args=['temperature', 'timestamp'])
 
-
-def write_sensor_event(sender, sensor_id: str, timestamp: int, value: float, *args, **kwargs):
-    SensorManager.write_sensor_event(
-        sensor_id,
-        timestamp,
-        value
-    )
-
-
-def update_statistics(sender, sensor_id: str, timestamp, value: float, *args, **kwargs):
-    SensorManager.update_sensor_statistics(sensor_id, value)
+# readings are passed to SensorManager.ingest in batches,
+# see flush_sensor_events for the shutdown part
+ingest_buffer = SensorEventBuffer(SensorManager.ingest)
 
 
 def update_helsinki_temperature(sender, temperature: float, *args, **kwargs):
     SensorManager.update_helsinki_temperature(temperature)
 
 
+def save_weather_reading(sender, temperature: float, timestamp: int, *args, **kwargs):
+    SensorManager.write_weather(timestamp, temperature)
+
+
 @celeryd_init.connect
 def init_signals(*args, **kwargs):
-    sensor_fetched.connect(
-        write_sensor_event,
-        dispatch_uid='write-sensor-to-db'
-    )
-    sensor_fetched.connect(
-        update_statistics,
-        dispatch_uid='update-cache-statistics'
-    )
     weather_fetched.connect(
         update_helsinki_temperature,
         dispatch_uid='update-cache-weather'
     )
+    weather_fetched.connect(
+        save_weather_reading,
+        dispatch_uid='save-weather'
+    )
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def flush_sensor_events(*args, **kwargs):
+    """
+    Ingest buffered events before the worker (prefork child or solo worker) exits
+    """
+    try:
+        ingest_buffer.flush()
+    except Exception:
+        logging.exception(
+            'Couldn"t flush sensor events',
+            extra={'events': len(ingest_buffer)}
+        )
 
 
 @task(bind=True)
 def fetch_sensor_data(self, sensor_id: str):
-    response = requests.get(
+    response = get_session().get(
         SENSOR_DATA_URI.format(sensor_id=sensor_id),
         timeout=EXTERNAL_API_TIMEOUT
     )
     if response.ok:
         data = response.json()
-        kwargs = {
-            'sender': self,
-            'sensor_id': data['id'],
-            'timestamp': data['timestamp'],
-            'value': data['data']
-        }
-        sensor_fetched.send(**kwargs)
+        ingest_buffer.add(data['id'], data['timestamp'], data['data'])
     else:
         logging.error(
             'Couldn"t fetch sensor data',
@@ -66,15 +76,70 @@ def fetch_sensor_data(self, sensor_id: str):
         )
 
 
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SENSOR_FETCH_CONCURRENCY)
+    return _executor
+
+
+def fetch_sensor(sensor_id: str):
+    """
+    Fetch the latest reading of a sensor as (sensor_id, timestamp, value),
+    returns None if it couldn't be fetched
+    """
+    try:
+        response = get_session().get(
+            SENSOR_DATA_URI.format(sensor_id=sensor_id),
+            timeout=EXTERNAL_API_TIMEOUT
+        )
+    except requests.RequestException:
+        logging.exception(
+            'Couldn"t fetch sensor data',
+            extra={'sensor_id': sensor_id}
+        )
+        return None
+    if not response.ok:
+        logging.error(
+            'Couldn"t fetch sensor data',
+            extra={'sensor_id': sensor_id, 'status_code': response.status_code}
+        )
+        return None
+    data = response.json()
+    return data['id'], data['timestamp'], data['data']
+
+
+@task(bind=True)
+def fetch_all_sensors(self):
+    """
+    Poll all supported sensors concurrently and ingest
+    the readings as a single batch
+    """
+    events = [
+        event
+        for event in get_executor().map(fetch_sensor, SUPPORTED_SENSORS)
+        if event is not None
+    ]
+    if events:
+        ingest_buffer.extend(events)
+
+
 @task(bind=True)
 def fetch_weather(self):
-    response = requests.get(
+    response = get_session().get(
         WEATHER_DATA_URI,
         timeout=EXTERNAL_API_TIMEOUT
     )
     if response.ok:
         data = response.json()
-        weather_fetched.send(sender=self, temperature=data['temperature'])
+        weather_fetched.send(
+            sender=self,
+            temperature=data['temperature'],
+            timestamp=int(time.time())
+        )
     else:
         logging.error(
             'Couldn"t fetch weather data',
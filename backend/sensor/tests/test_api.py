@@ -1,8 +1,13 @@
+import json
+import time
 from unittest import mock
 
+import numpy as np
 from django.contrib.auth.models import User
 from django.test import TestCase
 
+from sensor.constants import INGEST_MAX_BATCH_SIZE
+
 
 class SensorApiTest(TestCase):
     def setUp(self):
@@ -17,10 +22,11 @@ class SensorApiTest(TestCase):
             }
         ).json()['access']
 
-    @mock.patch('sensor.views.SensorManager.get_statistics')
-    def test_sensor_statistics(self, mocked_get_statistics):
+    @mock.patch('sensor.views.SensorManager.get_statistics_document')
+    def test_sensor_statistics(self, mocked_get_statistics_document):
         """
-        /sensor/ endpoint returns results from SensorManager.get_statistics
+        /sensor/ endpoint returns the document serialized by ingest
+        with its version as ETag
         """
         data = [
             {'id': 'abba5', 'count': 36, 'avgTemp': 23.76197165651435},
@@ -29,18 +35,50 @@ class SensorApiTest(TestCase):
             {'id': 'iddqd', 'count': 12500036, 'avgTemp': 25.87519048725104},
             {'id': 'idkfa', 'count': 12500000, 'avgTemp': 27.081039930247535}
         ]
-        mocked_get_statistics.return_value = data
+        mocked_get_statistics_document.return_value = (
+            json.dumps({'sensors': data}).encode(), 42, 1530127249.5
+        )
         response = self.client.get(
             '/sensor/',
             HTTP_AUTHORIZATION=f'Bearer {self.token}'
         )
-        mocked_get_statistics.assert_called_once()
+        mocked_get_statistics_document.assert_called_once()
         self.assertDictEqual(
             response.json(),
             {
                 'sensors': data
             }
         )
+        self.assertEqual(response['ETag'], '"42"')
+        self.assertEqual(response['Last-Modified'], 'Wed, 27 Jun 2018 19:20:49 GMT')
+
+    @mock.patch('sensor.views.SensorManager.get_statistics_document')
+    def test_sensor_statistics_not_modified(self, mocked_get_statistics_document):
+        """
+        /sensor/ endpoint answers conditional requests
+        with 304 until the document version changes
+        """
+        mocked_get_statistics_document.return_value = (b'{"sensors": []}', 42, 1530127249.5)
+        response = self.client.get(
+            '/sensor/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}',
+            HTTP_IF_NONE_MATCH='"42"'
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(
+            '/sensor/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}',
+            HTTP_IF_MODIFIED_SINCE='Wed, 27 Jun 2018 19:20:49 GMT'
+        )
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(
+            '/sensor/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}',
+            HTTP_IF_NONE_MATCH='"41"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'{"sensors": []}')
 
     @mock.patch('sensor.views.SensorManager.get_helsinki_temp_diff')
     def test_temperature_difference(self, mocked_get_helsinki_temp_diff):
@@ -72,3 +110,287 @@ class SensorApiTest(TestCase):
         )
         mocked_get_helsinki_temp_diff.assert_called_once()
         self.assertEqual(response.status_code, 404)
+
+    @mock.patch('sensor.views.SensorManager.get_helsinki_temp_diff')
+    def test_temperature_difference_zero(self, mocked_get_helsinki_temp_diff):
+        """
+        /diff/<sensor_id> returns a difference of 0, unknown sensors
+        get 404 without reading statistics
+        """
+        mocked_get_helsinki_temp_diff.return_value = 0.0
+        response = self.client.get(
+            '/sensor/diff/iddqd/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.json(), {'differenceInCelsius': 0.0})
+        response = self.client.get(
+            '/sensor/diff/foo/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 404)
+        mocked_get_helsinki_temp_diff.assert_called_once_with('iddqd')
+
+    @mock.patch('sensor.views.SensorManager.get_helsinki_temp_diffs')
+    def test_temperature_differences(self, mocked_get_helsinki_temp_diffs):
+        """
+        /diff/?ids= returns differences of several sensors at once
+        """
+        mocked_get_helsinki_temp_diffs.return_value = {'iddqd': 4.5, 'abba': None}
+        response = self.client.get(
+            '/sensor/diff/?ids=iddqd,abba,iddqd',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        mocked_get_helsinki_temp_diffs.assert_called_once_with(['iddqd', 'abba'])
+        self.assertEqual(
+            response.json(),
+            {
+                'sensors': [
+                    {'id': 'iddqd', 'differenceInCelsius': 4.5},
+                    {'id': 'abba', 'differenceInCelsius': None}
+                ]
+            }
+        )
+        self.client.get('/sensor/diff/?ids=all', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        mocked_get_helsinki_temp_diffs.assert_called_with(
+            ['abba5', 'abba', 'acdc', 'iddqd', 'idkfa']
+        )
+
+    @mock.patch('sensor.views.SensorManager.get_helsinki_temp_diffs')
+    def test_temperature_differences_bad_request(self, mocked_get_helsinki_temp_diffs):
+        for query, status in [('', 400), ('?ids=', 400), ('?ids=iddqd,foo', 404)]:
+            response = self.client.get(
+                f'/sensor/diff/{query}',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response.status_code, status)
+        mocked_get_helsinki_temp_diffs.assert_not_called()
+
+    @mock.patch('sensor.views.SensorManager.aggregate_range')
+    def test_sensor_range_statistics(self, mocked_aggregate_range):
+        """
+        /sensor/<sensor_id>/stats/ returns aggregates over [from, to)
+        """
+        mocked_aggregate_range.return_value = (2, 45.0, 18.0, 27.0)
+        response = self.client.get(
+            '/sensor/iddqd/stats/',
+            {'from': 1530127249766, 'to': 1530130849},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        mocked_aggregate_range.assert_called_once_with(
+            'iddqd', 1530127249, 1530130849
+        )
+        self.assertDictEqual(
+            response.json(),
+            {
+                'id': 'iddqd',
+                'from': 1530127249,
+                'to': 1530130849,
+                'count': 2,
+                'avgTemp': 22.5,
+                'minTemp': 18.0,
+                'maxTemp': 27.0
+            }
+        )
+
+    @mock.patch('sensor.views.SensorManager.aggregate_range_buckets')
+    def test_sensor_range_statistics_buckets(self, mocked_aggregate_range_buckets):
+        """
+        /sensor/<sensor_id>/stats/?bucket= returns aggregates per bucket
+        """
+        mocked_aggregate_range_buckets.return_value = [
+            (59, 2, 45.0, 18.0, 27.0),
+            (90000, 1, 25.0, 25.0, 25.0)
+        ]
+        response = self.client.get(
+            '/sensor/iddqd/stats/',
+            {'from': 59, 'to': 90031, 'bucket': 'hour'},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        mocked_aggregate_range_buckets.assert_called_once_with(
+            'iddqd', 59, 90031, 'hour'
+        )
+        self.assertEqual(
+            response.json()['buckets'],
+            [
+                {'time': 59, 'count': 2, 'avgTemp': 22.5, 'minTemp': 18.0, 'maxTemp': 27.0},
+                {'time': 90000, 'count': 1, 'avgTemp': 25.0, 'minTemp': 25.0, 'maxTemp': 25.0}
+            ]
+        )
+
+    def test_sensor_range_statistics_bad_request(self):
+        """
+        /sensor/<sensor_id>/stats/ returns 400 for invalid parameters
+        and 404 for unknown sensors
+        """
+        for params in ({'from': 'foo'}, {'from': 10, 'to': 5}, {'bucket': 'week'}):
+            response = self.client.get(
+                '/sensor/iddqd/stats/',
+                params,
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            '/sensor/foo/stats/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @mock.patch('sensor.views.SensorManager.get_series')
+    def test_sensor_series(self, mocked_get_series):
+        """
+        /sensor/<sensor_id>/series/ returns downsampled readings
+        """
+        mocked_get_series.return_value = [[1, 22.0], [2, 27.0]]
+        response = self.client.get(
+            '/sensor/iddqd/series/',
+            {'from': 1, 'to': 10, 'points': 100, 'method': 'minmax'},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        mocked_get_series.assert_called_once_with('iddqd', 1, 10, 100, 'minmax')
+        self.assertDictEqual(
+            response.json(),
+            {
+                'id': 'iddqd',
+                'from': 1,
+                'to': 10,
+                'method': 'minmax',
+                'points': [[1, 22.0], [2, 27.0]]
+            }
+        )
+
+    def test_sensor_series_bad_request(self):
+        """
+        /sensor/<sensor_id>/series/ returns 400 for invalid parameters
+        """
+        for params in ({'points': 2}, {'points': 'foo'}, {'method': 'avg'}):
+            response = self.client.get(
+                '/sensor/iddqd/series/',
+                params,
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response.status_code, 400)
+
+    @mock.patch('sensor.views.SensorManager.iter_readings')
+    def test_sensor_export(self, mocked_iter_readings):
+        """
+        /sensor/<sensor_id>/export/ streams readings in requested format
+        """
+        mocked_iter_readings.return_value = iter([[(1, 22.0)], [(2, 27.5)]])
+        response = self.client.get(
+            '/sensor/iddqd/export/',
+            {'from': 1, 'to': 10, 'output': 'ndjson'},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        mocked_iter_readings.assert_called_once_with('iddqd', 1, 10)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            b'{"id": "iddqd", "time": 1, "value": 22.0}\n'
+            b'{"id": "iddqd", "time": 2, "value": 27.5}\n'
+        )
+
+    @mock.patch('sensor.views.SensorManager.iter_temp_diffs')
+    def test_sensor_diff_history(self, mocked_iter_temp_diffs):
+        """
+        /sensor/<sensor_id>/diff-history/ streams differences as ndjson
+        """
+        mocked_iter_temp_diffs.return_value = iter([
+            (np.array([1, 2]), np.array([0.0, 1.5])),
+            (np.array([5]), np.array([2.25]))
+        ])
+        response = self.client.get(
+            '/sensor/iddqd/diff-history/',
+            {'from': 1, 'to': 10},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        mocked_iter_temp_diffs.assert_called_once_with('iddqd', 1, 10)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            b'{"time": 1, "differenceInCelsius": 0.0}\n'
+            b'{"time": 2, "differenceInCelsius": 1.5}\n'
+            b'{"time": 5, "differenceInCelsius": 2.25}\n'
+        )
+        response = self.client.get(
+            '/sensor/foo/diff-history/',
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_sensor_export_bad_format(self):
+        """
+        /sensor/<sensor_id>/export/ returns 400 for unknown formats
+        """
+        response = self.client.get(
+            '/sensor/iddqd/export/',
+            {'output': 'xml'},
+            HTTP_AUTHORIZATION=f'Bearer {self.token}'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('sensor.views.SensorManager.ingest')
+    def test_sensor_ingest(self, mocked_ingest):
+        """
+        /sensor/ingest/ passes json array and ndjson readings
+        to SensorManager.ingest as a single batch
+        """
+        mocked_ingest.return_value = 2
+        readings = [
+            {'id': 'iddqd', 'timestamp': 1530127249766, 'value': 23.9},
+            {'id': 'abba', 'timestamp': 1530127250, 'value': 24}
+        ]
+        events = [('iddqd', 1530127249766, 23.9), ('abba', 1530127250, 24)]
+        bodies = {
+            'application/json': json.dumps(readings),
+            'application/x-ndjson': '\n'.join(map(json.dumps, readings)) + '\n'
+        }
+        for content_type, body in bodies.items():
+            mocked_ingest.reset_mock()
+            response = self.client.post(
+                '/sensor/ingest/',
+                body,
+                content_type=content_type,
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), {'ingested': 2})
+            mocked_ingest.assert_called_once_with(events)
+
+    @mock.patch('sensor.views.SensorManager.ingest')
+    def test_sensor_ingest_bad_request(self, mocked_ingest):
+        """
+        /sensor/ingest/ rejects the whole batch if any reading is invalid
+        """
+        valid = {'id': 'iddqd', 'timestamp': 1530127249766, 'value': 23.9}
+        bodies = [
+            'not json',
+            json.dumps(valid),
+            json.dumps([]),
+            json.dumps([valid, {'id': 'iddqd', 'value': 23.9}]),
+            json.dumps([valid, dict(valid, id='foo')]),
+            json.dumps([valid, dict(valid, id=['iddqd'])]),
+            json.dumps([valid, dict(valid, timestamp='yesterday')]),
+            json.dumps([valid, dict(valid, timestamp=-1)]),
+            json.dumps([valid, dict(valid, timestamp=10 ** 20)]),
+            json.dumps([valid, dict(valid, timestamp=int(time.time() + 7200) * 1000)]),
+            json.dumps([valid, dict(valid, value=True)]),
+            json.dumps([valid] * (INGEST_MAX_BATCH_SIZE + 1)),
+        ]
+        for body in bodies:
+            response = self.client.post(
+                '/sensor/ingest/',
+                body,
+                content_type='application/json',
+                HTTP_AUTHORIZATION=f'Bearer {self.token}'
+            )
+            self.assertEqual(response.status_code, 400, body[:50])
+        mocked_ingest.assert_not_called()
+
+    def test_sensor_ingest_unauthenticated(self):
+        response = self.client.post(
+            '/sensor/ingest/',
+            '[]',
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 401)
@@ -0,0 +1,51 @@
+import numpy as np
+from django.test import SimpleTestCase
+
+from sensor import archive
+
+
+class ArchiveTest(SimpleTestCase):
+    def test_round_trip(self):
+        """
+        Times and values are decoded exactly as they were encoded
+        """
+        times = np.array([100, 105, 110, 115, 121, 1000, 1005], dtype=np.int64)
+        values = np.array([22.0, 22.004, 21.998, -3.5, 0.0, 1e-300, 29.0])
+        np.testing.assert_array_equal(
+            archive.decode_times(archive.encode_times(times)), times
+        )
+        np.testing.assert_array_equal(
+            archive.decode_values(archive.encode_values(values)), values
+        )
+
+    def test_regular_times_compress(self):
+        """
+        Readings at a fixed interval take next to nothing
+        """
+        times = np.arange(0, 5 * 17280, 5, dtype=np.int64)
+        self.assertLess(len(archive.encode_times(times)), 200)
+
+    def test_split_segments(self):
+        times = np.array([10, 50, 100, 250, 299, 300])
+        self.assertEqual(
+            [
+                (start, end, times[part].tolist())
+                for start, end, part in archive.split_segments(times, 100)
+            ],
+            [
+                (0, 100, [10, 50]),
+                (100, 200, [100]),
+                (200, 300, [250, 299]),
+                (300, 400, [300])
+            ]
+        )
+
+    def test_aggregate_buckets(self):
+        times = np.array([0, 30, 60, 130])
+        values = np.array([1.0, 3.0, 2.0, 5.0])
+        buckets, counts, totals, mins, maxs = archive.aggregate_buckets(times, values, 60)
+        self.assertEqual(buckets.tolist(), [0, 60, 120])
+        self.assertEqual(counts.tolist(), [2, 1, 1])
+        self.assertEqual(totals.tolist(), [4.0, 2.0, 5.0])
+        self.assertEqual(mins.tolist(), [1.0, 2.0, 5.0])
+        self.assertEqual(maxs.tolist(), [3.0, 2.0, 5.0])
@@ -0,0 +1,163 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from sensor import async_views
+from sensor.models import SensorManager
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='testuser', password='12345')
+        self.token = str(AccessToken.for_user(user))
+        self.loop = asyncio.new_event_loop()
+        self.redis = mock.Mock()
+        SensorManager.hot_cache.clear()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def resolved(self, value):
+        future = self.loop.create_future()
+        future.set_result(value)
+        return future
+
+    def get(self, path, query_string=b'', headers=(), authorized=True):
+        """
+        Run the async endpoint of path, returns (status, headers, body)
+        """
+        if authorized:
+            headers = list(headers) + [(b'authorization', f'Bearer {self.token}'.encode())]
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': path,
+            'query_string': query_string,
+            'headers': list(headers)
+        }
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def get_redis():
+            return self.redis
+
+        with mock.patch('sensor.async_views.get_redis', get_redis):
+            self.loop.run_until_complete(
+                async_views.dispatch(scope, send, *async_views.resolve(path))
+            )
+        return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+    def test_resolve(self):
+        self.assertEqual(async_views.resolve('/sensor/'), (async_views.sensor_statistics, ()))
+        self.assertEqual(
+            async_views.resolve('/sensor/diff/iddqd/'),
+            (async_views.temperature_difference, ('iddqd',))
+        )
+        self.assertEqual(
+            async_views.resolve('/sensor/iddqd/stats/'),
+            (async_views.sensor_range_statistics, ('iddqd',))
+        )
+        self.assertIsNone(async_views.resolve('/sensor/iddqd/series/'))
+        self.assertIsNone(async_views.resolve('/api/token'))
+
+    def test_sensor_statistics(self):
+        """
+        The statistics document is read from redis once per hot cache ttl,
+        conditional requests get 304
+        """
+        self.redis.hgetall.side_effect = lambda key: self.resolved({
+            b'body': b'{"sensors": []}',
+            b'version': b'42',
+            b'modified': b'1530127249.5'
+        })
+        status, headers, body = self.get('/sensor/')
+        self.assertEqual(status, 200)
+        self.assertEqual(body, b'{"sensors": []}')
+        self.assertEqual(headers[b'etag'], b'"42"')
+        self.assertEqual(headers[b'last-modified'], b'Wed, 27 Jun 2018 19:20:49 GMT')
+        status, _, body = self.get('/sensor/', headers=[(b'if-none-match', b'"42"')])
+        self.assertEqual((status, body), (304, b''))
+        status, _, _ = self.get(
+            '/sensor/',
+            headers=[(b'if-modified-since', b'Wed, 27 Jun 2018 19:20:49 GMT')]
+        )
+        self.assertEqual(status, 304)
+        self.redis.hgetall.assert_called_once_with('sensor_statistics_document')
+
+    def test_temperature_difference(self):
+        """
+        Sensor statistics and helsinki temperature are read in one pipeline
+        """
+        pipe = self.redis.pipeline.return_value
+        pipe.hgetall.return_value = self.resolved({
+            b'count': b'2', b'total': b'40.0', b'temperature': b'23.5'
+        })
+        pipe.get.return_value = self.resolved(b'19')
+        pipe.execute.side_effect = lambda: self.resolved([])
+        status, _, body = self.get('/sensor/diff/iddqd/')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {'differenceInCelsius': 4.5})
+        pipe.hgetall.assert_called_once_with('sensor_statistics:iddqd')
+        pipe.get.assert_called_once_with(SensorManager.helsinki_temperature_redis_key())
+
+        pipe.hgetall.return_value = self.resolved({b'count': b'1', b'total': b'19.0', b'temperature': b'19'})
+        status, _, body = self.get('/sensor/diff/abba/')
+        self.assertEqual((status, json.loads(body)), (200, {'differenceInCelsius': 0}))
+
+        pipe.hgetall.return_value = self.resolved({})
+        status, _, body = self.get('/sensor/diff/acdc/')
+        self.assertEqual((status, json.loads(body)), (404, {'detail': 'Not found.'}))
+        status, _, _ = self.get('/sensor/diff/foo/')
+        self.assertEqual(status, 404)
+        self.assertEqual(pipe.execute.call_count, 3)
+
+    @mock.patch('sensor.views.SensorManager.aggregate_range')
+    def test_sensor_range_statistics(self, mock_aggregate_range):
+        mock_aggregate_range.return_value = (2, 44.0, 21.0, 23.0)
+        status, _, body = self.get('/sensor/abba/stats/', b'from=1530403230&to=1530403310')
+        self.assertEqual(status, 200)
+        self.assertEqual(
+            json.loads(body),
+            {
+                'id': 'abba',
+                'from': 1530403230,
+                'to': 1530403310,
+                'count': 2,
+                'avgTemp': 22.0,
+                'minTemp': 21.0,
+                'maxTemp': 23.0
+            }
+        )
+        status, _, body = self.get('/sensor/abba/stats/', b'from=2&to=1')
+        self.assertEqual((status, json.loads(body)), (400, ['from must be less than to']))
+        status, _, _ = self.get('/sensor/foo/stats/')
+        self.assertEqual(status, 404)
+
+    @mock.patch('sensor.async_views.SensorManager.ensure_hot_cache_listener')
+    def test_hot_cache_listener(self, mock_ensure_hot_cache_listener):
+        """
+        Async views make sure hot cache invalidations are received
+        """
+        self.redis.hgetall.side_effect = lambda key: self.resolved({
+            b'body': b'{"sensors": []}', b'version': b'1', b'modified': b'1530127249.5'
+        })
+        self.get('/sensor/')
+        self.get('/sensor/diff/foo/')
+        mock_ensure_hot_cache_listener.assert_called_once_with()
+        pipe = self.redis.pipeline.return_value
+        pipe.hgetall.return_value = self.resolved({})
+        pipe.get.return_value = self.resolved(None)
+        pipe.execute.side_effect = lambda: self.resolved([])
+        self.get('/sensor/diff/iddqd/')
+        self.assertEqual(mock_ensure_hot_cache_listener.call_count, 2)
+
+    def test_unauthorized(self):
+        status, _, _ = self.get('/sensor/', authorized=False)
+        self.assertEqual(status, 401)
+        self.redis.hgetall.assert_not_called()
@@ -0,0 +1,89 @@
+import threading
+from unittest import mock
+
+from django.test import TestCase
+
+from sensor.buffer import SensorEventBuffer
+
+
+class SensorEventBufferTest(TestCase):
+    def test_flush_when_full(self):
+        """
+        SensorEventBuffer passes all events to flush_callback
+        once max_size is reached
+        """
+        callback = mock.Mock()
+        buffer = SensorEventBuffer(callback, max_size=2, max_age=60)
+        buffer.add('iddqd', 1530127249766, 23.91569438663249)
+        callback.assert_not_called()
+        buffer.add('abba', 1530127249767, 24.1)
+        callback.assert_called_once_with([
+            ('iddqd', 1530127249766, 23.91569438663249),
+            ('abba', 1530127249767, 24.1)
+        ])
+        self.assertEqual(len(buffer), 0)
+
+    @mock.patch('sensor.buffer.time.monotonic')
+    def test_flush_when_stale(self, mock_monotonic):
+        """
+        SensorEventBuffer flushes events older than max_age
+        """
+        callback = mock.Mock()
+        buffer = SensorEventBuffer(callback, max_size=100, max_age=5)
+        mock_monotonic.return_value = 100
+        buffer.add('iddqd', 1530127249766, 23.91569438663249)
+        callback.assert_not_called()
+        mock_monotonic.return_value = 105
+        buffer.add('iddqd', 1530127254766, 23.92)
+        callback.assert_called_once_with([
+            ('iddqd', 1530127249766, 23.91569438663249),
+            ('iddqd', 1530127254766, 23.92)
+        ])
+
+    def test_flush_by_thread(self):
+        """
+        SensorEventBuffer flushes stale events when nothing else is added,
+        always from the same thread
+        """
+        flushed = threading.Semaphore(0)
+        threads = []
+
+        def callback(events):
+            threads.append(threading.current_thread())
+            flushed.release()
+
+        callback = mock.Mock(side_effect=callback)
+        buffer = SensorEventBuffer(callback, max_size=100, max_age=0.01)
+        buffer.add('iddqd', 1530127249766, 23.91569438663249)
+        self.assertTrue(flushed.acquire(timeout=5))
+        buffer.add('iddqd', 1530127249767, 23.92)
+        self.assertTrue(flushed.acquire(timeout=5))
+        callback.assert_has_calls([
+            mock.call([('iddqd', 1530127249766, 23.91569438663249)]),
+            mock.call([('iddqd', 1530127249767, 23.92)])
+        ])
+        self.assertEqual(len(buffer), 0)
+        self.assertIs(threads[0], threads[1])
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_failed_flush_keeps_events(self):
+        """
+        Events are kept in the buffer if flush_callback fails
+        """
+        callback = mock.Mock(side_effect=[RuntimeError, None])
+        buffer = SensorEventBuffer(callback, max_size=100, max_age=60)
+        buffer.add('iddqd', 1530127249766, 23.91569438663249)
+        with self.assertRaises(RuntimeError):
+            buffer.flush()
+        self.assertEqual(len(buffer), 1)
+        self.assertEqual(buffer.flush(), 1)
+        self.assertEqual(len(buffer), 0)
+
+    def test_flush_empty(self):
+        """
+        Flushing an empty buffer doesn't call flush_callback
+        """
+        callback = mock.Mock()
+        buffer = SensorEventBuffer(callback)
+        self.assertEqual(buffer.flush(), 0)
+        callback.assert_not_called()
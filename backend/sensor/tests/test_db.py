@@ -0,0 +1,64 @@
+import os
+import sqlite3
+import tempfile
+from unittest import mock
+
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import TestCase, override_settings
+
+from sensor.db import apply_sqlite_pragmas
+from sensor.models import SensorManager
+
+
+class SqlitePragmasTest(TestCase):
+    @override_settings(SQLITE_PRAGMAS={
+        'readonly': {'busy_timeout': 1234, 'cache_size': -2048}
+    })
+    def test_apply_sqlite_pragmas(self):
+        """
+        Pragmas of the database alias are run on new connections
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'db.sqlite')
+            sqlite3.connect(path).close()
+            wrapper = DatabaseWrapper(
+                dict(connection.settings_dict, NAME=f'file:{path}?mode=ro'),
+                alias='readonly'
+            )
+            try:
+                wrapper.connect()
+                cursor = wrapper.connection.cursor()
+                self.assertEqual(
+                    cursor.execute('PRAGMA busy_timeout').fetchone(), (1234,)
+                )
+                self.assertEqual(
+                    cursor.execute('PRAGMA cache_size').fetchone(), (-2048,)
+                )
+                with self.assertRaises(sqlite3.OperationalError):
+                    cursor.execute('CREATE TABLE foo (id TEXT)')
+            finally:
+                wrapper.close()
+
+    def test_apply_sqlite_pragmas_other_vendor(self):
+        other = mock.Mock(vendor='postgresql', alias='default')
+        apply_sqlite_pragmas(None, other)
+        other.connection.execute.assert_not_called()
+
+    @mock.patch('sensor.models.connections')
+    def test_read_connection(self, mock_connections):
+        """
+        Read queries use the read-only alias unless it mirrors an in-memory database
+        """
+        read_only = mock_connections.__getitem__.return_value
+        read_only.is_in_memory_db.return_value = False
+        self.assertIs(
+            SensorManager.read_connection(),
+            read_only.cursor.return_value.db.connection
+        )
+        mock_connections.__getitem__.assert_called_once_with('readonly')
+        read_only.is_in_memory_db.return_value = True
+        self.assertIs(
+            SensorManager.read_connection(),
+            SensorManager.raw_connection()
+        )
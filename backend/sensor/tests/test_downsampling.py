@@ -0,0 +1,79 @@
+import random
+
+from django.test import TestCase
+
+from sensor.downsampling import lttb, min_max
+
+
+def chunked(rows, size):
+    return [rows[i:i + size] for i in range(0, len(rows), size)]
+
+
+class DownsamplingTest(TestCase):
+    def setUp(self):
+        random.seed(42)
+        self.rows = [(t, random.uniform(16, 29)) for t in range(1000, 2000, 5)]
+
+    def test_min_max(self):
+        """
+        min_max keeps the lowest and the highest reading of every bucket
+        regardless of how readings are chunked
+        """
+        points = min_max(chunked(self.rows, 7), 1000, 2000, 20)
+        expected = []
+        for bucket in range(10):
+            rows = [row for row in self.rows if (row[0] - 1000) * 10 // 1000 == bucket]
+            expected.extend(sorted(
+                [min(rows, key=lambda row: row[1]), max(rows, key=lambda row: row[1])]
+            ))
+        self.assertEqual(points, [list(row) for row in expected])
+        self.assertEqual(min_max(chunked(self.rows, 1000), 1000, 2000, 20), points)
+
+    def test_min_max_single_reading(self):
+        """
+        Buckets with a single reading produce a single point
+        """
+        self.assertEqual(
+            min_max([[(1000, 20.0)], [(1500, 21.0)]], 1000, 2000, 4),
+            [[1000, 20.0], [1500, 21.0]]
+        )
+
+    def test_lttb(self):
+        """
+        lttb keeps the first and the last reading and picks the reading
+        forming the largest triangle in every bucket
+        """
+        points = 12
+        buckets = points - 2
+        grouped = {}
+        for row in self.rows[1:]:
+            grouped.setdefault((row[0] - 1000) * buckets // 1000, []).append(row)
+        averages = {
+            bucket: (
+                sum(row[0] for row in rows) / len(rows),
+                sum(row[1] for row in rows) / len(rows)
+            )
+            for bucket, rows in grouped.items()
+        }
+        last_point = self.rows[-1]
+
+        expected = [self.rows[0]]
+        for bucket in sorted(grouped):
+            next_point = averages.get(bucket + 1, last_point)
+            previous = expected[-1]
+            expected.append(max(
+                grouped[bucket],
+                key=lambda row: abs(
+                    (previous[0] - next_point[0]) * (row[1] - previous[1]) -
+                    (previous[0] - row[0]) * (next_point[1] - previous[1])
+                )
+            ))
+        expected.append(last_point)
+
+        selected = lttb(chunked(self.rows, 13), 1000, 2000, points, averages, last_point)
+        self.assertEqual(len(selected), points)
+        self.assertEqual(selected, [list(row) for row in expected])
+        self.assertEqual(
+            lttb(chunked(self.rows, 1000), 1000, 2000, points, averages, last_point),
+            selected
+        )
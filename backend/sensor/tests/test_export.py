@@ -0,0 +1,70 @@
+import io
+import json
+from unittest import skipIf
+
+from django.test import TestCase
+
+from sensor import export
+
+READINGS = [[(1, 22.0), (2, 27.5)], [(3, 20.0)]]
+
+
+class ExportTest(TestCase):
+    def test_csv_chunks(self):
+        """
+        csv_chunks yields a chunk per batch of readings
+        """
+        chunks = list(export.csv_chunks('iddqd', READINGS))
+        self.assertEqual(
+            chunks,
+            [
+                b'id,time,value\r\niddqd,1,22.0\r\niddqd,2,27.5\r\n',
+                b'iddqd,3,20.0\r\n'
+            ]
+        )
+
+    def test_csv_chunks_empty(self):
+        """
+        csv_chunks yields the header if there are no readings
+        """
+        self.assertEqual(
+            list(export.csv_chunks('iddqd', [])),
+            [b'id,time,value\r\n']
+        )
+
+    def test_ndjson_chunks(self):
+        """
+        ndjson_chunks yields a json document per reading
+        """
+        lines = b''.join(export.ndjson_chunks('iddqd', READINGS)).splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [
+                {'id': 'iddqd', 'time': 1, 'value': 22.0},
+                {'id': 'iddqd', 'time': 2, 'value': 27.5},
+                {'id': 'iddqd', 'time': 3, 'value': 20.0}
+            ]
+        )
+
+    @skipIf(export.pyarrow is None, 'pyarrow is not installed')
+    def test_arrow_chunks(self):
+        """
+        arrow_chunks yields an arrow ipc stream with a record batch
+        per batch of readings
+        """
+        data = b''.join(export.arrow_chunks('iddqd', READINGS))
+        reader = export.pyarrow.ipc.open_stream(io.BytesIO(data))
+        batches = list(reader)
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(
+            reader.schema.names,
+            ['id', 'time', 'value']
+        )
+        self.assertEqual(
+            export.pyarrow.Table.from_batches(batches).to_pydict(),
+            {
+                'id': ['iddqd', 'iddqd', 'iddqd'],
+                'time': [1, 2, 3],
+                'value': [22.0, 27.5, 20.0]
+            }
+        )
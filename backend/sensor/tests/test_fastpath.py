@@ -0,0 +1,138 @@
+import json
+from unittest import mock
+from wsgiref.util import setup_testing_defaults
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from sensor import auth
+from sensor.fastpath import FastPathApplication
+
+
+class FastPathTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.token = str(AccessToken.for_user(self.user))
+        self.django_application = mock.Mock(return_value=[b'django'])
+        self.application = FastPathApplication(self.django_application)
+        auth.verified_tokens.clear()
+
+    def request(self, path, method='GET', authorized=True, **headers):
+        """
+        Run the application for path, returns (status, headers, body)
+        """
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'HTTP_HOST': 'testserver',
+            **headers
+        }
+        if authorized:
+            environ['HTTP_AUTHORIZATION'] = f'Bearer {self.token}'
+        setup_testing_defaults(environ)
+        started = {}
+
+        def start_response(status, response_headers):
+            started['status'] = int(status.split()[0])
+            started['headers'] = dict(response_headers)
+
+        response = self.application(environ, start_response)
+        body = b''.join(response)
+        return started.get('status'), started.get('headers'), body
+
+    def test_routing(self):
+        """
+        Only GET requests of statistics and temperature difference take the fast path
+        """
+        for path, method in [
+            ('/sensor/ingest/', 'POST'),
+            ('/sensor/', 'POST'),
+            ('/sensor/abba/stats/', 'GET'),
+            ('/sensor/diff/abba', 'GET'),
+            ('/api/token', 'POST')
+        ]:
+            self.assertEqual(self.request(path, method)[2], b'django')
+        self.assertEqual(self.django_application.call_count, 5)
+
+    @mock.patch('sensor.views.SensorManager.get_statistics_document')
+    def test_sensor_statistics(self, mocked_get_statistics_document):
+        mocked_get_statistics_document.return_value = (b'{"sensors": []}', 42, 1530127249.5)
+        status, headers, body = self.request('/sensor/')
+        self.assertEqual((status, body), (200, b'{"sensors": []}'))
+        self.assertEqual(headers['ETag'], '"42"')
+        self.assertEqual(headers['Last-Modified'], 'Wed, 27 Jun 2018 19:20:49 GMT')
+        self.assertNotIn('Set-Cookie', headers)
+        status, _, body = self.request('/sensor/', HTTP_IF_NONE_MATCH='"42"')
+        self.assertEqual((status, body), (304, b''))
+        self.django_application.assert_not_called()
+
+    @mock.patch('sensor.fastpath.SensorManager.get_helsinki_temp_diff')
+    def test_temperature_difference(self, mocked_get_helsinki_temp_diff):
+        mocked_get_helsinki_temp_diff.return_value = 4.5
+        status, headers, body = self.request('/sensor/diff/iddqd/')
+        self.assertEqual((status, json.loads(body)), (200, {'differenceInCelsius': 4.5}))
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        mocked_get_helsinki_temp_diff.assert_called_once_with('iddqd')
+
+        mocked_get_helsinki_temp_diff.return_value = 0.0
+        status, _, body = self.request('/sensor/diff/iddqd/')
+        self.assertEqual((status, json.loads(body)), (200, {'differenceInCelsius': 0.0}))
+
+        mocked_get_helsinki_temp_diff.return_value = None
+        status, _, body = self.request('/sensor/diff/abba/')
+        self.assertEqual((status, json.loads(body)), (404, {'detail': 'Not found.'}))
+        status, _, _ = self.request('/sensor/diff/foo/')
+        self.assertEqual(status, 404)
+        self.assertEqual(mocked_get_helsinki_temp_diff.call_count, 3)
+
+    @mock.patch('sensor.views.SensorManager.get_helsinki_temp_diffs')
+    def test_temperature_differences(self, mocked_get_helsinki_temp_diffs):
+        mocked_get_helsinki_temp_diffs.return_value = {'iddqd': 4.5}
+        status, _, body = self.request('/sensor/diff/', QUERY_STRING='ids=iddqd')
+        self.assertEqual(
+            (status, json.loads(body)),
+            (200, {'sensors': [{'id': 'iddqd', 'differenceInCelsius': 4.5}]})
+        )
+        status, _, body = self.request('/sensor/diff/', QUERY_STRING='ids=foo')
+        self.assertEqual((status, json.loads(body)), (404, {'detail': 'Not found.'}))
+        status, _, _ = self.request('/sensor/diff/')
+        self.assertEqual(status, 400)
+        self.django_application.assert_not_called()
+
+    @mock.patch('sensor.fastpath.SensorManager.get_helsinki_temp_diff')
+    def test_unauthorized(self, mocked_get_helsinki_temp_diff):
+        status, headers, _ = self.request('/sensor/diff/iddqd/', authorized=False)
+        self.assertEqual(status, 401)
+        self.assertEqual(headers['WWW-Authenticate'], 'Bearer realm="api"')
+        status, _, _ = self.request(
+            '/sensor/diff/iddqd/', authorized=False, HTTP_AUTHORIZATION='Bearer foo'
+        )
+        self.assertEqual(status, 401)
+        status, _, _ = self.request('/sensor/diff/iddqd/', HTTP_HOST='evil.com')
+        self.assertEqual(status, 400)
+        mocked_get_helsinki_temp_diff.assert_not_called()
+
+    @mock.patch('sensor.fastpath.SensorManager.get_helsinki_temp_diff')
+    def test_cors(self, mocked_get_helsinki_temp_diff):
+        """
+        Fast path responses get the headers of corsheaders middleware
+        """
+        mocked_get_helsinki_temp_diff.return_value = 4.5
+        _, headers, _ = self.request('/sensor/diff/iddqd/', HTTP_ORIGIN='http://localhost:4200')
+        self.assertEqual(headers['Access-Control-Allow-Origin'], 'http://localhost:4200')
+        _, headers, _ = self.request('/sensor/diff/iddqd/', HTTP_ORIGIN='http://evil.com')
+        self.assertNotIn('Access-Control-Allow-Origin', headers)
+
+    def test_verified_tokens(self):
+        """
+        Token signature is checked once, cached tokens still expire
+        """
+        with mock.patch('sensor.auth.AccessToken', wraps=AccessToken) as mocked_access_token:
+            self.assertEqual(auth.get_token_user_id(self.token), self.user.id)
+            self.assertEqual(auth.get_token_user_id(self.token), self.user.id)
+            mocked_access_token.assert_called_once_with(self.token)
+            self.assertIsNone(auth.get_token_user_id(self.token + 'x'))
+            self.assertNotIn(self.token + 'x', auth.verified_tokens._values)
+        with mock.patch('sensor.auth.time.time', return_value=AccessToken(self.token)['exp']):
+            self.assertIsNone(auth.get_token_user_id(self.token))
@@ -0,0 +1,88 @@
+from unittest import mock
+
+from django.test import TestCase
+from redis.exceptions import ConnectionError
+
+from sensor.hotcache import HotCache
+
+
+class HotCacheTest(TestCase):
+    @mock.patch('sensor.hotcache.time.monotonic')
+    def test_ttl(self, mock_monotonic):
+        """
+        HotCache loads a key once per ttl seconds
+        """
+        load = mock.Mock(side_effect=[1, 2])
+        hot_cache = HotCache(ttl=5, max_size=10)
+        mock_monotonic.return_value = 100
+        self.assertEqual(hot_cache.get_or_set('abba', load), 1)
+        mock_monotonic.return_value = 104
+        self.assertEqual(hot_cache.get_or_set('abba', load), 1)
+        mock_monotonic.return_value = 105
+        self.assertEqual(hot_cache.get_or_set('abba', load), 2)
+        self.assertEqual(load.call_count, 2)
+
+    def test_disabled(self):
+        load = mock.Mock(return_value=1)
+        hot_cache = HotCache(ttl=0, max_size=10)
+        hot_cache.get_or_set('abba', load)
+        hot_cache.get_or_set('abba', load)
+        self.assertEqual(load.call_count, 2)
+        self.assertEqual(len(hot_cache), 0)
+
+    def test_evict_least_recently_used(self):
+        hot_cache = HotCache(ttl=60, max_size=2)
+        hot_cache.get_or_set('abba', lambda: 1)
+        hot_cache.get_or_set('acdc', lambda: 2)
+        hot_cache.get_or_set('abba', lambda: 3)
+        hot_cache.get_or_set('iddqd', lambda: 4)
+        self.assertEqual(len(hot_cache), 2)
+        self.assertEqual(hot_cache.get_or_set('abba', lambda: 5), 1)
+        self.assertEqual(hot_cache.get_or_set('acdc', lambda: 6), 6)
+
+    def test_invalidate(self):
+        """
+        Invalidated keys are loaded again, values loaded
+        while a key was invalidated are not stored
+        """
+        hot_cache = HotCache(ttl=60, max_size=10)
+        hot_cache.get_or_set('abba', lambda: 1)
+        hot_cache.get_or_set('acdc', lambda: 2)
+        hot_cache.invalidate(['abba'])
+        self.assertEqual(hot_cache.get_or_set('abba', lambda: 3), 3)
+        self.assertEqual(hot_cache.get_or_set('acdc', lambda: 4), 2)
+
+        def load():
+            hot_cache.invalidate(['iddqd'])
+            return 5
+
+        self.assertEqual(hot_cache.get_or_set('iddqd', load), 5)
+        self.assertEqual(hot_cache.get_or_set('iddqd', lambda: 6), 6)
+
+    @mock.patch('sensor.hotcache.logging')
+    @mock.patch('sensor.hotcache.time.sleep')
+    def test_listen(self, mock_sleep, mock_logging):
+        """
+        Keys published to the channel are invalidated,
+        everything is dropped when the subscription fails
+        """
+        hot_cache = HotCache(ttl=60, max_size=10)
+        client = mock.Mock()
+        pubsub = client.pubsub.return_value
+        mock_sleep.side_effect = SystemExit
+
+        def listen():
+            for key, value in [('abba', 1), ('acdc', 2), ('iddqd', 3)]:
+                hot_cache.get_or_set(key, lambda: value)
+            yield {'type': 'message', 'data': b'abba,acdc'}
+            self.assertEqual(hot_cache.get_or_set('iddqd', lambda: 4), 3)
+            self.assertEqual(hot_cache.get_or_set('abba', lambda: 5), 5)
+            raise ConnectionError
+
+        pubsub.listen.side_effect = listen
+        with self.assertRaises(SystemExit):
+            hot_cache._listen(client, 'sensor_hot_cache')
+        pubsub.subscribe.assert_called_once_with('sensor_hot_cache')
+        pubsub.close.assert_called_once_with()
+        mock_logging.exception.assert_called_once_with('Hot cache subscription failed')
+        self.assertEqual(len(hot_cache), 0)
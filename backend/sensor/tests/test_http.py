@@ -0,0 +1,30 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from sensor import http
+from sensor.constants import EXTERNAL_API_RETRIES, EXTERNAL_API_POOL_SIZE
+
+
+class HttpSessionTest(TestCase):
+    def test_create_session(self):
+        """
+        Session retries failed requests and keeps
+        a connection per concurrently fetched sensor
+        """
+        session = http.create_session()
+        adapter = session.get_adapter('http://dummy-sensors.azurewebsites.net')
+        self.assertEqual(adapter.max_retries.total, EXTERNAL_API_RETRIES)
+        self.assertIn(503, adapter.max_retries.status_forcelist)
+        self.assertEqual(adapter._pool_maxsize, EXTERNAL_API_POOL_SIZE)
+
+    @mock.patch('sensor.http._session', None)
+    def test_session_per_process(self):
+        """
+        init_session, connected to worker_process_init, replaces the session
+        of the process and get_session keeps returning it
+        """
+        session = http.get_session()
+        self.assertIs(http.get_session(), session)
+        http.init_session()
+        self.assertIsNot(http.get_session(), session)
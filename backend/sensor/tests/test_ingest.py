@@ -0,0 +1,167 @@
+import json
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from sensor.ingest import (
+    AlertsStage,
+    IngestPipeline,
+    IngestStage,
+    PublishStage,
+    ReadingsStage,
+    RollupsStage,
+    StatisticsStage,
+    get_pipeline
+)
+from sensor.models import SensorManager
+
+EVENTS = [
+    ('iddqd', 1530127249766, 23.9),
+    ('abba', 1530127250, 24.1)
+]
+
+
+class IngestPipelineTest(TestCase):
+    def tearDown(self):
+        get_pipeline.cache_clear()
+
+    @mock.patch('sensor.models.SensorManager.refresh_statistics_document')
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_ingest(self, mock_redis, mock_refresh):
+        """
+        SensorManager.ingest writes readings and rollups to the database,
+        sends statistics updates in a single redis transaction
+        and serializes statistics of all sensors afterwards
+        """
+        self.assertEqual(SensorManager.ingest(EVENTS), 2)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT sensors.id, CAST(time AS INTEGER), value
+                FROM datas_201806 JOIN sensors ON sensor_key = datas_201806.id
+                ORDER BY sensors.id
+                """
+            )
+            self.assertEqual(
+                cursor.fetchall(),
+                [('abba', 1530127250, 24.1), ('iddqd', 1530127249, 23.9)]
+            )
+            cursor.execute(
+                """
+                SELECT sensors.id, bucket, count
+                FROM rollup_minute JOIN sensors ON sensor_key = rollup_minute.id
+                ORDER BY sensors.id
+                """
+            )
+            self.assertEqual(
+                cursor.fetchall(),
+                [('abba', 1530127200, 1), ('iddqd', 1530127200, 1)]
+            )
+        mock_redis.return_value.pipeline.assert_called_once_with()
+        pipe = mock_redis.return_value.pipeline.return_value
+        pipe.hincrby.assert_has_calls([
+            mock.call('sensor_statistics:iddqd', 'count', 1),
+            mock.call('sensor_statistics:abba', 'count', 1)
+        ])
+        pipe.execute.assert_called_once_with()
+        mock_refresh.assert_called_once_with()
+
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_stage_hooks(self, mock_redis):
+        """
+        Stages share one cursor and one redis pipeline,
+        after hooks run once the batch is committed
+        """
+        stages = [mock.Mock(spec=IngestStage), mock.Mock(spec=IngestStage)]
+        pipe = mock_redis.return_value.pipeline.return_value
+        IngestPipeline(stages).run(EVENTS)
+        cursors = set()
+        for stage in stages:
+            stage.write.assert_called_once_with(mock.ANY, EVENTS)
+            cursors.add(stage.write.call_args[0][0])
+            stage.cache.assert_called_once_with(pipe, EVENTS)
+            stage.after.assert_called_once_with(EVENTS)
+        self.assertEqual(len(cursors), 1)
+        pipe.execute.assert_called_once_with()
+
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_failed_write(self, mock_redis):
+        """
+        Nothing is written and statistics are not updated if a stage fails
+        """
+        failing = mock.Mock(spec=IngestStage)
+        failing.write.side_effect = RuntimeError
+        with self.assertRaises(RuntimeError):
+            IngestPipeline([ReadingsStage(), failing]).run(EVENTS)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT name FROM datas_partitions')
+            self.assertEqual(cursor.fetchall(), [('datas',)])
+        mock_redis.return_value.pipeline.assert_not_called()
+
+    @mock.patch('sensor.ingest.logging')
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_failed_cache(self, mock_redis, mock_logging):
+        """
+        Committed readings are not failed by redis or after hook errors,
+        so a flush never retries them
+        """
+        mock_redis.return_value.pipeline.return_value.execute.side_effect = RuntimeError
+        failing = mock.Mock(spec=IngestStage)
+        failing.after.side_effect = RuntimeError
+        after = mock.Mock(spec=IngestStage)
+        self.assertEqual(IngestPipeline([ReadingsStage(), failing, after]).run(EVENTS), 2)
+        after.after.assert_called_once_with(EVENTS)
+        self.assertEqual(mock_logging.exception.call_count, 2)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM datas_201806')
+            self.assertEqual(cursor.fetchone(), (2,))
+
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_empty_batch(self, mock_redis):
+        self.assertEqual(IngestPipeline([ReadingsStage()]).run([]), 0)
+        mock_redis.return_value.pipeline.assert_not_called()
+
+    def test_publish(self):
+        """
+        PublishStage publishes the batch with timestamps in seconds
+        """
+        pipe = mock.Mock()
+        PublishStage().cache(pipe, EVENTS)
+        pipe.publish.assert_called_once_with('sensor_readings', mock.ANY)
+        self.assertEqual(
+            json.loads(pipe.publish.call_args[0][1]),
+            [
+                {'id': 'iddqd', 'timestamp': 1530127249, 'value': 23.9},
+                {'id': 'abba', 'timestamp': 1530127250, 'value': 24.1}
+            ]
+        )
+
+    @mock.patch('sensor.ingest.logging')
+    def test_alerts(self, mock_logging):
+        """
+        AlertsStage reports readings outside of the allowed range
+        """
+        AlertsStage(min_value=16, max_value=29).after(
+            EVENTS + [('abba', 1530127255, 42.0)]
+        )
+        mock_logging.warning.assert_called_once_with(
+            'Sensor reading out of range',
+            extra={'sensor_id': 'abba', 'timestamp': 1530127255, 'value': 42.0}
+        )
+
+    @override_settings(SENSOR_INGEST_STAGES=[
+        'sensor.ingest.RollupsStage',
+        'sensor.ingest.StatisticsStage'
+    ])
+    def test_get_pipeline(self):
+        """
+        get_pipeline builds stages from SENSOR_INGEST_STAGES once
+        """
+        get_pipeline.cache_clear()
+        pipeline = get_pipeline()
+        self.assertEqual(
+            [type(stage) for stage in pipeline.stages],
+            [RollupsStage, StatisticsStage]
+        )
+        self.assertIs(get_pipeline(), pipeline)
@@ -1,64 +1,956 @@
+import os
+import sqlite3
+import tempfile
 from unittest import mock
 
+import numpy as np
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
-from sensor.models import SensorManager
+from sensor.ingest import IngestPipeline, ReadingsStage, RollupsStage
+from sensor.models import SensorManager, _aggregate_sensor_read_only
+
+# readings and rollups are written by the ingest pipeline,
+# tests run only the stage they need
+write_sensor_events = IngestPipeline([ReadingsStage()]).run
+update_rollups = IngestPipeline([RollupsStage()]).run
+
+
+def round_floats(data, digits=6):
+    if isinstance(data, float):
+        return round(data, digits)
+    if isinstance(data, dict):
+        return {key: round_floats(value, digits) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [round_floats(value, digits) for value in data]
+    return data
 
 
 class SensorManagerTest(TestCase):
-    @mock.patch('sensor.models.cache')
-    def test_update_statistics_empty(self, mock_cache):
+    def setUp(self):
+        SensorManager.hot_cache.clear()
+
+    def test_write_sensor_events(self):
+        """
+        SensorManager.write_sensor_events inserts all events to partitions
+        of their month, millisecond timestamps reported by sensor api
+        are stored in seconds
+        """
+        write_sensor_events([
+            ('iddqd', 1530127249766, 23.91569438663249),
+            ('abba', 1530127249, 24.1),
+            ('abba', 1530403200, 25.0)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT sensors.id, CAST(time AS INTEGER), value
+                FROM datas_201806 JOIN sensors ON sensor_key = datas_201806.id
+                ORDER BY sensors.id
+                """
+            )
+            self.assertEqual(
+                cursor.fetchall(),
+                [
+                    ('abba', 1530127249, 24.1),
+                    ('iddqd', 1530127249, 23.91569438663249)
+                ]
+            )
+            cursor.execute(
+                """
+                SELECT sensors.id, CAST(time AS INTEGER), value
+                FROM datas_201807 JOIN sensors ON sensor_key = datas_201807.id
+                """
+            )
+            self.assertEqual(cursor.fetchall(), [('abba', 1530403200, 25.0)])
+            cursor.execute('SELECT count(*) FROM datas')
+            self.assertEqual(cursor.fetchone(), (0,))
+            cursor.execute('SELECT * FROM datas_partitions ORDER BY start_time')
+            self.assertEqual(
+                cursor.fetchall(),
+                [
+                    ('datas', None, None),
+                    ('datas_201806', 1527811200, 1530403200),
+                    ('datas_201807', 1530403200, 1533081600)
+                ]
+            )
+
+    def test_partition_bounds(self):
+        self.assertEqual(
+            SensorManager.partition_bounds(1530127249),
+            ('datas_201806', 1527811200, 1530403200)
+        )
+        self.assertEqual(
+            SensorManager.partition_bounds(1545955200),
+            ('datas_201812', 1543622400, 1546300800)
+        )
+
+    @mock.patch('sensor.models.time.time', return_value=1530127249)
+    def test_months_ago_cutoff(self, mocked_time):
+        """
+        Cutoffs are month starts counted back from the current month
+        """
+        self.assertEqual(SensorManager.months_ago_cutoff(0), 1527811200)
+        # 2018-01-01 and 2017-12-01
+        self.assertEqual(SensorManager.months_ago_cutoff(5), 1514764800)
+        self.assertEqual(SensorManager.months_ago_cutoff(6), 1512086400)
+
+    def test_get_partitions(self):
+        """
+        SensorManager.get_partitions returns partitions overlapping the window
+        and the legacy datas table
+        """
+        write_sensor_events([
+            ('abba', 1527811200, 20.0),
+            ('abba', 1530403200, 21.0),
+            ('abba', 1533081600, 22.0)
+        ])
+        cursor = SensorManager.raw_connection().cursor()
+        self.assertEqual(
+            SensorManager.get_partitions(cursor, 1530403199, 1530403201),
+            ['datas', 'datas_201806', 'datas_201807']
+        )
+        self.assertEqual(
+            SensorManager.get_partitions(cursor, 1530403200, 1533081600),
+            ['datas', 'datas_201807']
+        )
+        self.assertEqual(
+            SensorManager.get_partitions(cursor, 1533081600),
+            ['datas', 'datas_201808']
+        )
+        self.assertEqual(len(SensorManager.get_partitions(cursor)), 4)
+
+    def test_partitioned_reads(self):
+        """
+        Rows of the legacy table and of partitions are read together
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO datas VALUES (?, ?, ?)',
+                [('abba', 1530403100, 19.0), ('abba', 1530403300, 23.0)]
+            )
+        write_sensor_events([
+            ('abba', 1530403150, 20.0),
+            ('abba', 1530403250, 21.0),
+            ('iddqd', 1530403250, 27.0)
+        ])
+        self.assertEqual(
+            [row for rows in SensorManager.iter_readings('abba', 0, 2 ** 40) for row in rows],
+            [(1530403100, 19.0), (1530403150, 20.0), (1530403250, 21.0), (1530403300, 23.0)]
+        )
+        self.assertEqual(
+            SensorManager.aggregate_range('abba', 1530403230, 1530403310),
+            (2, 44.0, 21.0, 23.0)
+        )
+        self.assertEqual(
+            SensorManager.get_last_reading('abba', 0, 1530403300),
+            (1530403250, 21.0)
+        )
+        self.assertEqual(
+            SensorManager.aggregate_sensor('abba'),
+            (4, 83.0, 1530403300, 23.0)
+        )
+        self.assertEqual(SensorManager.get_sensor_ids(), ['abba', 'iddqd'])
+
+    def test_sensor_keys(self):
+        """
+        Sensors get an integer key on first write, keys are
+        only cached once the transaction creating them commits
+        """
+        cursor = SensorManager.raw_connection().cursor()
+        keys = SensorManager.get_or_create_sensor_keys(cursor, ['abba', 'iddqd', 'abba'])
+        self.assertEqual(sorted(keys), ['abba', 'iddqd'])
+        self.assertEqual(
+            SensorManager.get_or_create_sensor_keys(cursor, ['iddqd']),
+            {'iddqd': keys['iddqd']}
+        )
+        self.assertEqual(SensorManager.get_sensor_key(cursor, 'abba'), keys['abba'])
+        self.assertIsNone(SensorManager.get_sensor_key(cursor, 'foo'))
+        self.assertNotIn('abba', SensorManager._sensor_keys)
+        with mock.patch.object(SensorManager, '_sensor_keys', {'abba': 42}):
+            self.assertEqual(SensorManager.get_sensor_key(cursor, 'abba'), 42)
+
+    def test_drop_partitions(self):
+        """
+        SensorManager.drop_partitions drops whole partitions
+        ending before the given time, the legacy table is kept
+        """
+        write_sensor_events([
+            ('abba', 1527811200, 20.0),
+            ('abba', 1530403200, 21.0)
+        ])
+        self.assertEqual(SensorManager.drop_partitions(1530403200), ['datas_201806'])
+        cursor = SensorManager.raw_connection().cursor()
+        self.assertEqual(
+            SensorManager.get_partitions(cursor),
+            ['datas', 'datas_201807']
+        )
+        cursor.execute(
+            "SELECT count(*) FROM sqlite_master WHERE name = 'datas_201806'"
+        )
+        self.assertEqual(cursor.fetchone(), (0,))
+        self.assertEqual(SensorManager.drop_partitions(1530403200), [])
+        SensorManager.write_weather(1530403100, 19.0)
+        SensorManager.write_weather(1530403200, 20.0)
+        SensorManager.drop_partitions(1530403200)
+        self.assertEqual(
+            SensorManager.get_weather(0, 1530403300)[0].tolist(), [1530403200]
+        )
+
+    def test_split_legacy_partition(self):
+        """
+        SensorManager.split_legacy_partition moves rows of a sensor
+        from the legacy table to monthly partitions
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO datas VALUES (?, ?, ?)',
+                [
+                    ('abba', 1530403100, 19.0),
+                    ('abba', 1530403300, 23.0),
+                    ('abba', 1533081600, 24.0),
+                    ('iddqd', 1530403300, 27.0)
+                ]
+            )
+        self.assertEqual(SensorManager.split_legacy_partition('abba'), 3)
+        self.assertEqual(SensorManager.split_legacy_partition('foo'), 0)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM datas')
+            self.assertEqual(cursor.fetchall(), [('iddqd',)])
+            cursor.execute('SELECT count(*) FROM datas_201807')
+            self.assertEqual(cursor.fetchone(), (1,))
+        self.assertEqual(
+            [row for rows in SensorManager.iter_readings('abba', 0, 2 ** 40) for row in rows],
+            [(1530403100, 19.0), (1530403300, 23.0), (1533081600, 24.0)]
+        )
+
+    def test_split_legacy_partition_milliseconds(self):
+        """
+        Legacy rows with millisecond timestamps are moved to the month
+        of their time in seconds and stored in seconds
+        """
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO datas VALUES (?, ?, ?)',
+                [
+                    ('abba', 1530127249766, 19.0),
+                    ('abba', 1530403300, 23.0),
+                    ('abba', 1533081600500, 24.0)
+                ]
+            )
+        self.assertEqual(SensorManager.split_legacy_partition('abba'), 3)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT name FROM datas_partitions ORDER BY name')
+            self.assertEqual(
+                cursor.fetchall(),
+                [('datas',), ('datas_201806',), ('datas_201807',), ('datas_201808',)]
+            )
+            cursor.execute('SELECT count(*) FROM datas')
+            self.assertEqual(cursor.fetchone(), (0,))
+        self.assertEqual(
+            [row for rows in SensorManager.iter_readings('abba', 0, 2 ** 40) for row in rows],
+            [(1530127249, 19.0), (1530403300, 23.0), (1533081600, 24.0)]
+        )
+
+    def test_archive_partition(self):
+        """
+        Readings of an archived partition are returned by every query
+        the same way as before archiving
+        """
+        june = 1527811200
+        events = [
+            ('abba', june + 5 * i + (i % 7 == 0), 20.0 + (i % 13) / 10)
+            for i in range(0, 3 * 17280, 97)
+        ] + [
+            ('iddqd', june + 86400 + 30, 25.0),
+            ('abba', 1530403200, 21.0)
+        ]
+        write_sensor_events(events)
+        end = 1530403201
+
+        def snapshot():
+            SensorManager.backfill_rollups('abba')
+            return (
+                [row for rows in SensorManager.iter_readings('abba', 0, end, 100) for row in rows],
+                SensorManager.aggregate_range('abba', june + 86400 - 20, june + 86400 + 30),
+                SensorManager.aggregate_sensor('abba'),
+                SensorManager.get_bucket_averages('abba', june + 1000, end, 50),
+                SensorManager.get_last_reading('abba', 0, june + 86400),
+                SensorManager.get_sensor_ids(),
+                self.get_rollups('minute')
+            )
+
+        before = snapshot()
+        self.assertEqual(
+            SensorManager.archive_partition('datas_201806'),
+            len(events) - 1
+        )
+        cursor = SensorManager.raw_connection().cursor()
+        self.assertEqual(SensorManager.get_partitions(cursor), ['datas', 'datas_201807'])
+        cursor.execute(
+            """
+            SELECT sensors.id, start_time, end_time
+            FROM archive_segments JOIN sensors ON sensor_key = archive_segments.id
+            ORDER BY sensors.id, start_time
+            """
+        )
+        self.assertEqual(
+            cursor.fetchall(),
+            [
+                ('abba', june, june + 86400),
+                ('abba', june + 86400, june + 2 * 86400),
+                ('abba', june + 2 * 86400, june + 3 * 86400),
+                ('iddqd', june + 86400, june + 2 * 86400)
+            ]
+        )
+        after = snapshot()
+        # totals are summed in a different order
+        for expected, actual in zip(round_floats(before), round_floats(after)):
+            self.assertTrue(actual == expected, (str(actual)[:300], str(expected)[:300]))
+
+        # late readings of an archived month are merged into its segments
+        write_sensor_events([('iddqd', june + 86400 + 10, 24.0)])
+        SensorManager.archive_partitions(1530403200)
+        self.assertEqual(
+            SensorManager.aggregate_sensor('iddqd'),
+            (2, 49.0, june + 86400 + 30, 25.0)
+        )
+
+    def get_rollups(self, level):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT sensors.id, bucket, count, total, min, max
+                FROM rollup_{level} JOIN sensors ON sensor_key = rollup_{level}.id
+                ORDER BY sensors.id, bucket
+                """
+            )
+            return cursor.fetchall()
+
+    def test_update_rollups(self):
+        """
+        Rollups stage adds events to
+        existing minute/hour/day buckets or creates new ones
+        """
+        update_rollups([
+            ('iddqd', 3600, 20.0),
+            ('iddqd', 3659, 22.0),
+            ('iddqd', 3660, 27.0)
+        ])
+        update_rollups([
+            ('iddqd', 3601, 18.0),
+            ('abba', 1530127249766, 21.0)
+        ])
+        self.assertEqual(
+            self.get_rollups('minute'),
+            [
+                ('abba', 1530127200, 1, 21.0, 21.0, 21.0),
+                ('iddqd', 3600, 3, 60.0, 18.0, 22.0),
+                ('iddqd', 3660, 1, 27.0, 27.0, 27.0)
+            ]
+        )
+        self.assertEqual(
+            self.get_rollups('hour'),
+            [
+                ('abba', 1530126000, 1, 21.0, 21.0, 21.0),
+                ('iddqd', 3600, 4, 87.0, 18.0, 27.0)
+            ]
+        )
+        self.assertEqual(
+            self.get_rollups('day'),
+            [
+                ('abba', 1530057600, 1, 21.0, 21.0, 21.0),
+                ('iddqd', 0, 4, 87.0, 18.0, 27.0)
+            ]
+        )
+
+    def test_backfill_rollups(self):
         """
-        SensorManager.update_sensor_statistics
-        puts data in django cache with timeout=None
-        so it doesn't expire
+        SensorManager.backfill_rollups rebuilds rollups of a sensor
+        from datas table
         """
-        mock_cache.get.return_value = {}
-        SensorManager.update_sensor_statistics(
-            'iddqd',
-            23.91569438663249
+        events = [
+            ('iddqd', 3600, 20.0),
+            ('iddqd', 3659, 22.0),
+            ('iddqd', 3660, 27.0),
+            ('iddqd', 90000, 18.0)
+        ]
+        write_sensor_events(events)
+        update_rollups(events[:1])
+        SensorManager.backfill_rollups('iddqd')
+        self.assertEqual(
+            self.get_rollups('minute'),
+            [
+                ('iddqd', 3600, 2, 42.0, 20.0, 22.0),
+                ('iddqd', 3660, 1, 27.0, 27.0, 27.0),
+                ('iddqd', 90000, 1, 18.0, 18.0, 18.0)
+            ]
+        )
+        self.assertEqual(
+            self.get_rollups('hour'),
+            [
+                ('iddqd', 3600, 3, 69.0, 20.0, 27.0),
+                ('iddqd', 90000, 1, 18.0, 18.0, 18.0)
+            ]
         )
-        mock_cache.set.assert_called_once_with(
-            "iddqd",
+        self.assertEqual(
+            self.get_rollups('day'),
+            [
+                ('iddqd', 0, 3, 69.0, 20.0, 27.0),
+                ('iddqd', 86400, 1, 18.0, 18.0, 18.0)
+            ]
+        )
+
+    def test_plan_range(self):
+        """
+        SensorManager.plan_range covers the window with the coarsest
+        rollup buckets which fit and leaves the edges to finer levels
+        """
+        self.assertEqual(
+            SensorManager.plan_range(30, 2 * 86400 + 3600 + 90),
+            [
+                (None, 30, 60),
+                ('minute', 60, 3600),
+                ('hour', 3600, 86400),
+                ('day', 86400, 2 * 86400),
+                ('hour', 2 * 86400, 2 * 86400 + 3600),
+                ('minute', 2 * 86400 + 3600, 2 * 86400 + 3660),
+                (None, 2 * 86400 + 3660, 2 * 86400 + 3690)
+            ]
+        )
+        self.assertEqual(SensorManager.plan_range(10, 50), [(None, 10, 50)])
+        self.assertEqual(SensorManager.plan_range(50, 10), [])
+
+    def test_aggregate_range(self):
+        """
+        SensorManager.aggregate_range combines rollups and raw rows
+        at the edges of the window
+        """
+        events = [
+            ('iddqd', 30, 20.0),
+            ('iddqd', 59, 22.0),
+            ('iddqd', 60, 27.0),
+            ('iddqd', 3600, 18.0),
+            ('iddqd', 90000, 25.0),
+            ('iddqd', 90030, 29.0),
+            ('abba', 3600, 10.0)
+        ]
+        write_sensor_events(events)
+        update_rollups(events)
+        self.assertEqual(
+            SensorManager.aggregate_range('iddqd', 59, 90030),
+            (4, 92.0, 18.0, 27.0)
+        )
+        self.assertEqual(
+            SensorManager.aggregate_range('iddqd', 0, 100000),
+            (6, 141.0, 18.0, 29.0)
+        )
+        self.assertEqual(
+            SensorManager.aggregate_range('iddqd', 100000, 200000),
+            (0, 0.0, None, None)
+        )
+        self.assertEqual(
+            SensorManager.aggregate_range_buckets('iddqd', 59, 90031, 'hour'),
+            [
+                (59, 2, 49.0, 22.0, 27.0),
+                (3600, 1, 18.0, 18.0, 18.0),
+                (90000, 2, 54.0, 25.0, 29.0)
+            ]
+        )
+
+    def test_iter_readings(self):
+        """
+        SensorManager.iter_readings yields readings in [start, end)
+        ordered by time in batches
+        """
+        write_sensor_events([
+            ('iddqd', 3, 20.0),
+            ('iddqd', 1, 22.0),
+            ('iddqd', 2, 27.0),
+            ('iddqd', 4, 18.0),
+            ('abba', 2, 21.0)
+        ])
+        self.assertEqual(
+            list(SensorManager.iter_readings('iddqd', 1, 4, batch_size=2)),
+            [[(1, 22.0), (2, 27.0)], [(3, 20.0)]]
+        )
+
+    def test_weather(self):
+        """
+        SensorManager.write_weather stores helsinki temperature readings
+        in seconds, get_weather returns them as arrays ordered by time
+        """
+        SensorManager.write_weather(1530127250000, 19.5)
+        SensorManager.write_weather(1530127245, 19.0)
+        SensorManager.write_weather(1530127255, 20.0)
+        times, temperatures = SensorManager.get_weather(1530127245, 1530127255)
+        self.assertEqual(times.tolist(), [1530127245, 1530127250])
+        self.assertEqual(temperatures.tolist(), [19.0, 19.5])
+        times, temperatures = SensorManager.get_weather(0, 1)
+        self.assertEqual((len(times), len(temperatures)), (0, 0))
+
+    def test_align_weather(self):
+        """
+        SensorManager.align_weather matches every reading with the latest
+        weather reading at or before it, same as a lookup per reading
+        """
+        rng = np.random.RandomState(0)
+        weather_times = np.unique(rng.randint(0, 10000, 500))
+        weather_temperatures = rng.uniform(-20, 30, len(weather_times))
+        times = np.sort(rng.randint(0, 12000, 2000))
+        values = rng.uniform(15, 30, len(times))
+        aligned_times, diffs = SensorManager.align_weather(
+            times, values, weather_times, weather_temperatures, max_age=50
+        )
+        expected = []
+        for time, value in zip(times, values):
+            previous = [
+                temperature
+                for weather_time, temperature in zip(weather_times, weather_temperatures)
+                if time - 50 <= weather_time <= time
+            ]
+            if previous:
+                expected.append((time, abs(value - previous[-1])))
+        self.assertEqual(list(zip(aligned_times.tolist(), diffs.tolist())), expected)
+
+    def test_iter_temp_diffs(self):
+        """
+        SensorManager.iter_temp_diffs compares readings with weather
+        readings of their time, including ones before the window
+        """
+        write_sensor_events([
+            ('iddqd', 10, 20.0),
+            ('iddqd', 20, 22.0),
+            ('iddqd', 30, 23.0),
+            ('iddqd', 10000, 24.0),
+            ('abba', 20, 25.0)
+        ])
+        SensorManager.write_weather(5, 18.0)
+        SensorManager.write_weather(25, 21.0)
+        with mock.patch.object(
+            SensorManager,
+            'get_weather',
+            wraps=SensorManager.get_weather
+        ) as mock_get_weather:
+            diffs = list(SensorManager.iter_temp_diffs('iddqd', 20, 20000))
+        # weather is read for the time range of each batch only
+        mock_get_weather.assert_called_once_with(20 - 60 * 60, 10001)
+        self.assertEqual(len(diffs), 1)
+        self.assertEqual(diffs[0][0].tolist(), [20, 30])
+        self.assertEqual(diffs[0][1].tolist(), [4.0, 2.0])
+        self.assertEqual(list(SensorManager.iter_temp_diffs('iddqd', 0, 5)), [])
+
+    def test_get_series(self):
+        """
+        SensorManager.get_series returns readings as they are
+        if there are fewer of them than requested points
+        """
+        write_sensor_events([
+            ('iddqd', 1, 22.0),
+            ('iddqd', 2, 27.0),
+            ('iddqd', 3, 20.0)
+        ])
+        self.assertEqual(
+            SensorManager.get_series('iddqd', 0, 10, 3),
+            [[1, 22.0], [2, 27.0], [3, 20.0]]
+        )
+
+    def test_get_series_lttb(self):
+        """
+        SensorManager.get_series downsamples readings to the requested
+        number of points
+        """
+        write_sensor_events([
+            ('iddqd', t, float(t % 7)) for t in range(100)
+        ])
+        series = SensorManager.get_series('iddqd', 0, 100, 10)
+        self.assertEqual(len(series), 10)
+        self.assertEqual(series[0], [0, 0.0])
+        self.assertEqual(series[-1], [99, 1.0])
+        series = SensorManager.get_series('iddqd', 0, 100, 10, method='minmax')
+        self.assertEqual(len(series), 10)
+
+    def test_get_sensor_ids(self):
+        """
+        SensorManager.get_sensor_ids returns distinct ids from datas table
+        """
+        write_sensor_events([
+            ('iddqd', 1, 20.0),
+            ('abba', 1, 21.0),
+            ('iddqd', 2, 22.0),
+            ('acdc', 1, 23.0)
+        ])
+        self.assertEqual(
+            SensorManager.get_sensor_ids(),
+            ['abba', 'acdc', 'iddqd']
+        )
+
+    def test_get_stats_for_all_sensors(self):
+        """
+        SensorManager.get_stats_for_all_sensors returns the value
+        with the latest time for each sensor regardless of insertion order
+        """
+        # create_iot_db.py inserts rows from the newest to the oldest one
+        write_sensor_events([
+            ('iddqd', 3, 20.0),
+            ('iddqd', 2, 22.0),
+            ('iddqd', 1, 27.0),
+            ('abba', 1, 21.0),
+            ('abba', 5, 25.0)
+        ])
+        self.assertCountEqual(
+            SensorManager.get_stats_for_all_sensors(),
+            [
+                ('iddqd', 20.0, 3, 23.0, 69.0),
+                ('abba', 25.0, 2, 23.0, 46.0)
+            ]
+        )
+
+    def test_aggregate_sensor_read_only(self):
+        """
+        Process pool workers aggregate a sensor
+        on a separate read-only connection
+        """
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, 'iot_db.sqlite')
+            conn = sqlite3.connect(db_path)
+            # same schema as the test database
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT sql FROM sqlite_master
+                    WHERE name IN ('datas', 'datas_partitions', 'archive_segments', 'sensors')
+                    """
+                )
+                for sql, in cursor.fetchall():
+                    conn.execute(sql)
+            conn.execute("INSERT INTO datas_partitions VALUES ('datas', NULL, NULL)")
+            conn.executemany(
+                'INSERT INTO datas VALUES (?, ?, ?)',
+                [('iddqd', 1, 20.0), ('iddqd', 2, 22.0), ('abba', 3, 21.0)]
+            )
+            conn.commit()
+            conn.close()
+            self.assertEqual(
+                _aggregate_sensor_read_only(db_path, 'iddqd'),
+                (2, 42.0, 2, 22.0)
+            )
+            self.assertEqual(
+                _aggregate_sensor_read_only(db_path, 'iddqd', [('datas', 1, 3)], False),
+                (1, 22.0, 2, 22.0)
+            )
+
+    def test_get_stats_since_checkpoints(self):
+        """
+        SensorManager.get_stats_since_checkpoints folds rows inserted after
+        the watermark of each partition into the checkpoints and moves
+        the watermarks forward
+        """
+        write_sensor_events([
+            ('iddqd', 1, 20.0),
+            ('iddqd', 2, 22.0),
+            ('abba', 1, 21.0)
+        ])
+        self.assertCountEqual(
+            SensorManager.get_stats_since_checkpoints(),
+            [
+                ('iddqd', 22.0, 2, 21.0, 42.0),
+                ('abba', 21.0, 1, 21.0, 21.0)
+            ]
+        )
+        self.assertDictEqual(
+            SensorManager.get_checkpoints(),
             {
-                "count": 1,
-                "avg": 23.91569438663249,
-                "temperature": 23.91569438663249,
-                "total": 23.91569438663249
-            },
-            timeout=None
-        )
-
-    @mock.patch('sensor.models.cache')
-    def test_update_statistics_non_empty(self, mock_cache):
-        """
-        SensorManager.update_sensor_statistics correctly
-        updates count/avg in django cache
-        """
-        previous_temp = 24.91569438663249
-        previous_total = previous_temp
-        previous_avg = previous_temp
-        mock_cache.get.return_value = {
-            "count": 1,
-            "avg": previous_avg,
-            "temperature": previous_temp,
-            "total": previous_total
-        }
-        new_temp = 23.91569438663249
-        SensorManager.update_sensor_statistics(
-            'iddqd',
-            new_temp
+                'iddqd': (2, 2, 42.0, 22.0),
+                'abba': (1, 1, 21.0, 21.0)
+            }
+        )
+        self.assertDictEqual(
+            SensorManager.get_watermarks(),
+            {'datas': 0, 'datas_197001': 3}
+        )
+
+        write_sensor_events([('iddqd', 3, 27.0)])
+        with mock.patch.object(
+            SensorManager,
+            'aggregate_sensor',
+            wraps=SensorManager.aggregate_sensor
+        ) as mock_aggregate:
+            stats = SensorManager.get_stats_since_checkpoints()
+        mock_aggregate.assert_any_call('iddqd', [('datas', 0, 0), ('datas_197001', 3, 4)], False)
+        self.assertCountEqual(
+            stats,
+            [
+                ('iddqd', 27.0, 3, 23.0, 69.0),
+                ('abba', 21.0, 1, 21.0, 21.0)
+            ]
         )
 
-        new_total = new_temp + previous_temp
-        mock_cache.set.assert_called_once_with(
-            "iddqd",
+    def test_get_stats_since_checkpoints_late_readings(self):
+        """
+        Readings inserted after a run are aggregated by the next one
+        even when they are older than the latest reading or share its second
+        """
+        write_sensor_events([('iddqd', 5, 20.0)])
+        SensorManager.get_stats_since_checkpoints()
+        write_sensor_events([('iddqd', 5, 22.0), ('iddqd', 1, 27.0)])
+        self.assertEqual(
+            SensorManager.get_stats_since_checkpoints(),
+            [('iddqd', 22.0, 3, 23.0, 69.0)]
+        )
+        self.assertEqual(
+            SensorManager.get_stats_since_checkpoints(),
+            [('iddqd', 22.0, 3, 23.0, 69.0)]
+        )
+
+    def test_get_stats_since_checkpoints_maintenance(self):
+        """
+        Rows which statistics haven't aggregated yet are folded into the
+        checkpoints when their partition is archived, dropped or split
+        """
+        june = 1527811200
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO datas VALUES (?, ?, ?)',
+                [('abba', june + 10, 19.0), ('abba', (june + 20) * 1000, 21.0)]
+            )
+        write_sensor_events([
+            ('iddqd', june + 30, 20.0),
+            ('iddqd', june + 86400 * 31, 22.0)
+        ])
+        SensorManager.get_stats_since_checkpoints()
+        with connection.cursor() as cursor:
+            cursor.execute('INSERT INTO datas VALUES (?, ?, ?)', ('abba', june + 5, 23.0))
+        write_sensor_events([
+            ('iddqd', june + 40, 24.0),
+            ('iddqd', june + 86400 * 31 + 10, 26.0)
+        ])
+        self.assertEqual(SensorManager.split_legacy_partition('abba'), 3)
+        self.assertEqual(SensorManager.drop_partitions(june + 86400 * 30), ['datas_201806'])
+        SensorManager.archive_partition('datas_201807')
+        self.assertEqual(SensorManager.get_watermarks(), {'datas': 2})
+        expected = [('iddqd', 26.0, 4, 23.0, 92.0)]
+        self.assertEqual(SensorManager.get_stats_since_checkpoints(), expected)
+        self.assertEqual(SensorManager.get_stats_since_checkpoints(), expected)
+        self.assertEqual(SensorManager.get_checkpoints()['abba'], (june + 20, 3, 63.0, 21.0))
+
+    def test_get_stats_since_checkpoints_without_save(self):
+        """
+        Checkpoints are left as they are when save is False
+        """
+        write_sensor_events([('iddqd', 1, 20.0)])
+        SensorManager.get_stats_since_checkpoints()
+        write_sensor_events([('iddqd', 2, 22.0)])
+        for _ in range(2):
+            self.assertEqual(
+                SensorManager.get_stats_since_checkpoints(save=False),
+                [('iddqd', 22.0, 2, 21.0, 42.0)]
+            )
+        self.assertEqual(SensorManager.get_checkpoints(), {'iddqd': (1, 1, 20.0, 20.0)})
+        self.assertEqual(SensorManager.get_watermarks(), {'datas': 0, 'datas_197001': 1})
+
+    @mock.patch('sensor.models.SensorManager.get')
+    def test_hard_reset_statistics_health_check(self, mocked_get):
+        """
+        hard_reset_statistics --health_check doesn't store checkpoints
+        """
+        mocked_get.return_value = {
+            'avg': 20.0, 'count': 1, 'temperature': 20.0, 'total': 20.0
+        }
+        write_sensor_events([('iddqd', 1, 20.0)])
+        for options in ({}, {'full': True}):
+            call_command('hard_reset_statistics', health_check=True, workers=1, **options)
+        self.assertEqual(SensorManager.get_checkpoints(), {})
+        self.assertEqual(SensorManager.get_watermarks(), {})
+
+    def test_save_checkpoints_conflict(self):
+        """
+        Checkpoints are not saved when they changed during the run
+        """
+        write_sensor_events([('iddqd', 1, 20.0)])
+        SensorManager.get_stats_since_checkpoints()
+        previous = SensorManager.get_checkpoints(), SensorManager.get_watermarks()
+        write_sensor_events([('iddqd', 2, 22.0)])
+        SensorManager.get_stats_since_checkpoints()
+        self.assertFalse(SensorManager.save_checkpoints({}, {}, previous))
+        self.assertEqual(SensorManager.get_checkpoints(), {'iddqd': (2, 2, 42.0, 22.0)})
+
+    def test_incr_statistics(self):
+        """
+        SensorManager.incr_statistics increments count/total of sensor
+        hashes and stores the latest temperature with one update per sensor
+        """
+        pipe = mock.Mock()
+        SensorManager.incr_statistics(pipe, [
+            ('iddqd', 1530127249766, 23.91569438663249),
+            ('abba', 1530127249767, 24.1),
+            ('iddqd', 1530127249768, 24.0)
+        ])
+        self.assertEqual(pipe.hincrby.call_args_list, [
+            mock.call('sensor_statistics:iddqd', 'count', 2),
+            mock.call('sensor_statistics:abba', 'count', 1)
+        ])
+        self.assertEqual(pipe.hincrbyfloat.call_args_list, [
+            mock.call('sensor_statistics:iddqd', 'total', 23.91569438663249 + 24.0),
+            mock.call('sensor_statistics:abba', 'total', 24.1)
+        ])
+        self.assertEqual(pipe.hset.call_args_list, [
+            mock.call('sensor_statistics:iddqd', 'temperature', 24.0),
+            mock.call('sensor_statistics:abba', 'temperature', 24.1)
+        ])
+        pipe.publish.assert_not_called()
+
+    @mock.patch('sensor.models.SensorManager.refresh_statistics_document')
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_set_many(self, mock_redis, mock_refresh):
+        """
+        SensorManager.set_many replaces hashes of all sensors in one pipeline
+        """
+        pipe = mock_redis.return_value.pipeline.return_value
+        SensorManager.set_many([
+            ('iddqd', 2, 22.0, 42.0),
+            ('abba', 1, 21.0, 21.0)
+        ])
+        mock_redis.return_value.pipeline.assert_called_once_with()
+        pipe.hmset.assert_has_calls([
+            mock.call(
+                'sensor_statistics:iddqd',
+                {'count': 2, 'temperature': 22.0, 'total': 42.0}
+            ),
+            mock.call(
+                'sensor_statistics:abba',
+                {'count': 1, 'temperature': 21.0, 'total': 21.0}
+            )
+        ])
+        pipe.execute.assert_called_once_with()
+        mock_refresh.assert_called_once_with()
+
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_get(self, mock_redis):
+        """
+        SensorManager.get calculates avg from count and total
+        stored in the sensor hash
+        """
+        mock_redis.return_value.hgetall.return_value = {
+            b'count': b'2',
+            b'total': b'48.83138877326498',
+            b'temperature': b'23.91569438663249'
+        }
+        self.assertDictEqual(
+            SensorManager.get('iddqd'),
             {
-                "count": 2,
-                "avg": new_total / 2,
-                "temperature": new_temp,
-                "total": new_total
-            },
-            timeout=None
+                'count': 2,
+                'avg': 48.83138877326498 / 2,
+                'temperature': 23.91569438663249,
+                'total': 48.83138877326498
+            }
+        )
+        mock_redis.return_value.hgetall.assert_called_once_with(
+            'sensor_statistics:iddqd'
+        )
+
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_get_empty(self, mock_redis):
+        """
+        SensorManager.get returns default if there is no hash for the sensor
+        """
+        mock_redis.return_value.hgetall.return_value = {}
+        self.assertEqual(SensorManager.get('foo', {}), {})
+
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_get_hot_cache(self, mock_redis):
+        """
+        Statistics are read from redis once per hot cache ttl,
+        sensors without statistics are cached too
+        """
+        mock_redis.return_value.hgetall.side_effect = [
+            {b'count': b'2', b'total': b'48.0'},
+            {}
+        ]
+        for _ in range(2):
+            self.assertEqual(SensorManager.get('iddqd')['count'], 2)
+            self.assertIsNone(SensorManager.get('foo'))
+        self.assertEqual(mock_redis.return_value.hgetall.call_count, 2)
+
+    @mock.patch('sensor.models.HOT_CACHE_INVALIDATION', True)
+    @mock.patch('sensor.models.SensorManager.hot_cache')
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_hot_cache_invalidation(self, mock_redis, mock_hot_cache):
+        """
+        Updated statistics keys are published in the same redis transaction,
+        reads make sure the process listens to them
+        """
+        pipe = mock.Mock()
+        SensorManager.incr_statistics(pipe, [
+            ('iddqd', None, 20.0),
+            ('abba', None, 21.0),
+            ('iddqd', None, 22.0)
+        ])
+        pipe.publish.assert_called_once_with(
+            'sensor_hot_cache',
+            'sensor_statistics:abba,sensor_statistics:iddqd,sensor_statistics'
+        )
+        SensorManager.get_statistics()
+        mock_hot_cache.listen.assert_called_once_with(
+            mock_redis.return_value, 'sensor_hot_cache'
+        )
+        mock_hot_cache.lookup.return_value = (None, 0)
+        SensorManager.get_helsinki_temp_diffs(['iddqd'])
+        self.assertEqual(mock_hot_cache.listen.call_count, 2)
+
+    @mock.patch('sensor.models.SUPPORTED_SENSORS', ['abba', 'foo'])
+    @mock.patch('sensor.models.time.time', return_value=1530127249.5)
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_refresh_statistics_document(self, mock_redis, mock_time):
+        """
+        SensorManager.refresh_statistics_document serializes statistics
+        while they are watched and bumps the document version
+        """
+        pipe = mock.Mock()
+        mock_redis.return_value.pipeline.return_value.execute.return_value = [
+            {b'count': b'2', b'total': b'48.0'},
+            {}
+        ]
+
+        def transaction(write, *keys):
+            self.assertEqual(keys, ('sensor_statistics:abba', 'sensor_statistics:foo'))
+            write(pipe)
+            return [True, 7]
+
+        mock_redis.return_value.transaction.side_effect = transaction
+        body = b'{"sensors": [{"id": "abba", "count": 2, "avgTemp": 24.0}]}'
+        self.assertEqual(
+            SensorManager.refresh_statistics_document(),
+            (body, 7, 1530127249.5)
+        )
+        pipe.multi.assert_called_once_with()
+        pipe.hmset.assert_called_once_with(
+            'sensor_statistics_document',
+            {'body': body, 'modified': 1530127249.5}
+        )
+        pipe.hincrby.assert_called_once_with('sensor_statistics_document', 'version', 1)
+
+    @mock.patch('sensor.models.SensorManager.refresh_statistics_document')
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_get_statistics_document(self, mock_redis, mock_refresh):
+        """
+        SensorManager.get_statistics_document reads the stored document,
+        it is built if there is none yet
+        """
+        mock_redis.return_value.hgetall.return_value = {
+            b'body': b'{"sensors": []}',
+            b'version': b'3',
+            b'modified': b'1530127249.5'
+        }
+        self.assertEqual(
+            SensorManager.get_statistics_document(),
+            (b'{"sensors": []}', 3, 1530127249.5)
+        )
+        SensorManager.hot_cache.clear()
+        mock_redis.return_value.hgetall.return_value = {}
+        self.assertEqual(
+            SensorManager.get_statistics_document(),
+            mock_refresh.return_value
         )
 
     @mock.patch('sensor.models.cache.set')
@@ -74,58 +966,90 @@ class SensorManagerTest(TestCase):
             'helsinki_temperature', temp, timeout=None
         )
 
-    @mock.patch('sensor.models.cache')
-    def test_get_statistics(self, mock_cache):
+    @mock.patch('sensor.models.SUPPORTED_SENSORS', ['abba5', 'abba', 'foo'])
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_get_statistics(self, mock_redis):
         """
         SensorManager.get_statistics() returns data
         for all sensors specified in constants.SUPPORTED_SENSORS
-        from django cache
-        """
-        mock_cache.get_many.return_value = {
-            "abba5": {"count": 36, "avg": 23.76197165651435},
-            "abba": {"count": 12500000, "avg": 25.725636626332992},
-            "acdc": {"count": 12500000, "avg": 25.186297131260652},
-            "iddqd": {"count": 12500036, "avg": 25.87519048725104},
-            "idkfa": {"count": 12500000, "avg": 27.081039930247535}
-        }
+        which have statistics in redis
+        """
+        pipe = mock_redis.return_value.pipeline.return_value
+        pipe.execute.return_value = [
+            {b'count': b'36', b'total': b'855.4309796345166'},
+            {b'count': b'12500000', b'total': b'321570457.8291624'},
+            {}
+        ]
         stats = SensorManager.get_statistics()
+        self.assertEqual(pipe.hgetall.call_count, 3)
         self.assertCountEqual(
             stats,
             [
-                {'id': 'abba5', 'count': 36, 'avgTemp': 23.76197165651435},
-                {'id': 'abba', 'count': 12500000, 'avgTemp': 25.725636626332992},
-                {'id': 'acdc', 'count': 12500000, 'avgTemp': 25.186297131260652},
-                {'id': 'iddqd', 'count': 12500036, 'avgTemp': 25.87519048725104},
-                {'id': 'idkfa', 'count': 12500000, 'avgTemp': 27.081039930247535}
+                {'id': 'abba5', 'count': 36, 'avgTemp': 855.4309796345166 / 36},
+                {'id': 'abba', 'count': 12500000, 'avgTemp': 321570457.8291624 / 12500000},
             ]
         )
 
+    @mock.patch('sensor.models.SensorManager.get_helsinki_temperature')
     @mock.patch('sensor.models.SensorManager.get')
-    def test_get_helsinki_temp_diff(self, mock_sensor_manager_get):
+    def test_get_helsinki_temp_diff(self, mock_sensor_manager_get,
+                                    mock_get_helsinki_temperature):
         """
         SensorManager.get_helsinki_temp_diff gets value for
-        a given sensor and helsinki_temperature from django cache
+        a given sensor and helsinki_temperature from cache
         and returns abs(sensor_temp - helsinki_temperature)
         """
         temp = 23.7619716565143
         helsinki_temp = 19.08
-        mock_sensor_manager_get.side_effect = [
-            {'temperature': temp},
-            helsinki_temp
-        ]
+        mock_sensor_manager_get.return_value = {'temperature': temp}
+        mock_get_helsinki_temperature.return_value = helsinki_temp
         diff = SensorManager.get_helsinki_temp_diff('iddqd')
         self.assertEqual(diff, temp - helsinki_temp)
 
+    @mock.patch('sensor.models.SensorManager.redis')
+    def test_get_helsinki_temp_diffs(self, mock_redis):
+        """
+        SensorManager.get_helsinki_temp_diffs reads statistics missing
+        from the hot cache and helsinki temperature in one pipeline
+        """
+        pipe = mock_redis.return_value.pipeline.return_value
+        pipe.execute.return_value = [
+            {b'count': b'2', b'total': b'40.0', b'temperature': b'23.5'},
+            {},
+            {b'count': b'1', b'total': b'19.0', b'temperature': b'19'},
+            b'19'
+        ]
+        self.assertEqual(
+            SensorManager.get_helsinki_temp_diffs(['iddqd', 'abba', 'acdc']),
+            {'iddqd': 4.5, 'abba': None, 'acdc': 0.0}
+        )
+        self.assertEqual(
+            pipe.hgetall.call_args_list,
+            [
+                mock.call('sensor_statistics:iddqd'),
+                mock.call('sensor_statistics:abba'),
+                mock.call('sensor_statistics:acdc')
+            ]
+        )
+        pipe.get.assert_called_once_with(SensorManager.helsinki_temperature_redis_key())
+
+        pipe.execute.return_value = [{b'count': b'1', b'total': b'20.0', b'temperature': b'20'}, b'19']
+        self.assertEqual(
+            SensorManager.get_helsinki_temp_diffs(['iddqd', 'idkfa']),
+            {'iddqd': 4.5, 'idkfa': 1.0}
+        )
+        self.assertEqual(pipe.hgetall.call_args, mock.call('sensor_statistics:idkfa'))
+        self.assertEqual(pipe.execute.call_count, 2)
+
+    @mock.patch('sensor.models.SensorManager.get_helsinki_temperature')
     @mock.patch('sensor.models.SensorManager.get')
-    def test_get_helsinki_temp_diff_no_data(self, mock_sensor_manager_get):
+    def test_get_helsinki_temp_diff_no_data(self, mock_sensor_manager_get,
+                                            mock_get_helsinki_temperature):
         """
         SensorManager.get_helsinki_temp_diff returns None
         if no data for sensor is present
         """
-        helsinki_temp = 19.08
-        mock_sensor_manager_get.side_effect = [
-            {},
-            helsinki_temp
-        ]
+        mock_sensor_manager_get.return_value = {}
+        mock_get_helsinki_temperature.return_value = 19.08
         diff = SensorManager.get_helsinki_temp_diff('foo')
         self.assertIsNone(diff)
@@ -0,0 +1,144 @@
+import asyncio
+import json
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from sensor.auth import get_bearer_token, get_token_user_id
+from sensor.stream import ReadingsHub, stream_readings
+
+READINGS = [
+    {'id': 'iddqd', 'timestamp': 1530127249, 'value': 23.9},
+    {'id': 'abba', 'timestamp': 1530127250, 'value': 24.1}
+]
+
+
+def make_scope(query_string=b'', headers=()):
+    return {
+        'type': 'http',
+        'method': 'GET',
+        'path': '/sensor/stream/',
+        'query_string': query_string,
+        'headers': list(headers)
+    }
+
+
+class ReadingsStreamTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='12345')
+        self.token = str(AccessToken.for_user(self.user))
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_stream(self, scope, hub, on_send=None):
+        """
+        Run stream_readings until the client disconnects,
+        on_send(sent messages) returns True to disconnect
+        """
+        async def run():
+            disconnected = asyncio.Event()
+            sent = []
+            # servers send the (empty) request body before a disconnect
+            messages = iter([{'type': 'http.request', 'body': b'', 'more_body': False}])
+
+            async def receive():
+                for message in messages:
+                    return message
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if on_send is not None and on_send(sent):
+                    disconnected.set()
+
+            await stream_readings(scope, receive, send, hub=hub)
+            return sent
+
+        return self.loop.run_until_complete(run())
+
+    def test_token(self):
+        self.assertEqual(get_token_user_id(self.token), self.user.id)
+        self.assertIsNone(get_token_user_id(self.token + 'x'))
+        self.assertIsNone(get_token_user_id(None))
+        self.assertEqual(get_bearer_token(f'Bearer {self.token}'), self.token)
+        self.assertIsNone(get_bearer_token(f'Basic {self.token}'))
+
+    def test_publish(self):
+        """
+        ReadingsHub puts readings of subscribed sensors to client queues,
+        a client which falls behind gets None and is unsubscribed
+        """
+        hub = ReadingsHub(queue_size=1)
+
+        async def publish():
+            everything = hub.subscribe()
+            iddqd = hub.subscribe(frozenset(['iddqd']))
+            idkfa = hub.subscribe(frozenset(['idkfa']))
+            hub.publish(json.dumps(READINGS).encode())
+            self.assertEqual(
+                everything.get_nowait(),
+                b'event: readings\ndata: ' + json.dumps(READINGS).encode() + b'\n\n'
+            )
+            self.assertEqual(
+                iddqd.get_nowait(),
+                b'event: readings\ndata: ' + json.dumps(READINGS[:1]).encode() + b'\n\n'
+            )
+            self.assertTrue(idkfa.empty())
+            hub.publish(json.dumps(READINGS).encode())
+            hub.publish(json.dumps(READINGS).encode())
+            self.assertIsNone(iddqd.get_nowait())
+            self.assertEqual(set(hub.clients), {idkfa})
+
+        self.loop.run_until_complete(publish())
+
+    def test_stream(self):
+        """
+        /sensor/stream/ sends published readings as server-sent events
+        and unsubscribes the client once it disconnects
+        """
+        hub = ReadingsHub()
+        hub.start = mock.Mock()
+
+        def on_send(sent):
+            if len(sent) == 2:
+                hub.publish(json.dumps(READINGS).encode())
+            return len(sent) == 3
+
+        sent = self.run_stream(
+            make_scope(f'ids=abba&token={self.token}'.encode()),
+            hub,
+            on_send
+        )
+        hub.start.assert_called_once_with()
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn((b'content-type', b'text/event-stream'), sent[0]['headers'])
+        self.assertEqual(
+            sent[2]['body'],
+            b'event: readings\ndata: ' + json.dumps(READINGS[1:]).encode() + b'\n\n'
+        )
+        self.assertEqual(hub.clients, {})
+
+    @mock.patch('sensor.stream.STREAM_HEARTBEAT_SECONDS', 0.01)
+    def test_heartbeat(self):
+        hub = ReadingsHub()
+        hub.start = mock.Mock()
+        sent = self.run_stream(
+            make_scope(headers=[(b'authorization', f'Bearer {self.token}'.encode())]),
+            hub,
+            lambda sent: len(sent) == 3
+        )
+        self.assertEqual(sent[2]['body'], b': heartbeat\n\n')
+
+    def test_unauthorized(self):
+        hub = ReadingsHub()
+        hub.start = mock.Mock()
+        sent = self.run_stream(make_scope(b'token=foo'), hub)
+        self.assertEqual(sent[0]['status'], 401)
+        sent = self.run_stream(make_scope(f'ids=abba,foo&token={self.token}'.encode()), hub)
+        self.assertEqual(sent[0]['status'], 404)
+        hub.start.assert_not_called()
@@ -4,10 +4,12 @@ from django.test import TestCase
 
 from sensor.constants import SENSOR_DATA_URI, WEATHER_DATA_URI, EXTERNAL_API_TIMEOUT
 from sensor.tasks import (
+    fetch_all_sensors,
     fetch_sensor_data,
     fetch_weather,
-    update_statistics,
-    update_helsinki_temperature
+    update_helsinki_temperature,
+    save_weather_reading,
+    flush_sensor_events
 )
 
 
@@ -16,34 +18,34 @@ class MockResponse:
     Class to mock requests.Response objects,
     feel free to adjust it to match the use case
     """
-    def __init__(self, json_data):
+    def __init__(self, json_data, status_code=200):
         self.json_data = json_data
+        self.status_code = status_code
 
     def json(self):
         return self.json_data
 
     @property
     def ok(self):
-        return True
+        return self.status_code < 400
 
 
 class SensorTasksTest(TestCase):
-    @mock.patch(
-        'requests.get',
-        return_value=MockResponse(
+    @mock.patch('sensor.tasks.get_session')
+    @mock.patch('sensor.tasks.ingest_buffer')
+    def test_fetch_sensor_data(self, mock_buffer, get_session_mock):
+        """
+        Http request to fetch sensor data is sent to the correct URI
+        and the reading is put to the ingest buffer
+        """
+        get_mock = get_session_mock.return_value.get
+        get_mock.return_value = MockResponse(
             json_data={
                 "id": "iddqd",
                 "data": 23.91569438663249,
                 "timestamp": 1530127249766
             }
         )
-    )
-    @mock.patch('sensor.tasks.sensor_fetched.send')
-    def test_fetch_sensor_data(self, signal_sent_mock, get_mock):
-        """
-        Http request to fetch sensor data is sent to the correct URI
-        and sensor_fetched signal is fired
-        """
         sensor_id = 'iddqd'
         fetch_sensor_data(sensor_id)
         get_mock.assert_called_once_with(
@@ -51,30 +53,26 @@ class SensorTasksTest(TestCase):
             timeout=EXTERNAL_API_TIMEOUT
         )
 
-        kwargs_to_send_signal_with = {
-            'sender': fetch_sensor_data,
-            'sensor_id': 'iddqd',
-            'timestamp': 1530127249766,
-            'value': 23.91569438663249
-        }
-        signal_sent_mock.assert_called_once_with(
-            **kwargs_to_send_signal_with
+        mock_buffer.add.assert_called_once_with(
+            'iddqd',
+            1530127249766,
+            23.91569438663249
         )
 
-    @mock.patch(
-        'requests.get',
-        return_value=MockResponse(
-            json_data={
-                "temperature": 22.19
-            }
-        )
-    )
+    @mock.patch('sensor.tasks.time.time', return_value=1530127249.5)
+    @mock.patch('sensor.tasks.get_session')
     @mock.patch('sensor.tasks.weather_fetched.send')
-    def test_fetch_weather_data(self, signal_sent_mock, get_mock):
+    def test_fetch_weather_data(self, signal_sent_mock, get_session_mock, time_mock):
         """
         Http request to fetch weather is sent to the correct URI
         and weather_fetched signal is fired
         """
+        get_mock = get_session_mock.return_value.get
+        get_mock.return_value = MockResponse(
+            json_data={
+                "temperature": 22.19
+            }
+        )
         fetch_weather()
         get_mock.assert_called_once_with(
             WEATHER_DATA_URI,
@@ -84,27 +82,12 @@ class SensorTasksTest(TestCase):
         kwargs_to_send_signal_with = {
             'sender': fetch_weather,
             'temperature': 22.19,
+            'timestamp': 1530127249
         }
         signal_sent_mock.assert_called_once_with(
             **kwargs_to_send_signal_with
         )
 
-    @mock.patch('sensor.models.SensorManager.update_sensor_statistics')
-    def test_update_statistics_handler(self, mock_sensor_update):
-        """
-        update_statistics calls SensorManager.update_sensor_statistics
-        """
-        update_statistics(
-            'some_sender',
-            'iddqd',
-            1530127249766,
-            23.91569438663249
-        )
-        mock_sensor_update.assert_called_once_with(
-            "iddqd",
-            23.91569438663249,
-        )
-
     @mock.patch('sensor.models.SensorManager.update_helsinki_temperature')
     def test_update_weather_handler(self, mock_helsinki_update):
         """
@@ -115,3 +98,48 @@ class SensorTasksTest(TestCase):
         mock_helsinki_update.assert_called_once_with(
             temp
         )
+
+    @mock.patch('sensor.models.SensorManager.write_weather')
+    def test_save_weather_handler(self, mock_write_weather):
+        """
+        save_weather_reading stores the reading with SensorManager.write_weather
+        """
+        save_weather_reading('some_sender', 22.19, 1530127249)
+        mock_write_weather.assert_called_once_with(1530127249, 22.19)
+
+    @mock.patch('sensor.tasks.ingest_buffer')
+    def test_flush_sensor_events_on_shutdown(self, mock_buffer):
+        """
+        flush_sensor_events flushes the ingest buffer
+        """
+        flush_sensor_events()
+        mock_buffer.flush.assert_called_once_with()
+
+    @mock.patch('sensor.tasks.SUPPORTED_SENSORS', ['iddqd', 'abba', 'foo'])
+    @mock.patch('sensor.tasks.get_session')
+    @mock.patch('sensor.tasks.ingest_buffer')
+    def test_fetch_all_sensors(self, mock_buffer, get_session_mock):
+        """
+        fetch_all_sensors polls all supported sensors and puts readings
+        of the ones that responded to the ingest buffer at once
+        """
+        responses = {
+            SENSOR_DATA_URI.format(sensor_id='iddqd'): MockResponse(
+                {"id": "iddqd", "data": 23.91569438663249, "timestamp": 1530127249766}
+            ),
+            SENSOR_DATA_URI.format(sensor_id='abba'): MockResponse(
+                {"id": "abba", "data": 24.1, "timestamp": 1530127249767}
+            ),
+            SENSOR_DATA_URI.format(sensor_id='foo'): MockResponse({}, status_code=404)
+        }
+        get_session_mock.return_value.get.side_effect = (
+            lambda uri, timeout: responses[uri]
+        )
+        fetch_all_sensors()
+        self.assertEqual(get_session_mock.return_value.get.call_count, 3)
+        mock_buffer.extend.assert_called_once_with(
+            [
+                ('iddqd', 1530127249766, 23.91569438663249),
+                ('abba', 1530127249767, 24.1)
+            ]
+        )
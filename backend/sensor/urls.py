@@ -1,5 +1,14 @@
 from django.urls import path
-from sensor.views import sensor_statistics, temperature_difference
+from sensor.views import (
+    sensor_diff_history,
+    sensor_export,
+    sensor_ingest,
+    sensor_range_statistics,
+    sensor_series,
+    sensor_statistics,
+    temperature_difference,
+    temperature_differences
+)
 
 
 urlpatterns = [
@@ -8,6 +17,36 @@ urlpatterns = [
         temperature_difference,
         name='temperature_difference'
     ),
+    path(
+        'diff/',
+        temperature_differences,
+        name='temperature_differences'
+    ),
+    path(
+        'ingest/',
+        sensor_ingest,
+        name='sensor_ingest'
+    ),
+    path(
+        '<str:sensor_id>/stats/',
+        sensor_range_statistics,
+        name='sensor_range_statistics'
+    ),
+    path(
+        '<str:sensor_id>/series/',
+        sensor_series,
+        name='sensor_series'
+    ),
+    path(
+        '<str:sensor_id>/diff-history/',
+        sensor_diff_history,
+        name='sensor_diff_history'
+    ),
+    path(
+        '<str:sensor_id>/export/',
+        sensor_export,
+        name='sensor_export'
+    ),
     path(
         '',
         sensor_statistics,
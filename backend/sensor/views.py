@@ -1,22 +1,280 @@
-from django.http import JsonResponse, Http404
+import json
+import math
+import time
 
+from django.http import HttpResponse, JsonResponse, Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from sensor import export
+from sensor.constants import (
+    INGEST_MAX_BATCH_SIZE,
+    INGEST_MAX_CLOCK_SKEW,
+    ROLLUP_LEVELS,
+    SUPPORTED_SENSORS,
+    SUPPORTED_SENSOR_IDS,
+    SERIES_DEFAULT_POINTS,
+    SERIES_MAX_POINTS
+)
 from sensor.models import SensorManager
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import ValidationError
+
+
+# same body as rest_framework responses to Http404
+NOT_FOUND = {'detail': 'Not found.'}
 
 
 @api_view()
 def sensor_statistics(request):
-    stats = SensorManager.get_statistics()
-    return JsonResponse({'sensors': stats})
+    """
+    Statistics of all sensors serialized by ingest,
+    polling clients get 304 until they change
+    """
+    return statistics_document_response(request)
+
+
+def statistics_document_response(request):
+    """
+    Response of the statistics endpoint, shared with sensor.fastpath
+    """
+    body, version, modified = SensorManager.get_statistics_document()
+    etag = f'"{version}"'
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(modified)
+    return get_conditional_response(
+        request, etag=etag, last_modified=int(modified), response=response
+    )
 
 
 @api_view()
 def temperature_difference(request, sensor_id):
+    if sensor_id not in SUPPORTED_SENSOR_IDS:
+        raise Http404('No such sensor')
     temp = SensorManager.get_helsinki_temp_diff(sensor_id)
-    if temp:
+    if temp is not None:
         payload = {
             "differenceInCelsius": temp
         }
         return JsonResponse(payload)
     else:
         raise Http404('No such sensor')
+
+
+@api_view()
+def temperature_differences(request):
+    """
+    Temperature difference of several sensors, ?ids=a,b,c or ?ids=all,
+    null for sensors without data
+    """
+    return JsonResponse(temperature_differences_payload(request.GET))
+
+
+def parse_sensor_ids(params):
+    """
+    Read ids query param, a comma separated list of sensors or all
+    """
+    ids = params.get('ids')
+    if not ids:
+        raise ValidationError('ids must be a comma separated list of sensors or all')
+    if ids == 'all':
+        return SUPPORTED_SENSORS
+    sensor_ids = list(dict.fromkeys(ids.split(',')))
+    if not SUPPORTED_SENSOR_IDS.issuperset(sensor_ids):
+        raise Http404('No such sensor')
+    return sensor_ids
+
+
+def temperature_differences_payload(params):
+    """
+    Payload of the batch temperature difference endpoint, shared with sensor.fastpath
+    """
+    diffs = SensorManager.get_helsinki_temp_diffs(parse_sensor_ids(params))
+    return {
+        'sensors': [
+            {'id': sensor_id, 'differenceInCelsius': diff}
+            for sensor_id, diff in diffs.items()
+        ]
+    }
+
+
+def parse_time_range(params):
+    """
+    Read from/to query params (unix epoch, seconds or milliseconds),
+    the window is [from, to) and defaults to everything until now
+    """
+    try:
+        start = int(params.get('from', 0))
+        end = int(params.get('to', time.time()))
+    except ValueError:
+        raise ValidationError('from and to must be unix timestamps')
+    start = SensorManager.to_seconds(start)
+    end = SensorManager.to_seconds(end)
+    if start >= end:
+        raise ValidationError('from must be less than to')
+    return start, end
+
+
+def format_aggregate(count, total, min_value, max_value):
+    return {
+        'count': count,
+        'avgTemp': total / count if count else None,
+        'minTemp': min_value,
+        'maxTemp': max_value
+    }
+
+
+@api_view()
+def sensor_range_statistics(request, sensor_id):
+    return JsonResponse(range_statistics(sensor_id, request.GET))
+
+
+def range_statistics(sensor_id: str, params):
+    """
+    Payload of the range statistics endpoint,
+    shared with its async version in sensor.async_views
+    """
+    if sensor_id not in SUPPORTED_SENSOR_IDS:
+        raise Http404('No such sensor')
+    start, end = parse_time_range(params)
+    bucket = params.get('bucket')
+    payload = {
+        'id': sensor_id,
+        'from': start,
+        'to': end
+    }
+    if bucket is None:
+        payload.update(
+            format_aggregate(*SensorManager.aggregate_range(sensor_id, start, end))
+        )
+    elif bucket in ROLLUP_LEVELS:
+        payload['bucket'] = bucket
+        payload['buckets'] = [
+            dict(time=bucket_start, **format_aggregate(*aggregate))
+            for bucket_start, *aggregate in SensorManager.aggregate_range_buckets(
+                sensor_id, start, end, bucket
+            )
+        ]
+    else:
+        raise ValidationError(f'bucket must be one of {", ".join(ROLLUP_LEVELS)}')
+    return payload
+
+
+@api_view()
+def sensor_series(request, sensor_id):
+    """
+    Readings of a sensor downsampled to a fixed number of points,
+    method is either lttb (default) or minmax
+    """
+    if sensor_id not in SUPPORTED_SENSOR_IDS:
+        raise Http404('No such sensor')
+    start, end = parse_time_range(request.GET)
+    method = request.GET.get('method', 'lttb')
+    if method not in ('lttb', 'minmax'):
+        raise ValidationError('method must be one of lttb, minmax')
+    try:
+        points = int(request.GET.get('points', SERIES_DEFAULT_POINTS))
+    except ValueError:
+        raise ValidationError('points must be a number')
+    if not 3 <= points <= SERIES_MAX_POINTS:
+        raise ValidationError(f'points must be between 3 and {SERIES_MAX_POINTS}')
+    return JsonResponse({
+        'id': sensor_id,
+        'from': start,
+        'to': end,
+        'method': method,
+        'points': SensorManager.get_series(sensor_id, start, end, points, method)
+    })
+
+
+@api_view()
+def sensor_export(request, sensor_id):
+    """
+    Stream raw readings of a sensor as csv (default), ndjson or arrow
+    """
+    if sensor_id not in SUPPORTED_SENSOR_IDS:
+        raise Http404('No such sensor')
+    start, end = parse_time_range(request.GET)
+    # ?format= is reserved by DRF content negotiation
+    export_format = request.GET.get('output', 'csv')
+    if not export.is_available(export_format):
+        raise ValidationError(f'output must be one of {", ".join(export.FORMATS)}')
+    content_type, serializer = export.FORMATS[export_format]
+    response = StreamingHttpResponse(
+        serializer(sensor_id, SensorManager.iter_readings(sensor_id, start, end)),
+        content_type=content_type
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="{sensor_id}-{start}-{end}.{export_format}"'
+    )
+    return response
+
+
+@api_view()
+def sensor_diff_history(request, sensor_id):
+    """
+    Stream difference between every reading of a sensor and
+    helsinki temperature at the time of the reading as ndjson
+    """
+    if sensor_id not in SUPPORTED_SENSOR_IDS:
+        raise Http404('No such sensor')
+    start, end = parse_time_range(request.GET)
+    return StreamingHttpResponse(
+        export.temp_diff_ndjson_chunks(SensorManager.iter_temp_diffs(sensor_id, start, end)),
+        content_type='application/x-ndjson'
+    )
+
+
+def parse_readings(body: bytes, content_type: str):
+    """
+    Read a batch of {id, timestamp, value} readings from a json array
+    or from ndjson (one reading per line) into (sensor_id, timestamp, value) tuples
+
+    Readings are checked by hand rather than with a serializer,
+    as serializer instance per reading is way too slow for large batches
+    """
+    try:
+        if content_type == 'application/x-ndjson':
+            readings = [
+                json.loads(line) for line in body.splitlines() if line.strip()
+            ]
+        else:
+            readings = json.loads(body)
+    except ValueError:
+        raise ValidationError('Body must be a json array or ndjson')
+    if not isinstance(readings, list):
+        raise ValidationError('Body must be a json array or ndjson')
+    if not readings:
+        raise ValidationError('No readings')
+    if len(readings) > INGEST_MAX_BATCH_SIZE:
+        raise ValidationError(f'At most {INGEST_MAX_BATCH_SIZE} readings per request')
+
+    latest = time.time() + INGEST_MAX_CLOCK_SKEW
+    events = []
+    for i, reading in enumerate(readings):
+        try:
+            sensor_id = reading['id']
+            timestamp = reading['timestamp']
+            value = reading['value']
+        except (TypeError, KeyError):
+            raise ValidationError(f'Reading {i} must have id, timestamp and value')
+        # unhashable ids can't be looked up in the set
+        if not isinstance(sensor_id, str) or sensor_id not in SUPPORTED_SENSOR_IDS:
+            raise ValidationError(f'Reading {i} has unknown sensor id')
+        # exact type checks, bool is a subclass of int
+        if type(timestamp) is not int or not 0 < SensorManager.to_seconds(timestamp) <= latest:
+            raise ValidationError(f'Reading {i} timestamp must be a unix timestamp')
+        if type(value) not in (int, float) or not math.isfinite(value):
+            raise ValidationError(f'Reading {i} value must be a number')
+        events.append((sensor_id, timestamp, value))
+    return events
+
+
+@api_view(['POST'])
+def sensor_ingest(request):
+    """
+    Store a batch of readings pushed by sensors in one transaction
+    """
+    events = parse_readings(request.body, request.content_type)
+    return JsonResponse({'ingested': SensorManager.ingest(events)})
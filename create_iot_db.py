@@ -1,65 +1,201 @@
-"""Create and populate iot_db.sqlite database"""
-
+"""Create and populate iot_db.sqlite database
+
+Every sensor is generated in its own process into a temporary shard
+database, shards are then copied into the main database in one
+transaction each and the index is built after the data is loaded.
+Run with --help to see how to change the size of the dataset.
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
 import sqlite3
+import tempfile
 import time
-import random
+
+import numpy as np
 
 SENSORS = ['abba', 'acdc', 'iddqd', 'idkfa']
 DB_NAME = 'iot_db.sqlite'
 ITEM_COUNT = 12500000
+# rows generated and inserted at once, bounds memory usage of a worker
+CHUNK_SIZE = 1000000
 # Time is stored to databse in unix epoch
 # To convert it in sql queries you might need to use
 # e.g. datetime(time, 'unixepoch')
 INITIAL_TIME = int(time.time())
+# seconds between two data points
+INTERVAL = 5
+INITIAL_TEMPERATURE = 22
+MIN_TEMPERATURE = 16
+MAX_TEMPERATURE = 29
+# max change of temperature between two data points
+STEP = 0.005
+
+# loading is a one-off job, durability doesn't matter until it's finished
+LOAD_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=OFF',
+]
 
 
-def init_db():
-    """Re-create database tables and indexes"""
+def init_db(db_name):
+    """Re-create database tables, the index is created after the data is loaded"""
 
-    conn = sqlite3.connect(DB_NAME)
+    conn = sqlite3.connect(db_name)
     cursor = conn.cursor()
     cursor.execute('DROP TABLE IF EXISTS datas')
     cursor.execute('CREATE TABLE datas (id TEXT, time TIMESTAMP, value REAL)')
-    cursor.execute('CREATE INDEX main_idx on datas (id, time)')
     conn.commit()
     conn.close()
 
 
-def insert_data(sensor_id):
-    """Insert ITEM_COUNT rows of data for sensor_id"""
+def create_index(db_name):
+    conn = sqlite3.connect(db_name)
+    conn.execute('CREATE INDEX main_idx on datas (id, time)')
+    conn.commit()
+    conn.close()
+
+
+def reflect(walk):
+    """Fold a random walk into [MIN_TEMPERATURE, MAX_TEMPERATURE]
 
-    def calculate_value(initial):
-        """Add or reduce value with 0.005, but keep between 16 and 29"""
-        mod = random.uniform(-0.005, 0.005)
-        # Keep value between 16 and 29
-        if 16 < initial + mod > 29:
-            return initial - mod
-        else:
-            return initial + mod
+    Same as bouncing off the bounds on every step, unlike clipping
+    the walk doesn't get stuck at a bound
+    """
+    width = MAX_TEMPERATURE - MIN_TEMPERATURE
+    folded = np.mod(walk - MIN_TEMPERATURE, 2 * width)
+    return MIN_TEMPERATURE + width - np.abs(folded - width)
 
-    conn = sqlite3.connect(DB_NAME, timeout=30.0)
-    cursor = conn.cursor()
 
-    temperature = 22
-    items = []
+def generate_data(item_count, seed=None, chunk_size=CHUNK_SIZE):
+    """Yield (times, temperatures) arrays of at most chunk_size data points
+
+    Temperature changes by at most STEP between two points,
+    time goes backwards from INITIAL_TIME by INTERVAL seconds
+    """
+
+    random = np.random.RandomState(seed)
+    walk = float(INITIAL_TEMPERATURE)
     current_time = INITIAL_TIME
 
-    for _ in range(0, ITEM_COUNT):
+    for offset in range(0, item_count, chunk_size):
+        size = min(chunk_size, item_count - offset)
+        walks = walk + np.cumsum(random.uniform(-STEP, STEP, size))
+        walk = walks[-1]
         # Reduce time with x seconds for each data point
-        current_time = current_time - 5
-        temperature = calculate_value(temperature)
-        items.append((sensor_id, current_time, temperature))
+        times = current_time - INTERVAL * np.arange(1, size + 1, dtype=np.int64)
+        current_time = int(times[-1])
+        yield times, reflect(walks)
+
+
+def insert_data(sensor_id, db_name, item_count, seed=None, chunk_size=CHUNK_SIZE):
+    """Insert item_count rows of data for sensor_id"""
+
+    conn = sqlite3.connect(db_name, timeout=30.0)
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    with conn:
+        for times, temperatures in generate_data(item_count, seed, chunk_size):
+            conn.executemany(
+                'INSERT INTO datas VALUES (?,?,?)',
+                zip(itertools.repeat(sensor_id), times.tolist(), temperatures.tolist())
+            )
+    conn.close()
 
-    cursor.executemany('INSERT INTO datas VALUES (?,?,?)', items)
-    conn.commit()
+
+def write_shard(sensor_id, shard_name, item_count, seed=None, chunk_size=CHUNK_SIZE):
+    """Generate data of a sensor into its own database, runs in a worker process"""
+
+    init_db(shard_name)
+    insert_data(sensor_id, shard_name, item_count, seed, chunk_size)
+    return shard_name
+
+
+def merge_shard(db_name, shard_name):
+    """Copy rows of a shard into the main database in a single transaction"""
+
+    conn = sqlite3.connect(db_name, timeout=30.0)
+    for pragma in LOAD_PRAGMAS:
+        conn.execute(pragma)
+    conn.execute('ATTACH DATABASE ? AS shard', (shard_name,))
+    with conn:
+        conn.execute('INSERT INTO datas SELECT * FROM shard.datas')
+    conn.execute('DETACH DATABASE shard')
     conn.close()
 
 
+def create_db(db_name=DB_NAME, sensors=SENSORS, item_count=ITEM_COUNT,
+              workers=None, seed=None, chunk_size=CHUNK_SIZE):
+    init_db(db_name)
+    shard_dir = os.path.dirname(os.path.abspath(db_name))
+    with tempfile.TemporaryDirectory(dir=shard_dir) as tmp_dir:
+        shards = [
+            (
+                sensor_id,
+                os.path.join(tmp_dir, f'{sensor_id}.sqlite'),
+                item_count,
+                None if seed is None else seed + i,
+                chunk_size
+            )
+            for i, sensor_id in enumerate(sensors)
+        ]
+        with multiprocessing.Pool(workers) as pool:
+            results = [pool.apply_async(write_shard, shard) for shard in shards]
+            # shards are merged in order as soon as they are ready
+            for result in results:
+                shard_name = result.get()
+                merge_shard(db_name, shard_name)
+                os.remove(shard_name)
+    create_index(db_name)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--items',
+        type=int,
+        default=ITEM_COUNT,
+        help=f'Rows per sensor (default: {ITEM_COUNT})',
+    )
+    parser.add_argument(
+        '--sensors',
+        nargs='+',
+        default=SENSORS,
+        help=f'Sensor ids (default: {" ".join(SENSORS)})',
+    )
+    parser.add_argument(
+        '--db',
+        default=DB_NAME,
+        help=f'Database file (default: {DB_NAME})',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of processes generating data (default: CPU count)',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=None,
+        help='Random seed to get the same data on every run',
+    )
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
-    init_db()
+    args = parse_args()
 
     start_time = time.time()
 
-    [insert_data(x) for x in SENSORS]
+    create_db(
+        db_name=args.db,
+        sensors=args.sensors,
+        item_count=args.items,
+        workers=args.workers,
+        seed=args.seed,
+    )
 
     print("--- %s seconds ---" % (time.time() - start_time))